@@ -3,6 +3,11 @@ ASGI config for Giftmarket project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The vendor event stream (``/api/async/vendor/events/``) is only served
+under ASGI, e.g.::
+
+    uvicorn Giftmarket.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
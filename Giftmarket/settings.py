@@ -36,6 +36,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # Trusted proxies in front of the app. With 0, throttles key clients
+    # on REMOTE_ADDR and ignore the client-supplied X-Forwarded-For.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
+}
+
+# Token-bucket budgets for the public API (see shop/throttling.py):
+# refill rate plus the burst a client may spend at once.
+THROTTLE_BUCKETS = {
+    'public_ip': {'rate': '5/s', 'burst': 30},
+    'public_user': {'rate': '10/s', 'burst': 60},
+    'public_endpoint': {'rate': '200/s', 'burst': 400},
 }
 
 
@@ -43,15 +54,24 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = 'shop.User'
 
+# Loads the session user together with their vendor profile in one query.
+AUTHENTICATION_BACKENDS = [
+    'shop.backends.VendorProfileBackend',
+]
+
 
 # MIDDLEWARE (REQUIRED BY ADMIN)
 
 MIDDLEWARE = [
+    'shop.middleware.RequestIdMiddleware',
+    'shop.middleware.MetricsMiddleware',
+    'shop.middleware.RequestProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.middleware.GuestCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -108,6 +128,98 @@ DATABASES = {
     }
 }
 '''
+# Completed/cancelled orders older than this move to the archive tables
+# (manage.py archive_orders).
+ORDER_ARCHIVE_AFTER_DAYS = 365
+
+# Pending orders (carts) idle this long are deleted
+# (manage.py purge_abandoned_carts).
+CART_ABANDON_AFTER_DAYS = 30
+
+# Time every signal receiver (see shop.profiling); off by default. Each
+# process writes its totals to SIGNAL_PROFILE_DIR for
+# manage.py signal_profile (shared by all servers, if there are several).
+SIGNAL_PROFILING = os.environ.get('SIGNAL_PROFILING') == '1'
+SIGNAL_PROFILE_DIR = (os.environ.get('SIGNAL_PROFILE_DIR')
+                      or BASE_DIR / 'signal_profile')
+
+# Autocomplete index snapshot (manage.py autocomplete_snapshot); each
+# worker loads it at startup instead of a full rebuild when present.
+AUTOCOMPLETE_SNAPSHOT = BASE_DIR / 'autocomplete.snapshot.json'
+# Start loading the index on a worker's first request, before any search.
+AUTOCOMPLETE_WARM_UP = True
+
+# Vendor event stream broker (see shop.events). Use
+# 'shop.events.CacheBroker' with a shared cache for several workers.
+EVENT_BROKER = {
+    'BACKEND': 'shop.events.InProcessBroker',
+    'OPTIONS': {'buffer_size': 1000},
+}
+
+# LOGGING
+# JSON lines on stderr, written by a background thread (see shop.log) so
+# requests never block on log I/O. DEBUG records from the shop are kept
+# for LOG_DEBUG_SAMPLE_RATE of requests.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'shop.log.RequestIdFilter'},
+        'sample_debug': {'()': 'shop.log.SampleDebugFilter',
+                         'rate': LOG_DEBUG_SAMPLE_RATE},
+    },
+    'handlers': {
+        'queue': {
+            '()': 'shop.log.QueueingHandler',
+            'target': 'logging.StreamHandler',
+            'queue_size': 10000,
+            'filters': ['request_id', 'sample_debug'],
+        },
+    },
+    'root': {'handlers': ['queue'], 'level': LOG_LEVEL},
+    'loggers': {
+        'django': {'handlers': ['queue'], 'level': 'INFO',
+                   'propagate': False},
+        'shop': {'level': 'DEBUG'},
+    },
+}
+
+# Prometheus metrics at /metrics (see shop.metrics). With several worker
+# processes, point METRICS_DIR at a directory they share (emptied on
+# deploy) so /metrics reports all of them. Scrapes are allowed from
+# METRICS_ALLOWED_IPS and from staff users.
+METRICS_ENABLED = True
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Chunked image uploads (see shop.uploads): temporary chunk files (a
+# shared volume when running several servers), largest accepted file,
+# longest edge of stored images, and how long idle sessions are kept
+# (manage.py process_uploads).
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'upload_tmp'
+CHUNKED_UPLOAD_MAX_SIZE = 25 * 1024 * 1024
+UPLOAD_IMAGE_MAX_EDGE = 2048
+CHUNKED_UPLOAD_SESSION_HOURS = 24
+
+# Public store/product lists are cached per version (see
+# shop.listing_cache): fresh for LISTING_CACHE_TTL seconds, then served
+# stale while one request recomputes, for up to LISTING_CACHE_STALE_TTL.
+LISTING_CACHE_TTL = 60
+LISTING_CACHE_STALE_TTL = 60 * 10
+
+# CACHE
+# Local memory by default; point this at Redis/Memcached in production so
+# throttles and cached data are shared between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'giftmarket',
+    }
+}
+
 # PASSWORD VALIDATORS
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -13,6 +13,7 @@ urlpatterns = [
     path('shop/', include('shop.urls')),   # shop app urls
     path('accounts/', include('django.contrib.auth.urls')),  # auth urls
     path('api/', include('shop.api_urls')),
+    path('metrics', views.metrics_view, name='metrics'),  # Prometheus
 
 
     # Optional: explicit login/logout
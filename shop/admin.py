@@ -1,10 +1,224 @@
-"""module for registering admin models in the Giftmarket application."""
-from django.contrib import admin
-from .models import User, VendorProfile, Product, Order, OrderItem, Review
-
-admin.site.register(User)
-admin.site.register(VendorProfile)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
-admin.site.register(Review)
+"""module for registering admin models in the Giftmarket application.
+
+The order, product and review tables run to millions of rows, so every
+changelist here:
+
+* joins the relations its ``__str__``/columns use (``list_select_related``)
+* edits foreign keys with autocomplete or raw-id widgets, never a
+  dropdown of every user or product
+* pages with ``EstimatedCountPaginator`` and skips the full-table count
+* filters the large tables only on indexed columns
+"""
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.urls import reverse
+from django.utils.text import Truncator
+from .models import (User, VendorProfile, Store, Product, Order, OrderItem,
+                     Review)
+from .order_status import bulk_transition
+from .pagination import EstimatedCountPaginator
+
+STATUS_BATCH_SIZE = 1000
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Defaults for changelists over large tables."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ('-id',)  # primary key order, also for autocomplete
+
+
+# -----------------------------
+# USERS AND VENDORS
+# -----------------------------
+
+@admin.register(User)
+class UserAdmin(BaseUserAdmin):
+    """Django's user admin with the role field."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_display = ('username', 'email', 'role', 'is_staff', 'date_joined')
+    list_filter = ('role', 'is_staff', 'is_superuser', 'is_active')
+    fieldsets = BaseUserAdmin.fieldsets + (('Role', {'fields': ('role',)}),)
+    add_fieldsets = BaseUserAdmin.add_fieldsets + (
+        ('Role', {'fields': ('role',)}),)
+
+
+@admin.register(VendorProfile)
+class VendorProfileAdmin(ScalableAdmin):
+    """Vendor profiles, with bulk verification."""
+    list_display = ('store_name', 'user', 'verified', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('verified',)
+    search_fields = ('store_name', 'user__username')
+    raw_id_fields = ('user',)
+    actions = ('mark_verified', 'mark_unverified')
+
+    @admin.action(description='Mark selected vendors as verified')
+    def mark_verified(self, request, queryset):
+        """Verify vendors with one UPDATE."""
+        updated = queryset.update(verified=True)
+        self.message_user(request, f"{updated} vendor(s) verified.")
+
+    @admin.action(description='Mark selected vendors as unverified')
+    def mark_unverified(self, request, queryset):
+        """Withdraw verification with one UPDATE."""
+        updated = queryset.update(verified=False)
+        self.message_user(request, f"{updated} vendor(s) unverified.")
+
+
+@admin.register(Store)
+class StoreAdmin(ScalableAdmin):
+    """Stores; also backs the store autocomplete on products."""
+    list_display = ('name', 'vendor', 'updated_at')
+    list_select_related = ('vendor',)
+    search_fields = ('name',)
+    raw_id_fields = ('vendor',)
+
+
+# -----------------------------
+# CATALOG
+# -----------------------------
+
+@admin.register(Product)
+class ProductAdmin(ScalableAdmin):
+    """Products; also backs the product autocomplete elsewhere."""
+    list_display = ('name', 'store', 'price', 'stock', 'updated_at')
+    list_select_related = ('store',)
+    search_fields = ('name',)
+    autocomplete_fields = ('store',)
+
+    def get_queryset(self, request):
+        """``__str__`` shows the store, also in autocomplete results."""
+        return super().get_queryset(request).select_related('store')
+
+
+@admin.register(Review)
+class ReviewAdmin(ScalableAdmin):
+    """Reviews, with bulk verification changes."""
+    list_display = ('__str__', 'rating', 'created_at')
+    list_select_related = ('user', 'product')
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('product',)
+    actions = ('mark_verified', 'mark_unverified')
+
+    @admin.action(description='Mark selected reviews as verified purchases')
+    def mark_verified(self, request, queryset):
+        """Flag reviews as verified with one UPDATE."""
+        updated = queryset.update(verified_purchase=True)
+        self.message_user(request, f"{updated} review(s) marked verified.")
+
+    @admin.action(description='Mark selected reviews as unverified')
+    def mark_unverified(self, request, queryset):
+        """Clear the verified flag with one UPDATE."""
+        updated = queryset.update(verified_purchase=False)
+        self.message_user(request, f"{updated} review(s) marked unverified.")
+
+
+# -----------------------------
+# ORDERS
+# -----------------------------
+
+def set_order_status(queryset, status):
+    """
+    Move the orders in ``queryset`` to ``status`` in batches.
+
+    Goes through the state machine in ``shop.order_status``: one
+    conditional UPDATE and one event per vendor per batch. Returns
+    ``(changed, rejected)`` counts.
+    """
+    order_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    changed = rejected = 0
+    for start in range(0, len(order_ids), STATUS_BATCH_SIZE):
+        moved, refused = bulk_transition(
+            order_ids[start:start + STATUS_BATCH_SIZE], status)
+        changed += len(moved)
+        rejected += len(refused)
+    return changed, rejected
+
+
+def _status_action(status):
+    def action(modeladmin, request, queryset):
+        changed, rejected = set_order_status(queryset, status)
+        message = f"{changed} order(s) marked {status}."
+        if rejected:
+            message += f" {rejected} could not move to {status}."
+        modeladmin.message_user(
+            request, message,
+            messages.SUCCESS if changed else messages.WARNING)
+    action.__name__ = f'mark_{status}'
+    return admin.action(description=f'Mark selected orders as {status}')(
+        action)
+
+
+class LoadedRawIdWidget(ForeignKeyRawIdWidget):
+    """Raw-id widget that labels an already loaded object without a query.
+
+    The stock widget fetches its object again for the label, one query
+    per inline row however the inline's queryset was loaded.
+    """
+    loaded = None
+
+    def label_and_url_for_value(self, value):
+        obj = self.loaded
+        if obj is None or str(obj.pk) != str(value):
+            return super().label_and_url_for_value(value)
+        opts = obj._meta
+        url = reverse(f'{self.admin_site.name}:{opts.app_label}_'
+                      f'{opts.model_name}_change', args=(obj.pk,))
+        return Truncator(obj).words(14), url
+
+
+class OrderItemForm(forms.ModelForm):
+    """Hands each line's product to its raw-id widget for the label."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.product_id:
+            self.fields['product'].widget.loaded = self.instance.product
+
+
+class OrderItemInline(admin.TabularInline):
+    """An order's lines, with raw-id product widgets."""
+    model = OrderItem
+    form = OrderItemForm
+    extra = 0
+    raw_id_fields = ('product',)
+
+    def get_queryset(self, request):
+        """Product labels show the store; join both for every line."""
+        return super().get_queryset(request).select_related('product__store')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'product':
+            kwargs['widget'] = LoadedRawIdWidget(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(Order)
+class OrderAdmin(ScalableAdmin):
+    """Orders, with batch status changes."""
+    list_display = ('__str__', 'status', 'total_price', 'created_at',
+                    'placed_at')
+    list_select_related = ('buyer',)
+    list_filter = ('status',)  # indexed by order_status_id
+    search_fields = ('=id', 'buyer__username')
+    raw_id_fields = ('buyer',)
+    inlines = (OrderItemInline,)
+    actions = tuple(_status_action(status)
+                    for status in ('shipped', 'completed', 'cancelled'))
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(ScalableAdmin):
+    """Order lines."""
+    list_display = ('__str__', 'order', 'price', 'updated_at')
+    list_select_related = ('product', 'order__buyer')
+    search_fields = ('=order__id',)
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('product',)
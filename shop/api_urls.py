@@ -28,6 +28,35 @@ urlpatterns = [
         api_views.VendorStoreListView.as_view(),
         name='api_vendor_store_list'
     ),
+    path(
+        'vendor/orders/status/',
+        api_views.VendorOrderStatusView.as_view(),
+        name='api_vendor_order_status'
+    ),
+
+    # -----------------------------
+    # CHUNKED UPLOADS (AUTHENTICATED)
+    # -----------------------------
+    path(
+        'uploads/',
+        api_views.UploadSessionCreateView.as_view(),
+        name='api_upload_create'
+    ),
+    path(
+        'uploads/<uuid:session_id>/',
+        api_views.UploadSessionView.as_view(),
+        name='api_upload_detail'
+    ),
+    path(
+        'uploads/<uuid:session_id>/chunks/<int:number>/',
+        api_views.UploadChunkView.as_view(),
+        name='api_upload_chunk'
+    ),
+    path(
+        'uploads/<uuid:session_id>/complete/',
+        api_views.UploadCompleteView.as_view(),
+        name='api_upload_complete'
+    ),
 
     # -----------------------------
     # PUBLIC (READ-ONLY)
@@ -47,4 +76,48 @@ urlpatterns = [
         api_views.StoreProductListView.as_view(),
         name='api_store_products'
     ),
+    path(
+        'products/batch/',
+        api_views.ProductBatchView.as_view(),
+        name='api_product_batch'
+    ),
+    path(
+        'availability/',
+        api_views.AvailabilityView.as_view(),
+        name='api_availability'
+    ),
+    path(
+        'autocomplete/',
+        api_views.autocomplete_view,
+        name='api_autocomplete'
+    ),
+    path(
+        'changes/',
+        api_views.CatalogChangesView.as_view(),
+        name='api_catalog_changes'
+    ),
+
+    # -----------------------------
+    # PUBLIC (ASYNC, FOR ASGI DEPLOYMENTS)
+    # -----------------------------
+    path(
+        'async/stores/',
+        api_views.store_list_async,
+        name='api_store_list_async'
+    ),
+    path(
+        'async/vendors/<int:vendor_id>/stores/',
+        api_views.public_vendor_store_list_async,
+        name='api_vendor_store_public_async'
+    ),
+    path(
+        'async/stores/<int:store_id>/products/',
+        api_views.store_product_list_async,
+        name='api_store_products_async'
+    ),
+    path(
+        'async/vendor/events/',
+        api_views.vendor_events,
+        name='api_vendor_events'
+    ),
 ]
@@ -1,22 +1,115 @@
 """Giftmarket Shop API Views"""
 
+import json
+from datetime import datetime, timedelta
+
+from rest_framework.exceptions import Throttled, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from django.db.models import Avg, Count, Q
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Store, Product, Review
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Store, Product, Review, UploadSession
 from .serializers import (
     StoreSerializer,
     ProductSerializer,
-    ReviewSerializer
+    VendorReviewSerializer,
+    product_values_serializer,
+    store_values_serializer
 )
 from .permissions import IsVendor
-from .models import VendorProfile
+from . import (autocomplete, availability, change_feed, listing_cache,
+               order_status, uploads)
+from .backends import get_vendor_profile
+from .catalog_cache import get_product_rows, serialize_product_rows
+from .events import get_broker
+from .pagination import ReviewCursorPagination
+from .popularity import SORTS, sort_by_popularity
+from .throttling import (PUBLIC_THROTTLES, PublicIPThrottle,
+                         PublicUserThrottle, RateLimitHeadersMixin,
+                         add_ratelimit_headers, throttle_wait)
 from rest_framework import generics, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .models import Review as ReviewType
 
+
+def parse_ids(raw, max_ids):
+    """Validate ``"3,1,2"`` or ``[3, 1, 2]`` into unique integer ids."""
+    if isinstance(raw, str):
+        raw = [part for part in raw.split(',') if part.strip()]
+    if not isinstance(raw, list):
+        raise ValidationError({'ids': "Expected a list of ids."})
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw))
+    except (TypeError, ValueError) as exc:
+        raise ValidationError({'ids': "Ids must be integers."}) from exc
+    if not ids:
+        raise ValidationError({'ids': "At least one id is required."})
+    if len(ids) > max_ids:
+        raise ValidationError({'ids': f"At most {max_ids} ids per request."})
+    return ids
+
+
+class ValuesListMixin:
+    """
+    Serve ``list`` from ``.values()`` rows through a ValuesSerializer.
+
+    Output matches ``serializer_class``; used on hot public lists where
+    building model instances and field objects per row dominates CPU.
+    """
+    values_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        """ Return the serialized rows of the filtered queryset. """
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values(*self.values_serializer.columns)
+        return Response(self.values_serializer.serialize(rows, request))
+
+
+class ListingCacheMixin:
+    """
+    Serve ``list`` from the version-keyed cache in ``shop.listing_cache``.
+
+    ``cache_scope`` names the scope and ``cache_scope_kwarg`` the URL
+    kwarg holding its id. ``cache_params`` maps the query parameters the
+    listing reads to their meaningful values; only those make separate
+    entries. Rows come from ``values_serializer`` (see ValuesListMixin).
+    ``X-Cache`` reports HIT, STALE or MISS.
+    """
+    cache_scope = None
+    cache_scope_kwarg = None
+    cache_params = {}
+
+    def list(self, request, *args, **kwargs):
+        """ Return the cached list, recomputing it when out of date. """
+        queryset = self.filter_queryset(self.get_queryset())
+        data, status = cached_list(
+            request, self.values_serializer, queryset, self.cache_scope,
+            self.kwargs[self.cache_scope_kwarg],
+            listing_cache.variant(request.GET, self.cache_params))
+        response = Response(data)
+        response['X-Cache'] = status.upper()
+        return response
+
+
+def cached_list(request, values_serializer, queryset, scope, scope_id,
+                variant):
+    """Return ``(data, status)`` of a listing from ``shop.listing_cache``."""
+    data, status = listing_cache.cached_result(
+        scope, scope_id, variant,
+        lambda: values_serializer.serialize(
+            queryset.values(*values_serializer.columns)))
+    return values_serializer.absolutize(data, request), status
+
+
 # -----------------------------
 # VENDOR: CREATE STORE
 # -----------------------------
@@ -30,17 +123,11 @@ class StoreCreateView(generics.CreateAPIView):
     def perform_create(self, serializer):
         """
         Save the store safely for the logged-in vendor.
-        Automatically creates a VendorProfile if missing.
+        IsVendor guarantees the profile exists and it is already loaded
+        with the user, so no extra lookup is needed.
         """
-
-        # ✅ Safely get or create VendorProfile
-        vendor_profile, created = VendorProfile.objects.get_or_create(
-            user=self.request.user,
-            defaults={'store_name': f"{self.request.user.username}'s Store"}
-        )
-
         # ✅ Save the store linked to this vendor
-        serializer.save(vendor=vendor_profile)
+        serializer.save(vendor=get_vendor_profile(self.request.user))
 
 
 # -----------------------------
@@ -56,11 +143,8 @@ class ProductCreateView(generics.CreateAPIView):
     def perform_create(self, serializer):
         """Save the product safely and post a tweet."""
 
-        # ✅ Always safely get the vendor (prevents duplicates)
-        vendor_profile, _ = VendorProfile.objects.get_or_create(
-            user=self.request.user,
-            defaults={'store_name': f"{self.request.user.username}'s Store"}
-        )
+        # ✅ Profile is guaranteed by IsVendor and loaded with the user
+        vendor_profile = get_vendor_profile(self.request.user)
 
         # ✅ Ensure vendor owns the store
         store = get_object_or_404(
@@ -85,15 +169,94 @@ class ProductCreateView(generics.CreateAPIView):
 
 
 class VendorReviewListView(generics.ListAPIView):
-    """Vendor retrieves reviews for their products."""
-    serializer_class = ReviewSerializer
+    """
+    Vendor retrieves reviews for their products.
+
+    Filters: ``product``, ``rating``, ``verified_purchase`` (true/false),
+    ``created_after`` and ``created_before`` (ISO dates). Results are
+    cursor-paginated newest first, and the response carries a ``summary``
+    of the filtered reviews.
+    """
+    serializer_class = VendorReviewSerializer
     permission_classes = [permissions.IsAuthenticated, IsVendor]
-       
+    pagination_class = ReviewCursorPagination
+
     def get_queryset(self) -> 'ReviewType.objects.__class__':
-        """ Get reviews for products owned by the vendor. """
-        return Review.objects.filter(
-            product__store__vendor=self.request.user.vendor_profile
+        """ Get filtered reviews for products owned by the vendor. """
+        params = self.request.query_params
+        queryset = Review.objects.filter(
+            product__store__vendor=get_vendor_profile(self.request.user)
+        ).select_related('product', 'user')
+
+        filters = {}
+        for param, lookup in (('product', 'product_id'),
+                              ('rating', 'rating')):
+            if params.get(param):
+                try:
+                    filters[lookup] = int(params[param])
+                except ValueError as exc:
+                    raise ValidationError(
+                        {param: "Must be an integer."}) from exc
+        if params.get('verified_purchase'):
+            filters['verified_purchase'] = (
+                params['verified_purchase'].lower() in ('1', 'true', 'yes'))
+        # Whole days, as datetime bounds so the created_at index is used.
+        for param, lookup, days in (('created_after', 'created_at__gte', 0),
+                                    ('created_before', 'created_at__lt', 1)):
+            if params.get(param):
+                value = parse_date(params[param])
+                if value is None:
+                    raise ValidationError(
+                        {param: "Use the YYYY-MM-DD format."})
+                filters[lookup] = timezone.make_aware(
+                    datetime.combine(value + timedelta(days=days),
+                                     datetime.min.time()))
+        return queryset.filter(**filters)
+
+    def get_summary(self, queryset):
+        """
+        Summarise reviews with one aggregate query grouped by product.
+
+        The per-product rows carry their star counts, so overall totals are
+        rolled up from at most one row per product.
+        """
+        rows = list(
+            queryset.order_by().values('product_id', 'product__name')
+            .annotate(
+                count=Count('id'),
+                average=Avg('rating'),
+                **{f'stars_{n}': Count('id', filter=Q(rating=n))
+                   for n in range(1, 6)}
+            )
         )
+        count = sum(row['count'] for row in rows)
+        total = sum(row['average'] * row['count'] for row in rows)
+        return {
+            'count': count,
+            'average_rating': round(total / count, 2) if count else None,
+            'distribution': {
+                str(n): sum(row[f'stars_{n}'] for row in rows)
+                for n in range(1, 6)
+            },
+            'products': [
+                {
+                    'product': row['product_id'],
+                    'product_name': row['product__name'],
+                    'count': row['count'],
+                    'average_rating': round(row['average'], 2),
+                }
+                for row in rows
+            ],
+        }
+
+    def list(self, request, *args, **kwargs):
+        """ Return a page of reviews plus the summary. """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response.data['summary'] = self.get_summary(queryset)
+        return response
 
 
 # -----------------------------
@@ -111,41 +274,466 @@ class VendorStoreListView(generics.ListAPIView):
             )  # type: ignore[attr-defined]
 
 
+# -----------------------------
+# VENDOR: BULK ORDER STATUS
+# -----------------------------
+class VendorOrderStatusView(APIView):
+    """
+    Vendor moves many of their orders to a new status at once.
+
+    ``POST {"ids": [12, 15, 18], "status": "shipped"}`` returns the
+    ``changed`` ids and the ``rejected`` ones with a reason. Only orders
+    made up entirely of the vendor's products can be moved.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsVendor]
+    max_ids = 500
+
+    def post(self, request):
+        """ Apply one status to a batch of orders. """
+        status = request.data.get('status')
+        if not order_status.sources(status):
+            raise ValidationError({'status': "Not a status orders can be "
+                                             "moved to."})
+        ids = parse_ids(request.data.get('ids'), self.max_ids)
+        changed, rejected = order_status.bulk_transition(
+            ids, status, vendor=get_vendor_profile(request.user))
+        return Response({'status': status, 'changed': changed,
+                         'rejected': rejected})
+
+
 # -----------------------------
 # PUBLIC: LIST ALL STORES
 # -----------------------------
-class StoreListView(generics.ListAPIView):
+class StoreListView(RateLimitHeadersMixin, ValuesListMixin,
+                    generics.ListAPIView):
     """Public endpoint: list all stores."""
     queryset = Store.objects.all()
     serializer_class = StoreSerializer
+    values_serializer = store_values_serializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = PUBLIC_THROTTLES
 
 
 # -----------------------------
 # PUBLIC: LIST PRODUCTS IN STORE
 # -----------------------------
-class StoreProductListView(generics.ListAPIView):
+class StoreProductListView(RateLimitHeadersMixin, ListingCacheMixin,
+                           ValuesListMixin, generics.ListAPIView):
     """Public endpoint: list products in a store."""
     serializer_class = ProductSerializer
+    values_serializer = product_values_serializer
+    cache_scope = 'store'
+    cache_scope_kwarg = 'store_id'
+    cache_params = {'sort': tuple(SORTS)}
     permission_classes = [permissions.AllowAny]
+    throttle_classes = PUBLIC_THROTTLES
 
     def get_queryset(self):
-        """"" Get products for the specified store. """
-        return Product.objects.filter(
-            store_id=self.kwargs['store_id']
+        """"" Get products for the specified store.
+
+        ``?sort=trending`` or ``?sort=bestsellers`` orders by popularity.
+        """
+        return sort_by_popularity(
+            Product.objects.filter(store_id=self.kwargs['store_id']),
+            self.request.query_params.get('sort', '')
         )
 
 
-class PublicVendorStoreListView(generics.ListAPIView):
+class PublicVendorStoreListView(RateLimitHeadersMixin, ListingCacheMixin,
+                                ValuesListMixin, generics.ListAPIView):
     """
     Public API view:
     List all stores for a specific vendor.
     """
     serializer_class = StoreSerializer
+    values_serializer = store_values_serializer
+    cache_scope = 'vendor'
+    cache_scope_kwarg = 'vendor_id'
     permission_classes = [permissions.AllowAny]
+    throttle_classes = PUBLIC_THROTTLES
 
     def get_queryset(self):
         """ Get stores for the specified vendor. """
         return Store.objects.filter(
             vendor_id=self.kwargs['vendor_id']
         )
+
+
+# -----------------------------
+# PUBLIC: BATCH PRODUCT LOOKUP
+# -----------------------------
+class ProductBatchView(RateLimitHeadersMixin, APIView):
+    """
+    Public endpoint: fetch many products by id.
+
+    ``GET ?ids=3,1,2`` or ``POST {"ids": [3, 1, 2]}`` for long lists.
+    Results keep the requested order; unknown ids are listed in
+    ``missing``.
+    """
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = PUBLIC_THROTTLES
+    max_ids = 300
+
+    def _parse_ids(self, raw):
+        return parse_ids(raw, self.max_ids)
+
+    def _respond(self, request, ids):
+        rows = get_product_rows(ids)
+        found = [rows[pid] for pid in ids if pid in rows]
+        return Response({
+            'results': serialize_product_rows(found, request),
+            'missing': [pid for pid in ids if pid not in rows],
+        })
+
+    def get(self, request):
+        """ Look up products from the ``ids`` query parameter. """
+        return self._respond(
+            request, self._parse_ids(request.query_params.get('ids', '')))
+
+    def post(self, request):
+        """ Look up products from an ``ids`` list in the body. """
+        return self._respond(request,
+                             self._parse_ids(request.data.get('ids')))
+
+
+# -----------------------------
+# PUBLIC: STOCK AVAILABILITY
+# -----------------------------
+class AvailabilityView(ProductBatchView):
+    """
+    Public endpoint: units available for many products.
+
+    ``GET ?ids=3,1,2`` (or ``POST {"ids": [...]}``) returns
+    ``{"availability": {"3": 12, ...}, "missing": [...]}``. Answered
+    from the cache; only misses reach the database, in one query.
+    """
+    max_ids = 500
+
+    def _respond(self, request, ids):
+        available = availability.get_availability(ids)
+        return Response({
+            'availability': {str(pid): available[pid] for pid in ids
+                             if pid in available},
+            'missing': [pid for pid in ids if pid not in available],
+        })
+
+
+# -----------------------------
+# PUBLIC: AUTOCOMPLETE
+# -----------------------------
+
+def autocomplete_view(request):
+    """
+    Public endpoint: product and store name suggestions for ``?q=``.
+
+    Optional ``?type=product|store`` and ``?limit=`` (max 20). Served
+    from the in-memory index without database access, so only the
+    per-client throttles apply, not the shared endpoint budget.
+    """
+    wait = throttle_wait(request, None,
+                         [PublicIPThrottle, PublicUserThrottle])
+    if wait is not None:
+        exc = Throttled(wait)
+        response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+        response['Retry-After'] = str(exc.wait)
+        return add_ratelimit_headers(request, response)
+
+    kind = request.GET.get('type') or None
+    if kind is not None and kind not in autocomplete.KINDS:
+        return JsonResponse({'type': "Use 'product' or 'store'."},
+                            status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1),
+                    autocomplete.MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'limit': "Must be an integer."}, status=400)
+
+    query = request.GET.get('q', '')[:100]
+    response = JsonResponse({
+        'query': query,
+        'results': autocomplete.search(query, limit, kind),
+    })
+    response['Cache-Control'] = 'public, max-age=60'
+    return add_ratelimit_headers(request, response)
+
+
+# -----------------------------
+# PUBLIC: CATALOG CHANGE FEED
+# -----------------------------
+class CatalogChangesView(RateLimitHeadersMixin, APIView):
+    """
+    Public endpoint: products and stores changed since a cursor.
+
+    Start with no parameters (full catalog) or ``?updated_since=<ISO
+    datetime>``; then pass the returned ``cursor`` back until
+    ``has_more`` is false. Deletions appear as ``"op": "delete"``.
+    """
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = PUBLIC_THROTTLES
+
+    def get(self, request):
+        """ Return the next page of catalog changes. """
+        params = request.query_params
+        try:
+            limit = min(int(params.get('limit', change_feed.DEFAULT_LIMIT)),
+                        change_feed.MAX_LIMIT)
+        except ValueError as exc:
+            raise ValidationError({'limit': "Must be an integer."}) from exc
+        if limit < 1:
+            raise ValidationError({'limit': "Must be positive."})
+
+        if params.get('cursor'):
+            try:
+                positions = change_feed.decode_cursor(params['cursor'])
+            except change_feed.InvalidCursor as exc:
+                raise ValidationError({'cursor': str(exc)}) from exc
+        elif params.get('updated_since'):
+            since = parse_datetime(params['updated_since'])
+            if since is None:
+                raise ValidationError(
+                    {'updated_since': "Use an ISO 8601 datetime."})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            positions = change_feed.initial_cursor(since)
+        else:
+            positions = change_feed.initial_cursor()
+
+        changes, positions, has_more = change_feed.read_changes(
+            positions, limit=limit, request=request)
+        return Response({
+            'changes': changes,
+            'cursor': change_feed.encode_cursor(positions),
+            'has_more': has_more,
+        })
+
+
+# -----------------------------
+# CHUNKED IMAGE UPLOADS
+# -----------------------------
+# Resumable uploads of product images (vendors) and personalization
+# photos (buyers); see shop.uploads for the protocol.
+
+def _upload_payload(session):
+    return {
+        'id': str(session.pk),
+        'target': session.target,
+        'target_id': session.target_id,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'missing': uploads.missing_chunks(session),
+        'status': session.status,
+        'error': session.error,
+    }
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Start an upload.
+
+    ``POST {"target": "product_image", "target_id": 7,
+    "filename": "mug.jpg", "size": 4718592, "sha256": "..."}``
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """ Create a session; chunks are then PUT to it. """
+        data = request.data
+        try:
+            session = uploads.start_session(
+                request.user, data.get('target'), int(data.get('target_id')),
+                str(data.get('filename', '')), int(data.get('size')),
+                str(data.get('sha256', '')))
+        except (TypeError, ValueError) as exc:
+            raise ValidationError(
+                "target_id and size must be integers.") from exc
+        except uploads.UploadError as exc:
+            raise ValidationError(str(exc)) from exc
+        return Response(_upload_payload(session), status=201)
+
+
+class UploadSessionView(APIView):
+    """Progress of an upload: missing chunks and processing status."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        """ Return the session, e.g. to resume after a disconnect. """
+        session = get_object_or_404(UploadSession, pk=session_id,
+                                    user=request.user)
+        return Response(_upload_payload(session))
+
+
+class UploadChunkView(APIView):
+    """
+    Store one chunk: ``PUT`` the raw bytes.
+
+    The body is streamed to disk, never parsed or held in memory. An
+    optional ``X-Chunk-SHA256`` header is checked.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, session_id, number):
+        """ Write chunk ``number`` of the session. """
+        session = get_object_or_404(UploadSession, pk=session_id,
+                                    user=request.user)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if request.stream is None or length <= 0:
+            raise ValidationError("Chunk body is empty.")
+        try:
+            session = uploads.write_chunk(
+                session, number, request.stream, length,
+                request.headers.get('X-Chunk-SHA256'))
+        except uploads.UploadError as exc:
+            raise ValidationError(str(exc)) from exc
+        return Response(_upload_payload(session))
+
+
+class UploadCompleteView(APIView):
+    """Finish an upload; the image is processed in the background."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        """ Verify the file's hash and queue it for processing. """
+        session = get_object_or_404(UploadSession, pk=session_id,
+                                    user=request.user)
+        try:
+            session = uploads.complete_session(session)
+        except uploads.UploadError as exc:
+            raise ValidationError(str(exc)) from exc
+        return Response(_upload_payload(session), status=202)
+
+
+# -----------------------------
+# PUBLIC (ASYNC): READ-ONLY LISTS
+# -----------------------------
+# Native async counterparts of the public list endpoints above. They use
+# the async ORM so an ASGI worker is not tied up while waiting on the
+# database, and return the same JSON as the DRF views. They spend the
+# same throttle budgets (the endpoint budget is shared with the DRF view)
+# and read the same listing cache; both are sync cache calls, run through
+# ``sync_to_async`` as Django's own async cache methods do.
+
+async def _serialize_list(request, values_serializer, queryset):
+    """Fetch ``queryset`` rows asynchronously and serialize them."""
+    rows = [row async for row in
+            queryset.values(*values_serializer.columns)]
+    return JsonResponse(values_serializer.serialize(rows, request),
+                        safe=False)
+
+
+def _cached_list(request, values_serializer, queryset, scope, scope_id):
+    """Sync: the listing from ``shop.listing_cache``, as a response."""
+    # These take no query parameters: one variant, shared with the DRF
+    # view's unsorted listing.
+    data, status = cached_list(request, values_serializer, queryset,
+                               scope, scope_id, variant='')
+    response = JsonResponse(data, safe=False)
+    response['X-Cache'] = status.upper()
+    return response
+
+
+async def _public_list(request, view_class, values_serializer, queryset,
+                       scope=None, scope_id=None):
+    """Throttle, then serve a public list (cached when ``scope`` is set)."""
+    wait = await sync_to_async(throttle_wait)(request, view_class())
+    if wait is not None:
+        exc = Throttled(wait)
+        response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+        response['Retry-After'] = str(exc.wait)
+    elif scope is None:
+        response = await _serialize_list(request, values_serializer,
+                                         queryset)
+    else:
+        response = await sync_to_async(_cached_list)(
+            request, values_serializer, queryset, scope, scope_id)
+    return add_ratelimit_headers(request, response)
+
+
+async def store_list_async(request):
+    """Public endpoint: list all stores (async)."""
+    return await _public_list(request, StoreListView,
+                              store_values_serializer, Store.objects.all())
+
+
+async def store_product_list_async(request, store_id):
+    """Public endpoint: list products in a store (async)."""
+    return await _public_list(request, StoreProductListView,
+                              product_values_serializer,
+                              Product.objects.filter(store_id=store_id),
+                              'store', store_id)
+
+
+async def public_vendor_store_list_async(request, vendor_id):
+    """Public endpoint: list all stores for a vendor (async)."""
+    return await _public_list(request, PublicVendorStoreListView,
+                              store_values_serializer,
+                              Store.objects.filter(vendor_id=vendor_id),
+                              'vendor', vendor_id)
+
+
+# -----------------------------
+# VENDOR EVENT STREAM (ASYNC, ASGI ONLY)
+# -----------------------------
+# Server-Sent Events replace dashboard polling. A connection only holds
+# its vendor id and last event id while it waits for the broker.
+
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MS = 3000
+
+
+def _sse(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _event_stream(broker, vendor_id, after_id):
+    """Yield the vendor's events after ``after_id``, then wait for more."""
+    yield f"retry: {SSE_RETRY_MS}\n\n"
+    while True:
+        newest = await broker.alast_id()
+        events, gap = await broker.abacklog(vendor_id, after_id)
+        if gap:
+            # Events were dropped; the client should reload its dashboard.
+            yield _sse(newest, 'resync', {})
+        for event_id, _, kind, data in events:
+            yield _sse(event_id, kind, data)
+            after_id = event_id
+        # Skip past other vendors' events as well.
+        after_id = max(after_id, newest)
+        if not await broker.wait(after_id, SSE_KEEPALIVE_SECONDS):
+            yield ": keepalive\n\n"
+
+
+async def vendor_events(request):
+    """
+    Vendor endpoint: stream order, review and stock events as SSE.
+
+    Resumes after the ``Last-Event-ID`` header (or ``?last_event_id=``);
+    new connections only receive events from now on.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'detail': "The event stream requires an ASGI server."},
+            status=501)
+    user = await request.auser()
+    vendor = await sync_to_async(get_vendor_profile)(user)
+    if vendor is None:
+        return JsonResponse({'detail': "Only vendors can listen to events."},
+                            status=403)
+
+    broker = get_broker()
+    last_event_id = (request.headers.get('Last-Event-ID')
+                     or request.GET.get('last_event_id'))
+    try:
+        after_id = int(last_event_id)
+    except (TypeError, ValueError):
+        after_id = await broker.alast_id()
+
+    response = StreamingHttpResponse(
+        _event_stream(broker, vendor.id, after_id),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer events
+    return response
@@ -7,6 +7,21 @@ class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
 
+    def __init__(self, app_name, app_module):
+        super().__init__(app_name, app_module)
+        # Before any models or ready(), so their receivers are profiled.
+        from . import profiling
+        if profiling.is_enabled():
+            profiling.install()
+
     def ready(self):
         # Import for side effects; suppress unused import warning
         _ = __import__('shop.signals')
+
+        from . import autocomplete
+        autocomplete.connect_warm_up()
+
+        from . import metrics
+        if metrics.is_enabled():
+            from django.db.backends.signals import connection_created
+            connection_created.connect(metrics.install_query_counter)
@@ -0,0 +1,283 @@
+"""
+Cold-order archival for the Giftmarket shop.
+
+Completed and cancelled orders older than ``ORDER_ARCHIVE_AFTER_DAYS``
+are moved from ``Order``/``OrderItem`` into ``ArchivedOrder``/
+``ArchivedOrderItem``. Ids are kept, and each batch is copied and
+deleted in one short transaction. An interrupted run can simply be
+started again. An id that is already archived (after an auto-increment
+reset, say) raises ``IntegrityError`` and rolls its batch back, rather
+than deleting a live order that was not copied.
+
+Readers that need the whole history use the helpers here instead of the
+live models:
+
+* ``order_history`` for a page of a buyer's orders
+* ``purchased_lines``, ``purchased_pairs``, ``units_sold`` and the
+  order counts for popularity and recommendations
+* ``recent_order_ids`` and ``order_pairs`` for incremental
+  recommendation refreshes
+* ``has_purchased`` for verified reviews
+"""
+
+import base64
+from datetime import datetime, timedelta
+from heapq import merge
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+# Archived orders that count as sales.
+ARCHIVED_PURCHASED_STATUSES = tuple(
+    status for status in Order.PURCHASED_STATUSES
+    if status in ARCHIVABLE_STATUSES)
+
+ORDER_FIELDS = ('id', 'buyer_id', 'total_price', 'status', 'created_at',
+                'placed_at')
+ITEM_FIELDS = ('id', 'order_id', 'product_id', 'quantity',
+               'personalized_text', 'personalized_image', 'price')
+
+
+# -----------------------------
+# ARCHIVING
+# -----------------------------
+
+def archive_cutoff(older_than_days=None, now=None):
+    """Orders created before this moment can be archived."""
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 365)
+    return (now or timezone.now()) - timedelta(days=older_than_days)
+
+
+def archivable_orders(cutoff):
+    """Live orders that are finished and older than ``cutoff``."""
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES,
+                                created_at__lt=cutoff)
+
+
+def archive_batch(cutoff, batch_size=500):
+    """
+    Move one batch of archivable orders and their lines.
+
+    Returns ``(orders_moved, items_moved)``; ``(0, 0)`` when done.
+    """
+    with transaction.atomic():
+        order_ids = list(
+            archivable_orders(cutoff).select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0, 0
+        orders = Order.objects.filter(pk__in=order_ids).values(*ORDER_FIELDS)
+        items = list(OrderItem.objects.filter(order_id__in=order_ids)
+                     .values(*ITEM_FIELDS))
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(**row) for row in orders],
+            batch_size=batch_size)
+        ArchivedOrderItem.objects.bulk_create(
+            [ArchivedOrderItem(**row) for row in items],
+            batch_size=1000)
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(pk__in=order_ids).delete()
+    return len(order_ids), len(items)
+
+
+def archive_orders(older_than_days=None, batch_size=500, now=None,
+                   progress=None):
+    """
+    Archive every eligible order; returns ``(orders, items)`` moved.
+
+    ``progress``, if given, is called with the running totals after each
+    batch.
+    """
+    cutoff = archive_cutoff(older_than_days, now)
+    orders = items = 0
+    while True:
+        moved_orders, moved_items = archive_batch(cutoff, batch_size)
+        if not moved_orders:
+            return orders, items
+        orders += moved_orders
+        items += moved_items
+        if progress is not None:
+            progress(orders, items)
+
+
+def table_sizes(models):
+    """
+    Return ``{table: (data_bytes, index_bytes)}`` for ``models``.
+
+    Supported on MySQL, PostgreSQL and SQLite (with ``dbstat``); returns
+    None elsewhere.
+    """
+    tables = [model._meta.db_table for model in models]
+    placeholders = ', '.join(['%s'] * len(tables))
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            # Refresh the cached statistics information_schema reports.
+            cursor.execute('ANALYZE TABLE ' + ', '.join(
+                connection.ops.quote_name(table) for table in tables))
+            cursor.fetchall()
+            cursor.execute(
+                'SELECT table_name, data_length, index_length '
+                'FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() '
+                f'AND table_name IN ({placeholders})', tables)
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT relname, pg_table_size(oid), pg_indexes_size(oid) '
+                f'FROM pg_class WHERE relname IN ({placeholders})', tables)
+        elif connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    'SELECT m.tbl_name, '
+                    "SUM(CASE WHEN m.type = 'table' THEN s.pgsize END), "
+                    "SUM(CASE WHEN m.type = 'index' THEN s.pgsize END) "
+                    'FROM dbstat s JOIN sqlite_master m ON m.name = s.name '
+                    f'WHERE m.tbl_name IN ({placeholders}) '
+                    'GROUP BY m.tbl_name', tables)
+            except DatabaseError:
+                return None  # SQLite built without dbstat
+        else:
+            return None
+        return {table: (data or 0, index or 0)
+                for table, data, index in cursor.fetchall()}
+
+
+# -----------------------------
+# READING LIVE + ARCHIVED ORDERS
+# -----------------------------
+
+HISTORY_PAGE_SIZE = 20
+
+
+def encode_history_cursor(position):
+    """Encode a ``(created_at, id)`` position as an opaque token."""
+    created_at, pk = position
+    return base64.urlsafe_b64encode(
+        f'{created_at.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_history_cursor(token):
+    """Decode a token from ``encode_history_cursor``; None if invalid."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(
+            token.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def order_history(user, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of a buyer's placed orders, live and archived, newest first.
+
+    ``before`` is the ``(created_at, id)`` of the last order on the
+    previous page. Each table is read with a keyset range scan of at
+    most ``limit + 1`` rows, and only those are merged. Returns
+    ``(orders, next_before)``; ``next_before`` is None on the last page.
+    """
+    sources = [Order.objects.filter(buyer=user).exclude(status='pending'),
+               ArchivedOrder.objects.filter(buyer=user)]
+    if before is not None:
+        created_at, pk = before
+        after_cursor = (Q(created_at__lt=created_at)
+                        | Q(created_at=created_at, id__lt=pk))
+        sources = [queryset.filter(after_cursor) for queryset in sources]
+    pages = [list(queryset.order_by('-created_at', '-id')
+                  .prefetch_related('items__product')[:limit + 1])
+             for queryset in sources]
+    orders = list(islice(
+        merge(*pages, key=lambda order: (order.created_at, order.id),
+              reverse=True), limit + 1))
+    if len(orders) <= limit:
+        return orders, None
+    orders = orders[:limit]
+    return orders, (orders[-1].created_at, orders[-1].id)
+
+
+def _live_sold():
+    return OrderItem.objects.filter(
+        order__status__in=Order.PURCHASED_STATUSES)
+
+
+def _archived_sold():
+    return ArchivedOrderItem.objects.filter(
+        order__status__in=ARCHIVED_PURCHASED_STATUSES)
+
+
+def purchased_lines(since=None):
+    """Iterate ``(product_id, quantity, order_created_at)`` of all sales."""
+    live, archived = _live_sold(), _archived_sold()
+    if since is not None:
+        live = live.filter(order__created_at__gte=since)
+        archived = archived.filter(order__created_at__gte=since)
+    fields = ('product_id', 'quantity', 'order__created_at')
+    return chain(live.values_list(*fields).iterator(),
+                 archived.values_list(*fields).iterator())
+
+
+def purchased_pairs():
+    """Iterate ``(order_id, product_id)`` of all sales."""
+    return chain(
+        _live_sold().values_list('order_id', 'product_id').iterator(),
+        _archived_sold().values_list('order_id', 'product_id').iterator())
+
+
+def recent_order_ids(product_id, limit):
+    """Ids of the latest ``limit`` sales (live or archived) of a product."""
+    ids = []
+    for items in (_live_sold(), _archived_sold()):
+        ids.extend(items.filter(product_id=product_id)
+                   .order_by('-order_id')
+                   .values_list('order_id', flat=True)[:limit])
+    return sorted(ids, reverse=True)[:limit]
+
+
+def order_pairs(order_ids):
+    """Iterate ``(order_id, product_id)`` of the given sold orders."""
+    return chain(*(
+        items.filter(order_id__in=order_ids)
+        .values_list('order_id', 'product_id').iterator()
+        for items in (_live_sold(), _archived_sold())))
+
+
+def units_sold():
+    """Return ``{product_id: units sold}`` over live and archived orders."""
+    totals = {}
+    for items in (_live_sold(), _archived_sold()):
+        for product_id, units in (items.values('product_id')
+                                  .annotate(n=Sum('quantity'))
+                                  .values_list('product_id', 'n')):
+            totals[product_id] = totals.get(product_id, 0) + units
+    return totals
+
+
+def product_order_counts(product_ids):
+    """Return ``{product_id: orders containing it}`` over all sales."""
+    counts = {}
+    for items in (_live_sold(), _archived_sold()):
+        for product_id, n in (items.filter(product_id__in=product_ids)
+                              .values('product_id')
+                              .annotate(n=Count('order_id'))
+                              .values_list('product_id', 'n')):
+            counts[product_id] = counts.get(product_id, 0) + n
+    return counts
+
+
+def purchased_order_count():
+    """Number of placed orders, live and archived."""
+    return (_live_sold().values('order_id').distinct().count()
+            + _archived_sold().values('order_id').distinct().count())
+
+
+def has_purchased(user, product):
+    """True if ``user`` has bought ``product`` (live or archived)."""
+    return (_live_sold().filter(order__buyer=user, product=product).exists()
+            or _archived_sold().filter(order__buyer=user,
+                                       product=product).exists())
@@ -0,0 +1,388 @@
+"""
+In-memory prefix autocomplete for product and store names.
+
+Each process keeps a ``PrefixIndex``. It holds a sorted array of
+normalised keys and a parallel array of ``(kind, id)`` refs. A name is
+indexed from each word onwards, so "mug" finds "Coffee Mug". A query
+bisects the key range for its prefix and returns the heaviest matches.
+Products weigh their popularity scores, and stores the sum of their
+products'. Queries never touch the database.
+
+Each worker loads its index in a background thread, started by its first
+request (``warm_up``, connected to ``request_started`` unless
+``settings.AUTOCOMPLETE_WARM_UP`` is off) or by the server calling
+``load_in_background()`` after it forks. Searches made before it is
+ready return no results rather than wait. The index is loaded:
+
+* from ``settings.AUTOCOMPLETE_SNAPSHOT`` if that file exists
+  (``manage.py autocomplete_snapshot`` writes it), then caught up with
+  changes made since it was written;
+* otherwise, built from the database.
+
+Product and store signals update it in place: new keys go to a small
+sorted side list that is merged into the main arrays once it grows past
+``MERGE_AT``, and only the cached short prefixes of the changed names are
+dropped. At most ``SHORT_CACHE_MAX`` short prefixes are cached, and only
+those with results. Other processes pick up
+those changes within ``SYNC_INTERVAL`` seconds from a background catch-up
+that reads recently updated rows and deletion tombstones.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import CatalogTombstone, Product, Store
+from .popularity import current_weight
+
+KINDS = ('product', 'store')
+MAX_WORDS = 6  # word starts indexed per name
+MAX_LIMIT = 20
+SHORT_PREFIX = 2  # results for prefixes this short are cached
+SHORT_CACHE_MAX = 2048  # cached prefixes; the oldest is dropped past this
+MERGE_AT = 512  # pending key changes before the arrays are rewritten
+SYNC_INTERVAL = 30
+# Catch-ups re-read a little before the last sync, for slow commits.
+SYNC_OVERLAP = timedelta(seconds=5)
+SNAPSHOT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def normalise(text):
+    """Lower-case, strip accents and collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """Sorted-array prefix index of weighted names; thread-safe."""
+
+    def __init__(self):
+        self._keys = []
+        self._refs = []
+        # Changes not yet merged into _keys/_refs: sorted (key, ref)
+        # additions, and (key, ref) entries of _keys/_refs to skip.
+        self._added = []
+        self._removed = set()
+        self._objects = {}  # (kind, id) -> (name, weight)
+        self._short_cache = {}
+        self._lock = threading.RLock()
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._objects)
+
+    @staticmethod
+    def _keys_for(name):
+        words = normalise(name).split()
+        return [' '.join(words[i:]) for i in range(min(len(words),
+                                                       MAX_WORDS))]
+
+    def load(self, objects):
+        """Replace the contents with ``[(kind, id, name, weight)]``."""
+        entries = sorted(
+            (key, (kind, obj_id))
+            for kind, obj_id, name, _ in objects
+            for key in self._keys_for(name))
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._refs = [ref for _, ref in entries]
+            self._objects = {(kind, obj_id): (name, weight)
+                             for kind, obj_id, name, weight in objects}
+            self._added = []
+            self._removed = set()
+            self._short_cache = {}
+
+    def _add_key(self, key, ref):
+        if (key, ref) in self._removed:
+            self._removed.discard((key, ref))  # still in the main arrays
+        else:
+            insort(self._added, (key, ref))
+
+    def _remove_key(self, key, ref):
+        i = bisect_left(self._added, (key, ref))
+        if i < len(self._added) and self._added[i] == (key, ref):
+            del self._added[i]
+        else:
+            self._removed.add((key, ref))
+
+    def _merge(self):
+        """Fold pending changes into the main arrays (O(N), amortised)."""
+        removed = self._removed
+        entries = heapq.merge(
+            ((key, ref) for key, ref in zip(self._keys, self._refs)
+             if (key, ref) not in removed),
+            self._added)
+        self._keys, self._refs = [], []
+        for key, ref in entries:
+            self._keys.append(key)
+            self._refs.append(ref)
+        self._added = []
+        self._removed = set()
+
+    def _forget_prefixes(self, kind, keys):
+        """Drop cached results that ``keys`` could appear in."""
+        for key in keys:
+            for length in range(1, SHORT_PREFIX + 1):
+                self._short_cache.pop((key[:length], None), None)
+                self._short_cache.pop((key[:length], kind), None)
+
+    def put(self, kind, obj_id, name, weight=None):
+        """Add or update one object (keeps its weight if none is given)."""
+        ref = (kind, obj_id)
+        keys = self._keys_for(name)
+        with self._lock:
+            old = self._objects.get(ref)
+            if weight is None:
+                weight = old[1] if old else 0.0
+            old_keys = self._keys_for(old[0]) if old else []
+            if not old or old[0] != name:
+                for key in old_keys:
+                    self._remove_key(key, ref)
+                for key in keys:
+                    self._add_key(key, ref)
+                if len(self._added) + len(self._removed) > MERGE_AT:
+                    self._merge()
+            self._objects[ref] = (name, weight)
+            self._forget_prefixes(kind, old_keys + keys)
+
+    def remove(self, kind, obj_id):
+        ref = (kind, obj_id)
+        with self._lock:
+            old = self._objects.pop(ref, None)
+            if old:
+                old_keys = self._keys_for(old[0])
+                for key in old_keys:
+                    self._remove_key(key, ref)
+                self._forget_prefixes(kind, old_keys)
+
+    def search(self, query, limit=10, kind=None):
+        """Return up to ``limit`` ``{'type', 'id', 'name'}`` matches."""
+        prefix = normalise(query)
+        if not prefix:
+            return []
+        cache_key = (prefix, kind)
+        with self._lock:
+            cached = self._short_cache.get(cache_key)
+            if cached is None:
+                end = prefix + '\uffff'
+                lo = bisect_left(self._keys, prefix)
+                hi = bisect_left(self._keys, end, lo)
+                if self._removed:
+                    refs = {ref for key, ref in zip(self._keys[lo:hi],
+                                                    self._refs[lo:hi])
+                            if (key, ref) not in self._removed}
+                else:
+                    refs = set(self._refs[lo:hi])
+                lo = bisect_left(self._added, (prefix,))
+                hi = bisect_left(self._added, (end,), lo)
+                refs.update(ref for _, ref in self._added[lo:hi])
+                if kind is not None:
+                    refs = {ref for ref in refs if ref[0] == kind}
+                objects = self._objects
+                best = heapq.nlargest(
+                    MAX_LIMIT, refs,
+                    key=lambda ref: (objects[ref][1], -ref[1]))
+                cached = [{'type': ref[0], 'id': ref[1],
+                           'name': objects[ref][0]} for ref in best]
+                # Only prefixes that match something are cached, so
+                # junk queries cannot grow the cache.
+                if cached and len(prefix) <= SHORT_PREFIX:
+                    if len(self._short_cache) >= SHORT_CACHE_MAX:
+                        del self._short_cache[next(iter(self._short_cache))]
+                    self._short_cache[cache_key] = cached
+        return cached[:limit]
+
+    def items(self):
+        with self._lock:
+            return [(kind, obj_id, name, weight) for (kind, obj_id),
+                    (name, weight) in self._objects.items()]
+
+
+# -----------------------------
+# LOADING FROM THE DATABASE
+# -----------------------------
+
+def _weight(prefix=''):
+    """Popularity weight of a product (``prefix`` reaches it via a join)."""
+    return current_weight(prefix)
+
+
+def _product_rows(queryset):
+    return [('product', row['id'], row['name'], row['weight'])
+            for row in queryset.annotate(weight=_weight())
+            .values('id', 'name', 'weight')]
+
+
+def _store_rows(queryset):
+    return [('store', row['id'], row['name'], row['weight'] or 0.0)
+            for row in queryset.annotate(weight=Sum(_weight('products__')))
+            .values('id', 'name', 'weight')]
+
+
+def build_objects():
+    """All products and stores as ``(kind, id, name, weight)``."""
+    return (_product_rows(Product.objects.all())
+            + _store_rows(Store.objects.all()))
+
+
+def catch_up(index, since):
+    """Apply products, stores and deletions changed since ``since``."""
+    now = timezone.now()
+    since -= SYNC_OVERLAP
+    for kind, obj_id, name, weight in (
+            _product_rows(Product.objects.filter(updated_at__gte=since))
+            + _store_rows(Store.objects.filter(updated_at__gte=since))):
+        index.put(kind, obj_id, name, weight)
+    for kind, obj_id in (CatalogTombstone.objects
+                         .filter(deleted_at__gte=since)
+                         .values_list('kind', 'object_id')):
+        index.remove(kind, obj_id)
+    index.synced_at = now
+
+
+# -----------------------------
+# SNAPSHOTS
+# -----------------------------
+
+def snapshot_path():
+    return getattr(settings, 'AUTOCOMPLETE_SNAPSHOT', None)
+
+
+def save_snapshot(index, path):
+    """Write the index contents to ``path`` as JSON."""
+    data = {'version': SNAPSHOT_VERSION,
+            'synced_at': index.synced_at.isoformat(),
+            'objects': index.items()}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh, separators=(',', ':'))
+    os.replace(tmp_path, path)  # readers never see a partial file
+
+
+def load_snapshot(index, path):
+    """Fill ``index`` from a snapshot; returns False if unusable."""
+    try:
+        with open(path, encoding='utf-8') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return False
+    if data.get('version') != SNAPSHOT_VERSION:
+        return False
+    index.load([tuple(obj) for obj in data['objects']])
+    index.synced_at = datetime.fromisoformat(data['synced_at'])
+    return True
+
+
+# -----------------------------
+# PROCESS-WIDE INDEX
+# -----------------------------
+
+_index = None
+_index_lock = threading.Lock()
+_load_thread = None
+_sync_thread = None
+
+
+def build_index():
+    """A fresh index loaded from the database."""
+    index = PrefixIndex()
+    synced_at = timezone.now()
+    index.load(build_objects())
+    index.synced_at = synced_at
+    return index
+
+
+def _load():
+    global _index
+    try:
+        index = PrefixIndex()
+        path = snapshot_path()
+        if path and load_snapshot(index, path):
+            catch_up(index, index.synced_at)
+        else:
+            index = build_index()
+        _index = index
+        logger.info("autocomplete index loaded",
+                    extra={'objects': len(index)})
+    except DatabaseError:
+        # Left unloaded; the next request tries again.
+        logger.exception("autocomplete index load failed")
+    finally:
+        close_old_connections()
+
+
+def load_in_background():
+    """Start loading this process's index unless it is loaded or loading."""
+    global _load_thread
+    if _index is not None or (_load_thread and _load_thread.is_alive()):
+        return
+    with _index_lock:
+        if _index is not None or (_load_thread
+                                  and _load_thread.is_alive()):
+            return
+        _load_thread = threading.Thread(target=_load, daemon=True)
+        _load_thread.start()
+
+
+def warm_up(**kwargs):
+    """``request_started`` receiver: load the index ahead of searches."""
+    if getattr(settings, 'AUTOCOMPLETE_WARM_UP', True):
+        load_in_background()
+
+
+def connect_warm_up():
+    """Load the index when this process serves its first request."""
+    request_started.connect(warm_up, dispatch_uid='autocomplete_warm_up')
+
+
+def _sync(index):
+    try:
+        catch_up(index, index.synced_at)
+    finally:
+        close_old_connections()
+
+
+def maybe_sync():
+    """Start a background catch-up if the index is due for one."""
+    global _sync_thread
+    index = _index
+    if index is None or (_sync_thread and _sync_thread.is_alive()):
+        return
+    if (timezone.now() - index.synced_at).total_seconds() < SYNC_INTERVAL:
+        return
+    with _index_lock:
+        if _sync_thread and _sync_thread.is_alive():
+            return
+        _sync_thread = threading.Thread(target=_sync, args=(index,),
+                                        daemon=True)
+        _sync_thread.start()
+
+
+def loaded_index():
+    """The index if this process has loaded one (signals skip otherwise)."""
+    return _index
+
+
+def search(query, limit=10, kind=None):
+    """Autocomplete ``query``; empty until the index has loaded."""
+    index = _index
+    if index is None:
+        load_in_background()
+        return []
+    results = index.search(query, limit, kind)
+    maybe_sync()
+    return results
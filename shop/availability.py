@@ -0,0 +1,118 @@
+"""
+Cache-first stock availability for the Giftmarket catalog.
+
+Each product's reservable stock (the sum of its ``StockCounter`` rows,
+or ``Product.stock`` before it has any) is cached under
+``availability:<id>``. The inventory ledger writes through to it:
+
+* ``reserve``, ``release`` and ``release_expired`` apply their deltas
+  with an atomic ``incr``/``decr``;
+* ``set_stock`` (vendor edits, the API, admin) writes the new total.
+
+Writes happen once the transaction commits, so a rolled-back checkout
+never shows. ``get_availability`` answers from one ``get_many``, and all
+misses are loaded with one query and cached with ``add``.
+
+A read can load a value, lose the race to a delta's commit and then
+cache what it loaded. If the delta found the entry already cached, the
+read's ``add`` fails. If not, the delta leaves an ``UNSETTLED`` marker
+for ``UNSETTLED_TIMEOUT`` seconds. Reads treat the marker as a miss, and
+their ``add`` cannot replace it, so the stale value is never cached.
+
+Entries expire after ``AVAILABILITY_TIMEOUT``, which bounds any drift
+from a process dying between a commit and its cache write.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from . import metrics
+from .models import Product
+
+AVAILABILITY_TIMEOUT = 60 * 5
+# Unknown ids are remembered briefly so repeated polls skip the DB.
+MISSING = 'missing'
+MISSING_TIMEOUT = 60
+# Left by a delta with nothing to apply to; reads load past it.
+UNSETTLED = 'unsettled'
+UNSETTLED_TIMEOUT = 10
+
+
+def availability_key(product_id):
+    return f'availability:{product_id}'
+
+
+def _load(product_ids):
+    """Reservable stock of existing products, in one query."""
+    return {
+        row['id']: (row['available'] if row['available'] is not None
+                    else row['stock'])
+        for row in Product.objects.filter(id__in=product_ids)
+        .annotate(available=Sum('stock_counters__available'))
+        .values('id', 'stock', 'available')
+    }
+
+
+def get_availability(product_ids):
+    """Return ``{product_id: units available}`` for existing products."""
+    keys = {availability_key(pid): pid for pid in product_ids}
+    cached = cache.get_many(list(keys))
+    found = {keys[key]: value for key, value in cached.items()
+             if value != UNSETTLED}
+
+    misses = [pid for pid in product_ids if pid not in found]
+    metrics.cache_lookups('availability', len(found), len(misses))
+    if misses:
+        loaded = _load(misses)
+        # add(), not set(): never overwrite a written-through value or
+        # an UNSETTLED marker, which may be newer than what we loaded.
+        for pid, available in loaded.items():
+            cache.add(availability_key(pid), available, AVAILABILITY_TIMEOUT)
+        cache.set_many({availability_key(pid): MISSING
+                        for pid in misses if pid not in loaded},
+                       MISSING_TIMEOUT)
+        found.update(loaded)
+    return {pid: max(value, 0) for pid, value in found.items()
+            if value != MISSING}
+
+
+# -----------------------------
+# WRITE-THROUGH
+# -----------------------------
+
+def _apply_deltas(deltas):
+    for pid, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(availability_key(pid), delta)
+        except (ValueError, TypeError):
+            # Not cached (or cached as missing or unsettled). A read may
+            # have loaded the value before this commit; block its add().
+            cache.set(availability_key(pid), UNSETTLED, UNSETTLED_TIMEOUT)
+
+
+def adjust(deltas):
+    """Add ``{product_id: delta}`` to cached values after commit."""
+    deltas = dict(deltas)
+    transaction.on_commit(lambda: _apply_deltas(deltas))
+
+
+def refresh(product_ids):
+    """Re-read and cache the products' availability after commit."""
+    product_ids = list(product_ids)
+
+    def write():
+        loaded = _load(product_ids)
+        cache.set_many({availability_key(pid): available
+                        for pid, available in loaded.items()},
+                       AVAILABILITY_TIMEOUT)
+        cache.delete_many([availability_key(pid) for pid in product_ids
+                           if pid not in loaded])
+    transaction.on_commit(write)
+
+
+def forget(product_ids):
+    """Drop cached values, e.g. of deleted products."""
+    cache.delete_many([availability_key(pid) for pid in product_ids])
@@ -0,0 +1,49 @@
+"""Authentication backend and role helpers for the Giftmarket shop.
+
+Role checks all over the app ask whether ``request.user`` has a
+``vendor_profile``. With the default backend each of those checks costs
+a query after the session user is loaded. ``VendorProfileBackend`` loads
+the user and their profile in one joined query instead, so the answer is
+already cached on the user object for the rest of the request.
+"""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import ObjectDoesNotExist
+
+UserModel = get_user_model()
+
+
+class VendorProfileBackend(ModelBackend):
+    """ModelBackend that joins ``vendor_profile`` when loading the user."""
+
+    def get_user(self, user_id):
+        """Load the session user with their vendor profile in one query."""
+        try:
+            user = UserModel._default_manager.select_related(
+                'vendor_profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def get_vendor_profile(user):
+    """
+    Return the user's VendorProfile, or None for buyers and anonymous users.
+
+    Uses the profile joined in by ``VendorProfileBackend``; users loaded any
+    other way pay one query, after which the result is cached on the user
+    (including a cached "no profile"). Creating a profile for the user
+    refreshes that cache, so the role is never stale.
+    """
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.vendor_profile
+    except ObjectDoesNotExist:
+        return None
+
+
+def is_vendor(user):
+    """Return True if the user has a vendor profile."""
+    return get_vendor_profile(user) is not None
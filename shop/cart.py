@@ -0,0 +1,370 @@
+"""Cart service for the Giftmarket shop application.
+
+Two cart backends share one API so views do not care who is shopping:
+
+* ``GuestCart`` keeps ``{product_id: quantity}`` in a signed cookie, so
+  anonymous browsing never writes to the database.
+* ``OrderCart`` keeps the cart in the buyer's pending ``Order``.
+
+When a guest logs in (or signs up), their cookie cart is merged into the
+pending order with a single bulk upsert and the cookie is cleared.
+
+Pending orders nobody has touched for ``CART_ABANDON_AFTER_DAYS`` are
+deleted by ``purge_abandoned_carts`` (``manage.py purge_abandoned_carts``).
+"""
+
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from . import inventory
+from .models import Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'shop.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30  # 30 days
+CART_MAX_LINES = 50  # keeps the cookie well under browser size limits
+
+
+class CartFull(Exception):
+    """Raised when a guest cart already holds ``CART_MAX_LINES`` lines."""
+
+    def __init__(self):
+        super().__init__(
+            f"Your cart can hold at most {CART_MAX_LINES} different "
+            f"products. Log in to add more.")
+
+
+class CartLine:
+    """A product and quantity in a guest cart, shaped like an OrderItem."""
+
+    def __init__(self, product, quantity):
+        self.id = product.id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def price(self):
+        """Return the unit price of the product."""
+        return self.product.price
+
+
+# -----------------------------
+# GUEST CART (SIGNED COOKIE)
+# -----------------------------
+
+class GuestCart:
+    """Cart for anonymous users, stored in a signed cookie.
+
+    Lines are keyed by product id, so ``item_id`` arguments are product ids.
+    Stock is checked but not held; it is reserved when the cart is merged
+    into an order and topped up at checkout.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.lines = self._load(request)
+        self.modified = False
+        self.cleared = False
+
+    @staticmethod
+    def _load(request):
+        """Read and validate the cart cookie; tampered cookies are dropped."""
+        data = request.get_signed_cookie(
+            CART_COOKIE_NAME, default=None, salt=CART_COOKIE_SALT)
+        if not data:
+            return {}
+        try:
+            raw = json.loads(data)
+            return {int(pid): int(qty) for pid, qty in raw.items()
+                    if int(qty) > 0}
+        except (ValueError, TypeError, AttributeError):
+            return {}
+
+    def _get_line(self, item_id):
+        if item_id not in self.lines:
+            raise Http404("No cart item matches the given query.")
+        return item_id
+
+    def _check_stock(self, product, quantity):
+        """Read-only stock check; guest carts do not hold stock."""
+        wanted = self.lines.get(product.id, 0) + quantity
+        available = inventory.available_stock([product.id]).get(
+            product.id, product.stock)
+        if wanted > available:
+            raise inventory.InsufficientStock(product, quantity)
+
+    def add(self, product, quantity=1):
+        """Add ``quantity`` of ``product``; raises ``CartFull`` if no room."""
+        if (product.id not in self.lines
+                and len(self.lines) >= CART_MAX_LINES):
+            raise CartFull()
+        self._check_stock(product, quantity)
+        self.lines[product.id] = self.lines.get(product.id, 0) + quantity
+        self.modified = True
+
+    def increase(self, item_id):
+        """Increase the quantity of a line by one."""
+        pid = self._get_line(item_id)
+        self._check_stock(get_object_or_404(Product, id=pid), 1)
+        self.lines[pid] += 1
+        self.modified = True
+
+    def decrease(self, item_id):
+        """Decrease the quantity of a line, removing it at zero."""
+        pid = self._get_line(item_id)
+        if self.lines[pid] > 1:
+            self.lines[pid] -= 1
+        else:
+            del self.lines[pid]
+        self.modified = True
+
+    def remove(self, item_id):
+        """Remove a line from the cart."""
+        del self.lines[self._get_line(item_id)]
+        self.modified = True
+
+    def clear(self):
+        """Empty the cart and drop the cookie."""
+        self.lines = {}
+        self.modified = True
+        self.cleared = True
+
+    def items(self):
+        """Return cart lines with their products, in one query."""
+        products = Product.objects.in_bulk(list(self.lines))
+        return [CartLine(products[pid], qty)
+                for pid, qty in self.lines.items() if pid in products]
+
+    def total(self, items=None):
+        """Return the cart total, reusing ``items`` when already loaded."""
+        items = self.items() if items is None else items
+        return sum(line.price * line.quantity for line in items)
+
+    def save(self, response):
+        """Write the cookie to ``response`` if the cart changed."""
+        if not self.modified:
+            return
+        if self.cleared or not self.lines:
+            response.delete_cookie(CART_COOKIE_NAME)
+            return
+        value = json.dumps(self.lines, separators=(',', ':'))
+        response.set_signed_cookie(
+            CART_COOKIE_NAME, value, salt=CART_COOKIE_SALT,
+            max_age=CART_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+
+
+# -----------------------------
+# LOGGED-IN CART (PENDING ORDER)
+# -----------------------------
+
+class OrderCart:
+    """Cart for authenticated users, stored in their pending Order.
+
+    ``item_id`` arguments are OrderItem ids. Quantities are held in the
+    inventory ledger as they are added, and released as they are removed;
+    adding raises ``inventory.InsufficientStock`` when stock runs out.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+
+    def _get_item(self, item_id):
+        return get_object_or_404(OrderItem, id=item_id,
+                                 order__buyer=self.user,
+                                 order__status='pending')
+
+    def add(self, product, quantity=1):
+        """Add ``quantity`` of ``product`` to the pending order."""
+        with transaction.atomic():
+            order, _ = Order.objects.get_or_create(buyer=self.user,
+                                                   status='pending')
+            order_item, created = OrderItem.objects.get_or_create(
+                order=order,
+                product=product,
+                defaults={'quantity': quantity, 'price': product.price}
+            )
+            if not created:
+                order_item.quantity += quantity
+                order_item.save()
+            inventory.reserve(product, quantity, order_item=order_item)
+
+    def increase(self, item_id):
+        """Increase the quantity of an item by one."""
+        item = self._get_item(item_id)
+        with transaction.atomic():
+            item.quantity += 1
+            item.save()
+            inventory.reserve(item.product, 1, order_item=item)
+
+    def decrease(self, item_id):
+        """Decrease the quantity of an item, removing it at zero."""
+        item = self._get_item(item_id)
+        with transaction.atomic():
+            inventory.release(item, 1)
+            if item.quantity > 1:
+                item.quantity -= 1
+                item.save()
+            else:
+                item.delete()
+
+    def remove(self, item_id):
+        """Remove an item from the cart."""
+        item = self._get_item(item_id)
+        with transaction.atomic():
+            inventory.release(item)
+            item.delete()
+
+    def items(self):
+        """Return the pending order's items with their products."""
+        return list(OrderItem.objects.filter(
+            order__buyer=self.user,
+            order__status='pending'
+        ).select_related('product'))
+
+    def total(self, items=None):
+        """Return the cart total, reusing ``items`` when already loaded."""
+        items = self.items() if items is None else items
+        return sum(item.product.price * item.quantity for item in items)
+
+    def save(self, response):
+        """Nothing to do: changes are already in the database."""
+
+
+# -----------------------------
+# ENTRY POINTS
+# -----------------------------
+
+def get_cart(request):
+    """Return the cart for this request, cached on the request."""
+    cart = getattr(request, '_cart', None)
+    if cart is None:
+        if request.user.is_authenticated:
+            cart = OrderCart(request)
+        else:
+            cart = GuestCart(request)
+        request._cart = cart
+    return cart
+
+
+def merge_guest_cart(request, user):
+    """Merge the request's guest cart into ``user``'s pending Order.
+
+    Existing lines have their quantities summed with the guest lines, and
+    the result is written with one ``bulk_create`` upsert.
+    """
+    guest = getattr(request, '_cart', None)
+    if not isinstance(guest, GuestCart):
+        guest = GuestCart(request)
+
+    request._cart = None
+    if guest.lines:
+        products = Product.objects.in_bulk(list(guest.lines))
+        with transaction.atomic():
+            order, _ = Order.objects.get_or_create(buyer=user,
+                                                   status='pending')
+            existing = dict(OrderItem.objects.filter(
+                order=order, product_id__in=products
+            ).values_list('product_id', 'quantity'))
+            rows = [
+                OrderItem(order=order, product=product,
+                          quantity=existing.get(pid, 0) + guest.lines[pid],
+                          price=product.price)
+                for pid, product in products.items()
+            ]
+            # MySQL infers the conflict target from the unique key and
+            # rejects an explicit one.
+            unique_fields = (
+                ['order', 'product']
+                if connection.features.supports_update_conflicts_with_target
+                else None
+            )
+            OrderItem.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['quantity', 'updated_at'],
+            )
+        logger.info("guest cart merged",
+                    extra={'user_id': user.pk, 'order_id': order.pk,
+                           'lines': len(rows)})
+
+    guest.clear()
+    # Keep the cleared guest cart around so the middleware drops the cookie.
+    request._guest_cart = guest
+
+
+# -----------------------------
+# ABANDONED CARTS
+# -----------------------------
+
+def abandoned_carts(cutoff):
+    """Pending orders with no cart activity since ``cutoff``."""
+    return (
+        Order.objects.filter(status='pending')
+        .annotate(last_activity=Coalesce(Max('items__updated_at'),
+                                         'created_at'))
+        .filter(last_activity__lt=cutoff)
+    )
+
+
+def purge_abandoned_carts(idle_days=None, batch_size=500, dry_run=False,
+                          pause=0, now=None):
+    """
+    Delete pending orders idle for ``idle_days``, ``batch_size`` at a time.
+
+    Candidates are found with a keyset scan outside any transaction; each
+    batch is then re-checked and deleted in its own short transaction, so
+    a buyer adding to their cart meanwhile keeps it. Holds on the deleted
+    lines have long expired and are returned by the reservation sweeper.
+
+    Returns ``{'orders', 'items', 'seconds'}``; nothing is deleted when
+    ``dry_run`` is set.
+    """
+    if idle_days is None:
+        idle_days = getattr(settings, 'CART_ABANDON_AFTER_DAYS', 30)
+    cutoff = (now or timezone.now()) - timedelta(days=idle_days)
+    started = time.monotonic()
+    orders = items = 0
+    last_id = 0
+    while True:
+        order_ids = list(
+            abandoned_carts(cutoff).filter(id__gt=last_id).order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            break
+        last_id = order_ids[-1]
+        if dry_run:
+            orders += len(order_ids)
+            items += OrderItem.objects.filter(order_id__in=order_ids).count()
+            continue
+        with transaction.atomic():
+            order_ids = list(
+                Order.objects.select_for_update()
+                .filter(pk__in=order_ids, status='pending')
+                .exclude(items__updated_at__gte=cutoff)
+                .values_list('id', flat=True)
+            )
+            items += OrderItem.objects.filter(
+                order_id__in=order_ids).delete()[0]
+            orders += Order.objects.filter(pk__in=order_ids).delete()[0]
+        if pause:
+            time.sleep(pause)  # let replicas and other writers catch up
+    result = {'orders': orders, 'items': items,
+              'seconds': time.monotonic() - started}
+    logger.info("abandoned carts purged",
+                extra={**result, 'dry_run': dry_run, 'idle_days': idle_days})
+    return result
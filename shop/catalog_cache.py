@@ -0,0 +1,82 @@
+"""
+Per-product cache entries for the Giftmarket catalog API.
+
+Each product is cached as its raw ``.values()`` row, plus its store name
+and rating summary, under ``catalog:product:<id>``. Rows are serialized
+per request, so URLs follow the request host. A batch is read with one
+``cache.get_many``, and all misses are loaded with one query. Entries
+are dropped by the product, store and review signals in
+``shop.signals``.
+"""
+
+from django.core.cache import cache
+from django.db.models import Avg, Count
+
+from . import metrics
+from .models import Product
+from .serializers import product_values_serializer
+
+PRODUCT_CACHE_TIMEOUT = 60 * 15
+# Unknown ids are remembered briefly so repeated lookups skip the DB.
+MISSING = 'missing'
+MISSING_CACHE_TIMEOUT = 60
+
+
+def product_cache_key(product_id):
+    """Cache key of one product's batch row."""
+    return f'catalog:product:{product_id}'
+
+
+def _load_rows(product_ids):
+    """Load product rows with store name and rating summary in one query."""
+    rows = (
+        Product.objects.filter(id__in=product_ids)
+        .annotate(review_count=Count('reviews'),
+                  average_rating=Avg('reviews__rating'))
+        .values(*product_values_serializer.columns, 'store__name',
+                'review_count', 'average_rating')
+    )
+    return {row['id']: row for row in rows}
+
+
+def get_product_rows(product_ids):
+    """
+    Return ``{product_id: row}`` for the products that exist.
+
+    Cached rows are read with ``get_many``; the rest are loaded together
+    and written back with ``set_many``.
+    """
+    keys = {product_cache_key(pid): pid for pid in product_ids}
+    cached = cache.get_many(list(keys))
+    rows = {keys[key]: row for key, row in cached.items()}
+
+    uncached = [pid for pid in product_ids if pid not in rows]
+    metrics.cache_lookups('catalog', len(rows), len(uncached))
+    if uncached:
+        loaded = _load_rows(uncached)
+        cache.set_many({product_cache_key(pid): row
+                        for pid, row in loaded.items()},
+                       PRODUCT_CACHE_TIMEOUT)
+        cache.set_many({product_cache_key(pid): MISSING
+                        for pid in uncached if pid not in loaded},
+                       MISSING_CACHE_TIMEOUT)
+        rows.update(loaded)
+    return {pid: row for pid, row in rows.items() if row != MISSING}
+
+
+def serialize_product_rows(rows, request):
+    """Serialize batch rows: product fields, store name and rating."""
+    data = product_values_serializer.serialize(rows, request)
+    for item, row in zip(data, rows):
+        average = row['average_rating']
+        item['store_name'] = row['store__name']
+        item['rating'] = {
+            'count': row['review_count'],
+            'average': round(average, 2) if average is not None else None,
+        }
+    return data
+
+
+def invalidate_products(product_ids):
+    """Drop cached rows for ``product_ids``."""
+    cache.delete_many([product_cache_key(pid) for pid in product_ids])
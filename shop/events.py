@@ -0,0 +1,232 @@
+"""
+Vendor event broker for the Giftmarket dashboard stream.
+
+Model signals publish small vendor-scoped events:
+
+* ``order_line``: a product was bought at checkout
+* ``order_status``: an order containing the vendor's products moved on
+* ``order_status_batch``: a batch of the vendor's orders moved to one
+  status (``shop.order_status``)
+* ``review``: a new review of one of the vendor's products
+* ``low_stock``: a product's stock fell to ``LOW_STOCK_THRESHOLD``
+
+``vendor_events`` in ``shop.api_views`` streams them as Server-Sent
+Events. Every event has an increasing id, so a reconnecting client
+resumes from ``Last-Event-ID``. Events are published after the
+transaction commits, so listeners never see rolled-back changes.
+
+The backend is set in ``settings.EVENT_BROKER``::
+
+    EVENT_BROKER = {
+        'BACKEND': 'shop.events.InProcessBroker',
+        'OPTIONS': {'buffer_size': 1000},
+    }
+
+``InProcessBroker`` only reaches listeners in the same process. Use
+``CacheBroker`` with a shared cache (Redis, Memcached) when running
+several workers.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+LOW_STOCK_THRESHOLD = 5
+
+
+class BaseBroker:
+    """
+    Interface of event broker backends.
+
+    An event is an ``(id, vendor_id, kind, data)`` tuple.
+    """
+
+    def publish(self, vendor_id, kind, data):
+        """Store an event and wake up waiting listeners; return its id."""
+        raise NotImplementedError
+
+    def last_id(self):
+        """Id of the newest event (0 if there are none)."""
+        raise NotImplementedError
+
+    def backlog(self, vendor_id, after_id):
+        """
+        Return ``(events, gap)`` for ``vendor_id`` newer than ``after_id``.
+
+        ``gap`` is true if older events have been dropped, so the client
+        may have missed some and should reload its dashboard.
+        """
+        raise NotImplementedError
+
+    async def abacklog(self, vendor_id, after_id):
+        return await sync_to_async(self.backlog)(vendor_id, after_id)
+
+    async def alast_id(self):
+        return await sync_to_async(self.last_id)()
+
+    async def wait(self, after_id, timeout):
+        """Wait until an event newer than ``after_id`` may exist."""
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Ring buffer of recent events shared by all listeners of a process.
+
+    Listeners only keep their last seen id. All listeners on an event
+    loop wait on one shared future, which ``publish`` resolves from any
+    thread.
+    """
+
+    def __init__(self, buffer_size=1000):
+        self._events = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        # Ids start from the clock so they keep increasing after a
+        # restart, and resuming clients are told about the gap.
+        self._seq = self._floor = int(time.time() * 1000)
+        self._wakeups = {}
+
+    def publish(self, vendor_id, kind, data):
+        with self._lock:
+            self._seq = max(self._seq + 1, int(time.time() * 1000))
+            if len(self._events) == self._events.maxlen:
+                self._floor = self._events[0][0]
+            event_id = self._seq
+            self._events.append((event_id, vendor_id, kind, data))
+            wakeups, self._wakeups = self._wakeups, {}
+        for loop, future in wakeups.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, future)
+        return event_id
+
+    def last_id(self):
+        return self._seq
+
+    def backlog(self, vendor_id, after_id):
+        with self._lock:
+            events = [event for event in self._events
+                      if event[0] > after_id and event[1] == vendor_id]
+            return events, after_id < self._floor
+
+    async def abacklog(self, vendor_id, after_id):
+        return self.backlog(vendor_id, after_id)
+
+    async def alast_id(self):
+        return self._seq
+
+    async def wait(self, after_id, timeout):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._seq > after_id:
+                return True
+            future = self._wakeups.get(loop)
+            if future is None:
+                future = self._wakeups[loop] = loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class CacheBroker(BaseBroker):
+    """
+    Events kept in a shared Django cache, for multi-process deployments.
+
+    Ids come from an atomic ``incr`` on the cache, and each event is its
+    own key that expires after ``ttl`` seconds. Listeners poll the
+    sequence key every ``poll_interval`` seconds.
+    """
+
+    SEQ_KEY = 'events:seq'
+
+    def __init__(self, cache_alias='default', buffer_size=1000, ttl=3600,
+                 poll_interval=1.0):
+        self.cache = caches[cache_alias]
+        self.buffer_size = buffer_size
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def _key(self, event_id):
+        return f'events:{event_id}'
+
+    def publish(self, vendor_id, kind, data):
+        self.cache.add(self.SEQ_KEY, 0, None)
+        event_id = self.cache.incr(self.SEQ_KEY)
+        self.cache.set(self._key(event_id), (event_id, vendor_id, kind, data),
+                       self.ttl)
+        return event_id
+
+    def last_id(self):
+        return self.cache.get(self.SEQ_KEY, 0)
+
+    def backlog(self, vendor_id, after_id):
+        last = self.last_id()
+        start = max(after_id + 1, last - self.buffer_size + 1)
+        keys = [self._key(i) for i in range(start, last + 1)]
+        found = self.cache.get_many(keys)
+        events = [found[key] for key in keys
+                  if key in found and found[key][1] == vendor_id]
+        return events, start > after_id + 1 or len(found) < len(keys)
+
+    async def wait(self, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if await self.alast_id() > after_id:
+                return True
+            await asyncio.sleep(self.poll_interval)
+        return False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the broker configured in ``settings.EVENT_BROKER``."""
+    global _broker
+    if _broker is None:
+        config = getattr(settings, 'EVENT_BROKER', {})
+        backend = import_string(
+            config.get('BACKEND', 'shop.events.InProcessBroker'))
+        _broker = backend(**config.get('OPTIONS', {}))
+    return _broker
+
+
+def publish(vendor_ids, kind, data):
+    """Publish ``data`` to each vendor once the transaction commits."""
+    def send():
+        broker = get_broker()
+        for vendor_id in set(vendor_ids):
+            broker.publish(vendor_id, kind, data)
+    transaction.on_commit(send)
+
+
+def crossed_low_stock(old_stock, new_stock):
+    """True if stock has just fallen to the low-stock threshold."""
+    return (new_stock <= LOW_STOCK_THRESHOLD
+            and (old_stock is None or old_stock > LOW_STOCK_THRESHOLD))
+
+
+def publish_low_stock(product_ids):
+    """Send ``low_stock`` events for products to their vendors."""
+    if not product_ids:
+        return
+    for row in (Product.objects.filter(pk__in=product_ids)
+                .values('id', 'name', 'stock', 'store__vendor_id')):
+        publish([row['store__vendor_id']], 'low_stock', {
+            'product_id': row['id'], 'name': row['name'],
+            'stock': row['stock']})
@@ -0,0 +1,326 @@
+"""
+Inventory reservation ledger for the Giftmarket shop.
+
+Sellable stock lives in ``StockCounter`` rows (one or more shards per
+product). Stock moves through the ledger like this:
+
+* ``reserve`` takes stock from the counters with conditional
+  ``UPDATE ... WHERE available >= n`` statements and records a held
+  ``StockReservation`` that expires after ``RESERVATION_TTL``. This
+  happens when an item is added to the cart.
+* ``commit_order`` turns an order's holds into committed sales at
+  checkout.
+* ``release`` (cart removal), ``release_expired`` (the sweeper) and
+  ``release_orders`` (cancelled orders, committed stock included) put
+  stock back on the counters.
+
+Every change to the counters is written through to the availability
+cache in ``shop.availability``.
+
+Carts and checkout never write to ``Product`` rows. ``Product.stock`` is
+the vendor's on-hand figure, which ``sync_product_stock`` refreshes from
+the ledger for display. Until it runs, the figure still includes units
+sold since. A vendor edit is therefore applied to the counters as the
+change the vendor made (``set_stock`` with ``previous``), not as a new
+total, which would sell those units again.
+"""
+
+import random
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import availability, listing_cache
+from .catalog_cache import invalidate_products
+from .events import crossed_low_stock, publish_low_stock
+from .models import Product, StockCounter, StockReservation
+
+RESERVATION_TTL = timedelta(minutes=15)
+
+
+class InsufficientStock(Exception):
+    """Raised when a reservation cannot be satisfied."""
+
+    def __init__(self, product, requested):
+        self.product = product
+        self.requested = requested
+        super().__init__(
+            f"Sorry, not enough stock of {product.name} "
+            f"for {requested} more.")
+
+
+# -----------------------------
+# COUNTERS
+# -----------------------------
+
+def _held_totals(product_ids):
+    return dict(
+        StockReservation.objects.filter(product_id__in=product_ids,
+                                        status='held')
+        .values('product_id').annotate(n=Sum('quantity'))
+        .values_list('product_id', 'n')
+    )
+
+
+def ensure_counters(product):
+    """Create the first shard for a product that has no counters yet."""
+    counters = list(product.stock_counters.all())
+    if counters:
+        return counters
+    held = _held_totals([product.id]).get(product.id, 0)
+    counter, _ = StockCounter.objects.get_or_create(
+        product=product, shard=0,
+        defaults={'available': max(product.stock - held, 0)})
+    return [counter]
+
+
+def _distribute(counters, total):
+    base, extra = divmod(total, len(counters))
+    for i, counter in enumerate(counters):
+        counter.available = base + (1 if i < extra else 0)
+    StockCounter.objects.bulk_update(counters, ['available'])
+
+
+def set_stock(product, stock, previous=None):
+    """
+    Make ``stock`` the product's on-hand figure.
+
+    With ``previous`` (the figure the edit started from), the counters
+    move by ``stock - previous``. Otherwise they are set to ``stock`` net
+    of active holds, which is only right when ``stock`` is current.
+    """
+    with transaction.atomic():
+        had_counters = product.stock_counters.exists()
+        ensure_counters(product)  # new counters start from ``stock``
+        counters = list(StockCounter.objects.select_for_update()
+                        .filter(product=product).order_by('shard'))
+        if previous is None:
+            held = _held_totals([product.id]).get(product.id, 0)
+            _distribute(counters, max(stock - held, 0))
+        elif had_counters:
+            available = sum(counter.available for counter in counters)
+            _distribute(counters, max(available + stock - previous, 0))
+        availability.refresh([product.id])
+
+
+def shard_stock(product, shards):
+    """Split a product's available stock evenly over ``shards`` counters."""
+    if shards < 1:
+        raise ValueError("A product needs at least one stock shard.")
+    with transaction.atomic():
+        ensure_counters(product)
+        counters = list(StockCounter.objects.select_for_update()
+                        .filter(product=product).order_by('shard'))
+        total = sum(counter.available for counter in counters)
+
+        keep, removed = counters[:shards], counters[shards:]
+        if removed:
+            # Holds on removed shards move to shard 0 and return there.
+            StockReservation.objects.filter(counter__in=removed).update(
+                counter=keep[0])
+            StockCounter.objects.filter(
+                pk__in=[c.pk for c in removed]).delete()
+        keep += StockCounter.objects.bulk_create([
+            StockCounter(product=product, shard=shard)
+            for shard in range(len(keep), shards)
+        ])
+        _distribute(keep, total)
+
+
+# -----------------------------
+# RESERVE / RELEASE / COMMIT
+# -----------------------------
+
+def reserve(product, quantity, order_item=None, now=None):
+    """
+    Hold ``quantity`` units of ``product`` for ``order_item``.
+
+    Shards are tried in random order so concurrent buyers spread over
+    different rows; a large request may be filled from several shards.
+    Raises ``InsufficientStock`` (and takes nothing) if it cannot be met.
+    """
+    now = now or timezone.now()
+    remaining = quantity
+    holds = []
+    with transaction.atomic():
+        # A second pass re-reads the counters in case the first one raced
+        # with other buyers on the shards it picked.
+        for _ in range(2):
+            counters = ensure_counters(product)
+            random.shuffle(counters)
+            for counter in counters:
+                take = min(counter.available, remaining)
+                if take <= 0:
+                    continue
+                taken = StockCounter.objects.filter(
+                    pk=counter.pk, available__gte=take
+                ).update(available=F('available') - take)
+                if not taken:
+                    continue  # another buyer got there first
+                holds.append(StockReservation(
+                    product=product, counter=counter, order_item=order_item,
+                    quantity=take, expires_at=now + RESERVATION_TTL))
+                remaining -= take
+                if remaining == 0:
+                    availability.adjust({product.id: -quantity})
+                    return StockReservation.objects.bulk_create(holds)
+
+        # Rows already decremented are rolled back with the block.
+        raise InsufficientStock(product, quantity)
+
+
+def _return_to_counters(amounts):
+    for counter_id, amount in amounts.items():
+        StockCounter.objects.filter(pk=counter_id).update(
+            available=F('available') + amount)
+
+
+def release(order_item, quantity=None):
+    """Release ``quantity`` (default: all) held units of a cart line."""
+    with transaction.atomic():
+        holds = list(StockReservation.objects.select_for_update()
+                     .filter(order_item=order_item, status='held')
+                     .order_by('-created_at'))
+        remaining = (sum(h.quantity for h in holds)
+                     if quantity is None else quantity)
+        amounts = {}
+        for hold in holds:
+            if remaining == 0:
+                break
+            take = min(hold.quantity, remaining)
+            amounts[hold.counter_id] = amounts.get(hold.counter_id, 0) + take
+            if take == hold.quantity:
+                hold.status = 'released'
+            else:
+                hold.quantity -= take
+            hold.save(update_fields=['status', 'quantity'])
+            remaining -= take
+        _return_to_counters(amounts)
+        availability.adjust({order_item.product_id: sum(amounts.values())})
+
+
+def commit_order(order, now=None):
+    """
+    Commit the stock held for every line of ``order``.
+
+    Lines whose holds expired (or that were never held, e.g. merged guest
+    carts) are topped up first; raises ``InsufficientStock`` if that fails,
+    in which case nothing is committed.
+    """
+    with transaction.atomic():
+        items = list(order.items.select_related('product'))
+        held = {}
+        for hold in (StockReservation.objects.select_for_update()
+                     .filter(order_item__in=items, status='held')
+                     .only('order_item_id', 'quantity')):
+            held[hold.order_item_id] = (held.get(hold.order_item_id, 0)
+                                        + hold.quantity)
+        for item in items:
+            shortfall = item.quantity - held.get(item.id, 0)
+            if shortfall > 0:
+                reserve(item.product, shortfall, order_item=item, now=now)
+            elif shortfall < 0:
+                release(item, -shortfall)
+
+        StockReservation.objects.filter(
+            order_item__in=items, status='held').update(status='committed')
+
+
+def _release_holds(holds):
+    """Mark locked ``holds`` released and return their stock."""
+    amounts = {}
+    returned = {}
+    for hold in holds:
+        amounts[hold.counter_id] = (amounts.get(hold.counter_id, 0)
+                                    + hold.quantity)
+        returned[hold.product_id] = (returned.get(hold.product_id, 0)
+                                     + hold.quantity)
+    StockReservation.objects.filter(
+        pk__in=[h.pk for h in holds]).update(status='released')
+    _return_to_counters(amounts)
+    availability.adjust(returned)
+    return returned
+
+
+def release_expired(batch_size=500, now=None):
+    """
+    Release expired holds in short, bounded transactions.
+
+    Returns ``(released_count, product_ids_touched)``.
+    """
+    now = now or timezone.now()
+    released = 0
+    touched = set()
+    while True:
+        with transaction.atomic():
+            holds = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(status='held', expires_at__lt=now)
+                .order_by('expires_at')[:batch_size]
+            )
+            if not holds:
+                break
+            touched.update(_release_holds(holds))
+        released += len(holds)
+    return released, touched
+
+
+def release_orders(order_ids):
+    """
+    Put all stock held or sold for ``order_ids`` back on the counters.
+
+    Used when orders are cancelled; call it in the transaction that
+    cancels them. Returns ``{product_id: units returned}``.
+    """
+    with transaction.atomic():
+        holds = list(StockReservation.objects.select_for_update()
+                     .filter(order_item__order_id__in=list(order_ids),
+                             status__in=('held', 'committed')))
+        return _release_holds(holds)
+
+
+# -----------------------------
+# DISPLAY
+# -----------------------------
+
+def available_stock(product_ids):
+    """Return ``{product_id: units available to reserve}``."""
+    return dict(
+        StockCounter.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(n=Sum('available'))
+        .values_list('product_id', 'n')
+    )
+
+
+def sync_product_stock(product_ids=None):
+    """Refresh ``Product.stock`` (available + held) from the ledger."""
+    counters = StockCounter.objects.all()
+    if product_ids is not None:
+        counters = counters.filter(product_id__in=product_ids)
+    available = dict(
+        counters.values('product_id').annotate(n=Sum('available'))
+        .values_list('product_id', 'n')
+    )
+    held = _held_totals(list(available))
+
+    products = list(Product.objects.filter(pk__in=list(available))
+                    .only('id', 'stock', 'store_id'))
+    now = timezone.now()
+    changed = []
+    low = []
+    for product in products:
+        on_hand = available[product.id] + held.get(product.id, 0)
+        if product.stock != on_hand:
+            if crossed_low_stock(product.stock, on_hand):
+                low.append(product.id)
+            product.stock = on_hand
+            product.updated_at = now  # surfaces in the change feed
+            changed.append(product)
+    Product.objects.bulk_update(changed, ['stock', 'updated_at'],
+                                batch_size=500)
+    invalidate_products([product.id for product in changed])
+    listing_cache.bump('store', [product.store_id for product in changed])
+    publish_low_stock(low)
+    return len(changed)
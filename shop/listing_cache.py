@@ -0,0 +1,189 @@
+"""
+Version-keyed result cache for the public store and product listings.
+
+Every listing belongs to a scope: a store for its products, or a vendor
+for their stores. Each scope has a version counter under
+``listing:version:<scope>:<id>``, and cached results are keyed on it.
+The product and store signals in ``shop.signals`` call ``bump`` on a
+change. Once the change commits, every old result is unreachable in
+O(1), with no key scanning. Old entries simply expire.
+
+A listing's variant is built by ``variant`` from the query parameters it
+actually reads, and only from their known values, so a client cannot
+create new entries (or force recomputes) with made-up parameters. Results
+are cached with relative file URLs and made absolute per request, so the
+host is not part of the key either.
+
+Entries are fresh for ``LISTING_CACHE_TTL`` seconds (popularity sorts
+change without any save) and kept for ``LISTING_CACHE_STALE_TTL``
+seconds. One request per key recomputes an expired or invalidated
+result while holding a short cache lock. Meanwhile other requests are
+served the previous result (stale-while-revalidate). If there is no
+previous result, they wait briefly for the recompute.
+
+Hits, stale hits, misses, recomputes and waits are counted per process;
+``stats()`` returns them. Hits, stale hits and misses also go to
+``shop.metrics``.
+"""
+
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metrics
+
+LOCK_TIMEOUT = 10
+WAIT_STEP = 0.05
+MAX_WAIT = 2.0
+
+_stats_lock = threading.Lock()
+_stats = dict.fromkeys(('hit', 'stale', 'miss', 'recompute', 'wait'), 0)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+    if name in ('hit', 'stale', 'miss'):
+        metrics.inc('giftmarket_cache_requests_total', cache='listing',
+                    result=name)
+
+
+def stats():
+    """Copy of this process's cache counters."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def fresh_ttl():
+    return getattr(settings, 'LISTING_CACHE_TTL', 60)
+
+
+def stale_ttl():
+    return getattr(settings, 'LISTING_CACHE_STALE_TTL', 60 * 10)
+
+
+# -----------------------------
+# VERSIONS
+# -----------------------------
+
+def version_key(scope, scope_id):
+    return f'listing:version:{scope}:{scope_id}'
+
+
+def _initial_version():
+    # Start from the clock, so a version lost from the cache never
+    # comes back lower and reaches entries cached before it was lost.
+    return int(time.time() * 1000)
+
+
+def get_version(scope, scope_id):
+    """Current version of a scope (created on first use)."""
+    key = version_key(scope, scope_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def _bump_now(scope, scope_ids):
+    for scope_id in scope_ids:
+        key = version_key(scope, scope_id)
+        if not cache.add(key, _initial_version(), None):
+            try:
+                cache.incr(key)
+            except ValueError:  # evicted in between
+                cache.add(key, _initial_version(), None)
+
+
+def bump(scope, scope_ids):
+    """
+    Invalidate every cached listing of the given scope ids.
+
+    Runs once the transaction commits. Bumping earlier would let a
+    concurrent reader cache pre-commit data under the new version.
+    """
+    scope_ids = set(scope_ids)
+    transaction.on_commit(lambda: _bump_now(scope, scope_ids))
+
+
+# -----------------------------
+# CACHED RESULTS
+# -----------------------------
+
+def variant(query_params, allowed):
+    """
+    Cache variant of a listing request.
+
+    ``allowed`` maps each query parameter the listing reads to the values
+    that change its result. Other parameters and values are ignored.
+    """
+    return urlencode([(name, query_params[name]) for name in sorted(allowed)
+                      if query_params.get(name) in allowed[name]])
+
+
+def result_key(scope, scope_id, variant, version):
+    digest = hashlib.md5(variant.encode()).hexdigest()
+    return f'listing:{scope}:{scope_id}:{digest}:v{version}'
+
+
+def _store(key, data):
+    cache.set(key, (time.time() + fresh_ttl(), data), stale_ttl())
+
+
+def _recompute(key, lock_key, compute):
+    _count('recompute')
+    try:
+        data = compute()
+        _store(key, data)
+        return data
+    finally:
+        cache.delete(lock_key)
+
+
+def cached_result(scope, scope_id, variant, compute):
+    """
+    Return ``(data, status)`` for one listing.
+
+    ``variant`` (from ``variant()``) identifies the listing within its
+    scope. ``compute`` builds the data on a miss. ``status`` is one of
+    ``'hit'``, ``'stale'`` or ``'miss'``.
+    """
+    version = get_version(scope, scope_id)
+    key = result_key(scope, scope_id, variant, version)
+    previous_key = result_key(scope, scope_id, variant, version - 1)
+    found = cache.get_many([key, previous_key])
+
+    entry = found.get(key)
+    if entry is not None and entry[0] > time.time():
+        _count('hit')
+        return entry[1], 'hit'
+
+    # The latest result for this key, if any, even if out of date.
+    stale = entry or found.get(previous_key)
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        _count('miss')
+        return _recompute(key, lock_key, compute), 'miss'
+    if stale is not None:
+        _count('stale')
+        return stale[1], 'stale'
+
+    # Someone else is computing a result we have nothing for; wait.
+    _count('wait')
+    deadline = time.monotonic() + MAX_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            _count('hit')
+            return entry[1], 'hit'
+    _count('miss')
+    data = compute()  # the other request is too slow; do not pile up
+    _store(key, data)
+    return data, 'miss'
@@ -0,0 +1,157 @@
+"""
+Non-blocking structured logging for the Giftmarket shop.
+
+``settings.LOGGING`` sends records to ``QueueingHandler``. Its ``emit``
+only puts the record on a bounded in-memory queue. A ``QueueListener``
+thread formats the records as JSON lines and does the I/O to the real
+handler (stderr by default). A request thread never waits on a stream
+or file. If the listener falls behind and the queue fills up, records
+are dropped and counted (``giftmarket_log_records_dropped_total`` in
+``/metrics``), rather than stalling requests. The listener starts when
+logging is configured, i.e. in each worker process.
+
+Before a record is queued, two filters run in the logging thread:
+
+* ``RequestIdFilter`` stamps it with the current request id. That id is
+  set by ``RequestIdMiddleware`` from ``X-Request-ID``, or generated.
+* ``SampleDebugFilter`` keeps only ``LOG_DEBUG_SAMPLE_RATE`` of DEBUG
+  records. The choice is made per request, so a sampled request keeps
+  all of its debug lines.
+
+Use ordinary loggers and put structured fields in ``extra``::
+
+    logger = logging.getLogger(__name__)
+    logger.info("order placed", extra={'order_id': order.id})
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.utils.module_loading import import_string
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+# Attributes every LogRecord has; anything else came from ``extra``.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+_RECORD_ATTRS |= {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id (or None) as ``record.request_id``."""
+
+    def filter(self, record):
+        # django.request logs after the middleware has returned, but
+        # passes the request along.
+        record.request_id = request_id_var.get() or getattr(
+            getattr(record, 'request', None), 'request_id', None)
+        return True
+
+
+class SampleDebugFilter(logging.Filter):
+    """Keep a ``rate`` share of DEBUG records; other levels all pass."""
+
+    def __init__(self, rate=0.01):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            bucket = zlib.crc32(request_id.encode()) % 10000
+            return bucket < self.rate * 10000
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with ``extra`` fields included."""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, dt_timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class QueueingHandler(QueueHandler):
+    """
+    Queue records for a background ``QueueListener``.
+
+    ``target`` is the dotted path of the handler that does the I/O, and
+    ``target_kwargs`` are its arguments. It formats with
+    ``JsonFormatter``. The queue holds at most ``queue_size`` records.
+
+    Configure it with ``'()'`` rather than ``'class'``: from Python 3.12,
+    ``dictConfig`` builds ``'class'`` QueueHandlers its own way.
+    """
+
+    def __init__(self, target='logging.StreamHandler', target_kwargs=None,
+                 queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        sink = import_string(target)(**(target_kwargs or {}))
+        sink.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, sink)
+        self.listener.start()
+        self._stopped = False
+        atexit.register(self._stop_listener)
+
+    def _stop_listener(self):
+        """Drain the queue and stop the listener thread (once)."""
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def prepare(self, record):
+        # Merge args and render the traceback now, while they are valid;
+        # JSON formatting is left to the listener thread.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Imported here: logging is configured before apps load.
+            from . import metrics
+            metrics.inc('giftmarket_log_records_dropped_total')
+
+    def close(self):
+        self._stop_listener()
+        super().close()
+
+
+def new_request_id(header_value=None):
+    """A sane ``X-Request-ID`` from the client, or a fresh one."""
+    if header_value and REQUEST_ID_PATTERN.match(header_value):
+        return header_value
+    return f'{random.getrandbits(64):016x}'
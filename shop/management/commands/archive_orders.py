@@ -0,0 +1,71 @@
+"""Move old completed and cancelled orders into the archive tables."""
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import archive
+from shop.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+class Command(BaseCommand):
+    """Nightly job; safe to interrupt and run again."""
+    help = ('Archive completed/cancelled orders older than '
+            'ORDER_ARCHIVE_AFTER_DAYS and report table sizes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=None,
+            help='Override settings.ORDER_ARCHIVE_AFTER_DAYS.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Orders moved per transaction.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count the orders that would be archived.')
+
+    def handle(self, *args, **options):
+        cutoff = archive.archive_cutoff(options['older_than_days'])
+        if options['dry_run']:
+            count = archive.archivable_orders(cutoff).count()
+            self.stdout.write(
+                f"{count} orders created before {cutoff:%Y-%m-%d} "
+                f"would be archived.")
+            return
+
+        models = [Order, OrderItem, ArchivedOrder, ArchivedOrderItem]
+        before = archive.table_sizes(models)
+
+        started = time.monotonic()
+        orders, items = archive.archive_orders(
+            options['older_than_days'], options['batch_size'],
+            progress=lambda orders, items: self.stdout.write(
+                f"  archived {orders} orders so far"))
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {orders} orders ({items} lines) in {elapsed:.1f}s."))
+        self._report_sizes(models, before, archive.table_sizes(models))
+
+    def _report_sizes(self, models, before, after):
+        if before is None or after is None:
+            self.stdout.write("Table sizes are not available on this "
+                              "database.")
+            return
+        self.stdout.write(f"{'table':<28}{'data before':>14}{'after':>12}"
+                          f"{'index before':>14}{'after':>12}")
+        for model in models:
+            table = model._meta.db_table
+            data_before, index_before = before.get(table, (0, 0))
+            data_after, index_after = after.get(table, (0, 0))
+            self.stdout.write(
+                f"{table:<28}{_size(data_before):>14}{_size(data_after):>12}"
+                f"{_size(index_before):>14}{_size(index_after):>12}")
+
+
+def _size(num_bytes):
+    """Format a byte count as KB/MB/GB."""
+    for unit in ('KB', 'MB'):
+        num_bytes /= 1024
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+    return f"{num_bytes / 1024:.1f} GB"
@@ -0,0 +1,50 @@
+"""Rebuild the autocomplete index from the database and save a snapshot."""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import autocomplete
+
+
+class Command(BaseCommand):
+    """Run at deploy time and after popularity recomputes."""
+    help = ('Build the product/store autocomplete index, write it to '
+            'AUTOCOMPLETE_SNAPSHOT and report query latency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Override AUTOCOMPLETE_SNAPSHOT.')
+        parser.add_argument('--queries', type=int, default=1000,
+                            help='Sample queries for the latency report.')
+
+    def handle(self, *args, **options):
+        path = options['path'] or autocomplete.snapshot_path()
+        if not path:
+            raise CommandError("Set AUTOCOMPLETE_SNAPSHOT or pass --path.")
+
+        started = time.perf_counter()
+        index = autocomplete.build_index()
+        built = time.perf_counter() - started
+        autocomplete.save_snapshot(index, path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} products and stores in "
+            f"{built * 1000:.0f} ms; snapshot written to {path}."))
+
+        names = [name for _, _, name, _ in index.items()]
+        if not names or not options['queries']:
+            return
+        timings = []
+        for _ in range(options['queries']):
+            name = autocomplete.normalise(random.choice(names))
+            prefix = name[:random.randint(1, max(len(name), 1))]
+            index._short_cache.clear()  # measure uncached lookups
+            start = time.perf_counter()
+            index.search(prefix)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"Query latency over {len(timings)} prefixes: "
+            f"p50 {statistics.median(timings):.3f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99) - 1]:.3f} ms, "
+            f"max {timings[-1]:.3f} ms")
@@ -0,0 +1,72 @@
+"""Micro-benchmark: ModelSerializer vs ValuesSerializer on large lists."""
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.utils import timezone
+
+from shop.models import Product
+from shop.serializers import ProductSerializer, product_values_serializer
+
+
+class Command(BaseCommand):
+    """Time both read paths on in-memory rows (no database needed)."""
+    help = 'Compare list serialization speed for the product API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def _rows(self, count):
+        now = timezone.now()
+        return [
+            {
+                'id': i,
+                'store': 1 + i % 50,
+                'name': f'Product {i}',
+                'description': 'A lovely gift.',
+                'price': Decimal(f'{i % 1000}.{i % 100:02d}'),
+                'stock': i % 30,
+                'image': f'products/item_{i}.jpg',
+                'personalized_text': bool(i % 2),
+                'personalized_image': bool(i % 3),
+                'created_at': now - timedelta(minutes=i),
+                'updated_at': now,
+            }
+            for i in range(count)
+        ]
+
+    @staticmethod
+    def _best(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        rows = self._rows(options['rows'])
+        instances = [Product(**{('store_id' if k == 'store' else k): v
+                                for k, v in row.items()}) for row in rows]
+        request = RequestFactory().get('/api/stores/1/products/',
+                                      HTTP_HOST='localhost')
+
+        model_time, expected = self._best(
+            lambda: ProductSerializer(instances, many=True,
+                                      context={'request': request}).data,
+            options['repeat'])
+        values_time, actual = self._best(
+            lambda: product_values_serializer.serialize(rows, request),
+            options['repeat'])
+
+        if [dict(item) for item in expected] != actual:
+            raise CommandError("Outputs differ between serializers.")
+
+        self.stdout.write(
+            f"{options['rows']} rows, best of {options['repeat']}:\n"
+            f"  ModelSerializer:  {model_time * 1000:8.1f} ms\n"
+            f"  ValuesSerializer: {values_time * 1000:8.1f} ms\n"
+            f"  speedup:          {model_time / values_time:8.1f}x")
@@ -0,0 +1,128 @@
+"""Benchmark cold start: import time and memory of the WSGI app and check."""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter; prints one marker line with the results.
+PROBE = """\
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != 'darwin':
+    rss *= 1024  # Linux reports KiB
+print('STARTUP_BENCH ' + json.dumps({{'seconds': seconds, 'rss': rss}}))
+"""
+
+SCENARIOS = {
+    'wsgi': 'import Giftmarket.wsgi',
+    'check': ("from django.core.management import execute_from_command_line\n"
+              "execute_from_command_line(['manage.py', 'check'])"),
+}
+
+
+def parse_importtime(stderr):
+    """Return ``[(module, self_us, cumulative_us)]`` from -X importtime."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+class Command(BaseCommand):
+    """Each run starts a new interpreter, so nothing is cached."""
+    help = ('Measure import time and peak RSS of Giftmarket.wsgi and '
+            '"manage.py check", with a per-package -X importtime breakdown.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=12,
+                            help='Packages to list per scenario.')
+        parser.add_argument('--save', metavar='PATH',
+                            help='Write the results as a JSON baseline.')
+        parser.add_argument(
+            '--compare', metavar='PATH',
+            help='Fail if slower or bigger than this baseline.')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Allowed regression over the baseline (0.2 = 20%%).')
+
+    def _run(self, code):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'Giftmarket.settings')
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             PROBE.format(code=code)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        marker = [line for line in proc.stdout.splitlines()
+                  if line.startswith('STARTUP_BENCH ')]
+        if proc.returncode or not marker:
+            raise CommandError(f"Startup probe failed:\n{proc.stderr[-2000:]}")
+        result = json.loads(marker[-1].split(' ', 1)[1])
+        result['wall'] = wall
+        result['modules'] = parse_importtime(proc.stderr)
+        return result
+
+    def _report(self, name, runs, top):
+        seconds = statistics.median(run['seconds'] for run in runs)
+        wall = statistics.median(run['wall'] for run in runs)
+        rss = statistics.median(run['rss'] for run in runs)
+        modules = runs[-1]['modules']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{name}: {seconds * 1000:.0f} ms import/run, "
+            f"{wall * 1000:.0f} ms wall incl. interpreter, "
+            f"{rss / 2 ** 20:.1f} MiB peak RSS, {len(modules)} modules "
+            f"(median of {len(runs)})"))
+
+        packages = defaultdict(lambda: [0, 0])
+        for module, self_us, _ in modules:
+            entry = packages[module.split('.')[0]]
+            entry[0] += self_us
+            entry[1] += 1
+        for package, (self_us, count) in sorted(
+                packages.items(), key=lambda item: item[1][0],
+                reverse=True)[:top]:
+            self.stdout.write(f"  {package:<28}{self_us / 1000:>8.1f} ms"
+                              f"{count:>6} modules")
+        return {'seconds': seconds, 'rss': rss, 'modules': len(modules)}
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, code in SCENARIOS.items():
+            runs = [self._run(code) for _ in range(options['repeat'])]
+            results[name] = self._report(name, runs, options['top'])
+
+        if options['save']:
+            Path(options['save']).write_text(json.dumps(results, indent=2))
+        if options['compare']:
+            self._compare(results, json.loads(
+                Path(options['compare']).read_text()), options['tolerance'])
+
+    def _compare(self, results, baseline, tolerance):
+        failures = []
+        for name, result in results.items():
+            for metric in ('seconds', 'rss'):
+                before = baseline.get(name, {}).get(metric)
+                if before and result[metric] > before * (1 + tolerance):
+                    failures.append(
+                        f"{name} {metric}: {result[metric]:.3g} vs "
+                        f"baseline {before:.3g}")
+        if failures:
+            raise CommandError("Startup regression:\n  "
+                               + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS(
+            "Within tolerance of the baseline."))
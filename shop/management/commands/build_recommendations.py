@@ -0,0 +1,46 @@
+"""Rebuild "frequently bought together" recommendations."""
+from django.core.management.base import BaseCommand
+
+from shop import recommendations
+
+
+class Command(BaseCommand):
+    """Recompute the product co-purchase table from placed orders."""
+    help = 'Rebuild "frequently bought together" product recommendations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metric', choices=recommendations.METRICS,
+            default=recommendations.DEFAULT_METRIC,
+            help='Normalisation applied to co-purchase counts.')
+        parser.add_argument(
+            '--top-k', type=int, default=recommendations.TOP_K,
+            help='Neighbours stored per product.')
+        parser.add_argument(
+            '--product', type=int, action='append', dest='products',
+            help='Only refresh these product ids (repeatable).')
+        parser.add_argument(
+            '--pending', action='store_true',
+            help='Only refresh the products queued by recent checkouts.')
+
+    def handle(self, *args, **options):
+        metric, top_k = options['metric'], options['top_k']
+        if options['pending']:
+            products = recommendations.refresh_pending(
+                metric=metric, top_k=top_k)
+            self.stdout.write(self.style.SUCCESS(
+                f"Refreshed {products} queued products."))
+            return
+        if options['products']:
+            rows = recommendations.refresh_products(
+                options['products'], metric=metric, top_k=top_k)
+            self.stdout.write(self.style.SUCCESS(
+                f"Refreshed {len(options['products'])} products "
+                f"({rows} recommendations)."))
+            return
+
+        products, rows = recommendations.rebuild_all(
+            metric=metric, top_k=top_k)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt recommendations for {products} products "
+            f"({rows} rows)."))
@@ -0,0 +1,32 @@
+"""Retry stalled chunked uploads and remove abandoned ones."""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.uploads import expire_sessions, process_session, stalled_sessions
+
+
+class Command(BaseCommand):
+    """Run every few minutes from cron."""
+    help = ('Process uploads whose background worker died, and delete '
+            'sessions (and temporary files) idle for '
+            'CHUNKED_UPLOAD_SESSION_HOURS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-hours', type=int, default=None,
+            help='Override settings.CHUNKED_UPLOAD_SESSION_HOURS.')
+
+    def handle(self, *args, **options):
+        retried = 0
+        for session_id in stalled_sessions().values_list('pk', flat=True):
+            process_session(session_id)
+            retried += 1
+        idle_hours = options['idle_hours']
+        if idle_hours is None:
+            idle_hours = getattr(settings, 'CHUNKED_UPLOAD_SESSION_HOURS', 24)
+        expired = expire_sessions(timedelta(hours=idle_hours))
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {retried} stalled uploads; "
+            f"removed {expired} expired sessions."))
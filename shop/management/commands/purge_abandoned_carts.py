@@ -0,0 +1,38 @@
+"""Delete pending orders (carts) that have been idle for too long."""
+from django.core.management.base import BaseCommand
+
+from shop.cart import purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    """Nightly cleanup of abandoned carts."""
+    help = ('Delete pending orders with no cart activity for '
+            'CART_ABANDON_AFTER_DAYS, in small batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-days', type=int, default=None,
+            help='Override settings.CART_ABANDON_AFTER_DAYS.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Orders deleted per transaction.')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to sleep between batches.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Count abandoned carts without deleting them.')
+
+    def handle(self, *args, **options):
+        result = purge_abandoned_carts(
+            idle_days=options['idle_days'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            pause=options['pause'],
+        )
+        rate = result['orders'] / result['seconds'] if result['seconds'] else 0
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result['orders']} abandoned carts "
+            f"({result['items']} lines) in {result['seconds']:.1f}s "
+            f"({rate:.0f} carts/s)."))
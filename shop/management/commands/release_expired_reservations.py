@@ -0,0 +1,24 @@
+"""Release expired stock reservations back to the inventory counters."""
+from django.core.management.base import BaseCommand
+
+from shop import inventory
+
+
+class Command(BaseCommand):
+    """Sweeper for abandoned cart holds (run every few minutes)."""
+    help = 'Release expired stock reservations and refresh product stock.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Reservations released per transaction.')
+
+    def handle(self, *args, **options):
+        released, _ = inventory.release_expired(
+            batch_size=options['batch_size'])
+        # Checkouts commit sales without touching Product rows, so the
+        # displayed stock of every product is refreshed here.
+        synced = inventory.sync_product_stock()
+        self.stdout.write(self.style.SUCCESS(
+            f"Released {released} expired reservations; "
+            f"refreshed stock for {synced} products."))
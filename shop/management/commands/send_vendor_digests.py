@@ -0,0 +1,15 @@
+"""Email each vendor a digest of their new order lines."""
+from django.core.management.base import BaseCommand
+
+from shop.notifications import send_vendor_digests
+
+
+class Command(BaseCommand):
+    """Run every few minutes (cron, systemd timer, etc.)."""
+    help = 'Send batched new-order digests to vendors.'
+
+    def handle(self, *args, **options):
+        result = send_vendor_digests()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {result['vendors']} vendor digests covering "
+            f"{result['lines']} order lines."))
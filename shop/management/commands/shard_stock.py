@@ -0,0 +1,27 @@
+"""Split a hot product's stock over several counter rows."""
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import inventory
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    """Set the number of stock shards for a product (e.g. before a sale)."""
+    help = "Split a product's available stock over N counter rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(pk=options['product_id'])
+        except Product.DoesNotExist as exc:
+            raise CommandError("Product not found.") from exc
+        try:
+            inventory.shard_stock(product, options['shards'])
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(self.style.SUCCESS(
+            f"Product {product.id} now uses {options['shards']} "
+            f"stock shards."))
@@ -0,0 +1,61 @@
+"""Report the slowest signal receivers recorded by shop.profiling."""
+import shlex
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import profiling
+
+
+class Command(BaseCommand):
+    """Top-N signal receivers by total time, calls, worst case or queries."""
+    help = ('Print a top-N report of signal receiver timings collected '
+            'with SIGNAL_PROFILING, or profile one management command.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10,
+                            help='Number of receivers to show.')
+        parser.add_argument(
+            '--order', choices=['total', 'max', 'calls', 'queries'],
+            default='total', help='Sort key.')
+        parser.add_argument(
+            '--run', metavar='COMMAND',
+            help='Profile this command (e.g. "loaddata demo.json") '
+                 'instead of reading the collected totals. Needs '
+                 'SIGNAL_PROFILING=1.')
+        parser.add_argument('--reset', action='store_true',
+                            help='Clear the collected totals afterwards.')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            if not profiling.is_installed():
+                raise CommandError(
+                    "Set SIGNAL_PROFILING=1 so receivers are timed as "
+                    "they connect at startup.")
+            profiling.reset()
+            name, *command_args = shlex.split(options['run'])
+            call_command(name, *command_args)
+            stats = profiling.snapshot()
+        else:
+            stats = profiling.collected()
+
+        if not stats:
+            self.stdout.write("No signal receiver calls recorded. Set "
+                              "SIGNAL_PROFILING=1 or use --run.")
+            return
+
+        self.stdout.write(
+            f"{'signal':<14}{'receiver':<58}{'calls':>7}{'total ms':>11}"
+            f"{'mean':>8}{'p95':>8}{'max':>9}{'q/call':>8}")
+        for (signal, receiver), (calls, total, worst, queries, buckets) in \
+                profiling.top(stats, options['top'], options['order']):
+            p95 = profiling.percentile(buckets, 0.95)
+            if len(receiver) > 57:
+                receiver = '...' + receiver[-54:]
+            self.stdout.write(
+                f"{signal:<14}{receiver:<58}{calls:>7}{total:>11.1f}"
+                f"{total / calls:>8.2f}{'<' + format(p95, 'g'):>8}"
+                f"{worst:>9.2f}{queries / calls:>8.1f}")
+
+        if options['reset']:
+            profiling.clear_collected()
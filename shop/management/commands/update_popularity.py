@@ -0,0 +1,14 @@
+"""Recompute trending and bestseller scores for all products."""
+from django.core.management.base import BaseCommand
+
+from shop import popularity
+
+
+class Command(BaseCommand):
+    """Rebuild time-decayed popularity scores (run periodically, e.g. cron)."""
+    help = 'Recompute time-decayed trending and bestseller scores.'
+
+    def handle(self, *args, **options):
+        count = popularity.recompute_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated popularity scores for {count} products."))
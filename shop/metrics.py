@@ -0,0 +1,321 @@
+"""
+Runtime metrics for the Giftmarket shop, in Prometheus text format.
+
+``MetricsMiddleware`` records for every request:
+
+* latency per URL name and method
+* responses per URL name and status code
+* database queries and time spent in them, per URL name
+
+The catalog, availability and listing caches count their hits and
+misses. Queue and backlog depths are read from the database at scrape
+time.
+
+Recording is lock-free. Each thread adds to its own dicts, and the
+totals are only summed when read. With several worker processes (e.g.
+gunicorn), set ``METRICS_DIR`` to a directory shared by the workers and
+emptied on deploy. Each process then writes its totals to
+``<pid>.json`` in that directory, atomically, at most every
+``FLUSH_INTERVAL`` seconds. ``/metrics`` sums every file, so counters
+from restarted workers are kept.
+
+Queries are counted by ``count_queries``, an ``execute_wrapper`` that
+``ShopConfig.ready`` installs on every connection. It adds to the
+``QueryTimer`` of the current request, found through a context variable.
+That also works for async views, whose queries run in other threads.
+"""
+
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import (Order, RecommendationRefresh, StockReservation,
+                     UploadSession, VendorDigestMark)
+
+# Upper bounds (seconds) of the latency buckets; +Inf is implied.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FLUSH_INTERVAL = 5
+
+METRICS = {
+    'giftmarket_http_request_duration_seconds': (
+        'histogram', 'Request latency by URL name and method.'),
+    'giftmarket_http_responses_total': (
+        'counter', 'Responses by URL name and status code.'),
+    'giftmarket_db_queries_total': (
+        'counter', 'Database queries run by requests, by URL name.'),
+    'giftmarket_db_query_seconds_total': (
+        'counter', 'Time spent in database queries, by URL name.'),
+    'giftmarket_cache_requests_total': (
+        'counter', 'Cache lookups by cache and result (hit/miss/stale).'),
+    'giftmarket_log_records_dropped_total': (
+        'counter', 'Log records dropped because the log queue was full.'),
+    'giftmarket_queue_depth': (
+        'gauge', 'Items waiting in background queues and backlogs.'),
+}
+
+_local = threading.local()
+_shards = []  # one (counters, histograms) pair per thread
+_shards_lock = threading.Lock()
+_last_flush = 0.0
+_query_timer = contextvars.ContextVar('metrics_query_timer', default=None)
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+# -----------------------------
+# RECORDING (PER THREAD, NO LOCKS)
+# -----------------------------
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = ({}, {})
+        with _shards_lock:  # once per thread
+            _shards.append(shard)
+    return shard
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    counters = _shard()[0]
+    key = (name, _labels(labels))
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record one histogram observation."""
+    histograms = _shard()[1]
+    key = (name, _labels(labels))
+    entry = histograms.get(key)
+    if entry is None:
+        # Bucket counts (non-cumulative), then sum and count.
+        entry = histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+    entry[bisect.bisect_left(BUCKETS, value)] += 1
+    entry[-2] += value
+    entry[-1] += 1
+
+
+class QueryTimer:
+    """``execute_wrapper`` that counts and times queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def count_queries(execute, sql, params, many, context):
+    """``execute_wrapper`` passing queries to the request's QueryTimer."""
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    """``connection_created`` receiver: add ``count_queries`` (once)."""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def start_request():
+    """Start timing the current request's queries; returns a token."""
+    return _query_timer.set(QueryTimer())
+
+
+def finish_request(token):
+    """Stop timing and return the request's ``QueryTimer``."""
+    timer = _query_timer.get()
+    _query_timer.reset(token)
+    return timer
+
+
+def cache_lookups(cache_name, hits, misses):
+    """Count a (batch) cache lookup."""
+    if hits:
+        inc('giftmarket_cache_requests_total', hits, cache=cache_name,
+            result='hit')
+    if misses:
+        inc('giftmarket_cache_requests_total', misses, cache=cache_name,
+            result='miss')
+
+
+# -----------------------------
+# AGGREGATION
+# -----------------------------
+
+def snapshot():
+    """This process's totals as ``{'counters': ..., 'histograms': ...}``."""
+    with _shards_lock:
+        shards = list(_shards)
+    counters, histograms = {}, {}
+    for shard_counters, shard_histograms in shards:
+        for key, value in list(shard_counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, entry in list(shard_histograms.items()):
+            total = histograms.get(key)
+            histograms[key] = (list(entry) if total is None
+                               else [a + b for a, b in zip(total, entry)])
+    return {'counters': counters, 'histograms': histograms}
+
+
+def merge(*snapshots):
+    merged = {'counters': {}, 'histograms': {}}
+    for snap in snapshots:
+        for key, value in snap['counters'].items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + value
+        for key, entry in snap['histograms'].items():
+            total = merged['histograms'].get(key)
+            merged['histograms'][key] = (
+                list(entry) if total is None
+                else [a + b for a, b in zip(total, entry)])
+    return merged
+
+
+def _encode(snap):
+    return {kind: [[name, list(labels), value]
+                   for (name, labels), value in values.items()]
+            for kind, values in snap.items()}
+
+
+def _decode(data):
+    return {kind: {(name, tuple(tuple(pair) for pair in labels)): value
+                   for name, labels, value in data.get(kind, [])}
+            for kind in ('counters', 'histograms')}
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush_due():
+    """Whether ``flush`` would write now (cheap; for async callers)."""
+    return (bool(metrics_dir())
+            and time.monotonic() - _last_flush >= FLUSH_INTERVAL)
+
+
+def flush(force=False):
+    """Write this process's totals to ``METRICS_DIR`` (rate-limited)."""
+    global _last_flush
+    directory = metrics_dir()
+    now = time.monotonic()
+    if not directory or (not force and now - _last_flush < FLUSH_INTERVAL):
+        return
+    _last_flush = now
+    path = Path(directory) / f'{os.getpid()}.json'
+    tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+    tmp_path.write_text(json.dumps(_encode(snapshot())))
+    os.replace(tmp_path, path)  # readers never see a partial file
+
+
+def collected():
+    """Totals of every process (just this one without ``METRICS_DIR``)."""
+    directory = metrics_dir()
+    if not directory:
+        return snapshot()
+    flush(force=True)
+    snapshots = []
+    for path in Path(directory).glob('*.json'):
+        try:
+            snapshots.append(_decode(json.loads(path.read_text())))
+        except (OSError, ValueError):
+            continue  # removed or being replaced; skip this scrape
+    return merge(*snapshots)
+
+
+# -----------------------------
+# SCRAPE-TIME GAUGES
+# -----------------------------
+
+def queue_depths():
+    """Return ``{queue: depth}`` for the shop's background backlogs."""
+    depths = {
+        'stock_holds': StockReservation.objects.filter(
+            status='held').count(),
+        'uploads_open': UploadSession.objects.filter(status='open').count(),
+        'uploads_processing': UploadSession.objects.filter(
+            status='processing').count(),
+        'recommendation_refresh': RecommendationRefresh.objects.count(),
+    }
+    mark = (VendorDigestMark.objects.filter(vendor__isnull=True)
+            .values_list('notified_through', flat=True).first())
+    placed = Order.objects.filter(status__in=Order.PURCHASED_STATUSES,
+                                  placed_at__isnull=False)
+    if mark is not None:
+        placed = placed.filter(placed_at__gt=mark)
+    depths['vendor_digest_outbox'] = placed.count()
+    return depths
+
+
+# -----------------------------
+# PROMETHEUS TEXT FORMAT
+# -----------------------------
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"'
+                          for key, value in pairs) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(snap, gauges=None):
+    """Prometheus text exposition (format 0.0.4) of ``snap`` and gauges."""
+    samples = {name: [] for name in METRICS}
+    for (name, labels), value in sorted(snap['counters'].items()):
+        samples.setdefault(name, []).append(
+            f'{name}{_format_labels(labels)} {_format_number(value)}')
+    for (name, labels), entry in sorted(snap['histograms'].items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), entry[:-2]):
+            cumulative += count
+            samples.setdefault(name, []).append(
+                f'{name}_bucket{_format_labels(labels, [("le", bound)])} '
+                f'{cumulative}')
+        samples[name].append(f'{name}_sum{_format_labels(labels)} '
+                             f'{_format_number(entry[-2])}')
+        samples[name].append(f'{name}_count{_format_labels(labels)} '
+                             f'{entry[-1]}')
+    for queue, depth in sorted((gauges or {}).items()):
+        samples['giftmarket_queue_depth'].append(
+            f'giftmarket_queue_depth{{queue="{_escape(queue)}"}} {depth}')
+
+    lines = []
+    for name, lines_for_name in samples.items():
+        if not lines_for_name:
+            continue
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(lines_for_name)
+    return '\n'.join(lines) + '\n'
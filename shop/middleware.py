@@ -0,0 +1,217 @@
+"""
+Middleware for the Giftmarket shop application.
+
+Every class here works natively under both WSGI and ASGI (see
+``HybridMiddleware``), so async views and event streams are not pushed
+onto a thread by the middleware in front of them.
+"""
+
+import time
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics, profiling
+from .log import new_request_id, request_id_var
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class HybridMiddleware:
+    """
+    Base for sync-and-async middleware.
+
+    Subclasses implement ``handle`` (sync) and ``ahandle`` (async); the
+    one matching the next handler in the chain is used.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.ahandle(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def ahandle(self, request):
+        raise NotImplementedError
+
+
+class GuestCartMiddleware(HybridMiddleware):
+    """Persist guest cart changes made during the request to its cookie."""
+
+    def handle(self, request):
+        return self._save_carts(request, self.get_response(request))
+
+    async def ahandle(self, request):
+        return self._save_carts(request, await self.get_response(request))
+
+    @staticmethod
+    def _save_carts(request, response):
+        # Only sets a cookie: a logged-in buyer's cart saves nothing here.
+        for attr in ('_guest_cart', '_cart'):
+            cart = getattr(request, attr, None)
+            if cart is not None:
+                cart.save(response)
+        return response
+
+
+class RequestIdMiddleware(HybridMiddleware):
+    """
+    Give every request an id for its log records (see ``shop.log``).
+
+    A well-formed ``X-Request-ID`` from a proxy is kept; otherwise one is
+    generated. The id is echoed in the response's ``X-Request-ID``. On
+    the async path the context variable is set in the request's task,
+    and ``sync_to_async`` copies it into the threads the view uses.
+    """
+
+    def _start(self, request):
+        request.request_id = new_request_id(
+            request.headers.get('X-Request-ID'))
+        return request_id_var.set(request.request_id)
+
+    def handle(self, request):
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    async def ahandle(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Record latency, status and database use per URL name for
+    ``/metrics`` (see ``shop.metrics``). Disabled by
+    ``METRICS_ENABLED = False``.
+
+    Queries are counted through a context variable rather than a
+    per-request ``execute_wrapper``: async views run their queries on
+    other threads' connections.
+    """
+
+    def __init__(self, get_response):
+        if not metrics.is_enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def handle(self, request):
+        # Connections opened before the app was ready lack the wrapper.
+        metrics.install_query_counter(connection=connection)
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timer = metrics.finish_request(token)
+        self._record(request, response, timer,
+                     time.perf_counter() - started)
+        metrics.flush()
+        return response
+
+    async def ahandle(self, request):
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timer = metrics.finish_request(token)
+        self._record(request, response, timer,
+                     time.perf_counter() - started)
+        if metrics.flush_due():
+            await sync_to_async(metrics.flush)()
+        return response
+
+    @staticmethod
+    def _record(request, response, timer, duration):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS \
+            else 'other'
+        metrics.observe('giftmarket_http_request_duration_seconds',
+                        duration, view=view, method=method)
+        metrics.inc('giftmarket_http_responses_total', view=view,
+                    status=response.status_code)
+        metrics.inc('giftmarket_db_queries_total', timer.count, view=view)
+        metrics.inc('giftmarket_db_query_seconds_total', timer.seconds,
+                    view=view)
+
+
+class RequestProfilerMiddleware(HybridMiddleware):
+    """
+    Report the signal receivers run by a request in ``Server-Timing``.
+
+    Only active with ``SIGNAL_PROFILING``; the header is only added for
+    staff users or under DEBUG. Totals are also saved for
+    ``manage.py signal_profile``.
+    """
+    max_entries = 10
+
+    def __init__(self, get_response):
+        if not profiling.is_enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def handle(self, request):
+        token = profiling.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            calls = profiling.finish_request(token)
+            profiling.flush()
+
+        user = getattr(request, 'user', None)
+        if calls and (settings.DEBUG or getattr(user, 'is_staff', False)):
+            response['Server-Timing'] = self._server_timing(calls)
+        return response
+
+    async def ahandle(self, request):
+        token = profiling.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            calls = profiling.finish_request(token)
+            if profiling.flush_due():
+                await sync_to_async(profiling.flush)()
+
+        if calls and not settings.DEBUG and hasattr(request, 'auser'):
+            user = await request.auser()  # never load it on the loop
+            if not user.is_staff:
+                calls = None
+        if calls:
+            response['Server-Timing'] = self._server_timing(calls)
+        return response
+
+    def _server_timing(self, calls):
+        total = sum(ms for _, ms, _ in calls)
+        queries = sum(q for _, _, q in calls)
+        entries = [f'signals;dur={total:.2f};'
+                   f'desc="{len(calls)} receivers, {queries} queries"']
+        slowest = sorted(calls, key=lambda call: call[1], reverse=True)
+        for i, ((signal, receiver), ms, q) in enumerate(
+                slowest[:self.max_entries], start=1):
+            entries.append(f'signal-{i};dur={ms:.2f};'
+                           f'desc="{signal} {receiver} ({q} queries)"')
+        return ', '.join(entries)
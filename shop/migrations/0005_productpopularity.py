@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-19 12:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='shop.product')),
+                ('trending_score', models.FloatField(db_index=True, default=0)),
+                ('bestseller_score', models.FloatField(db_index=True, default=0)),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('average_rating', models.FloatField(blank=True, null=True)),
+                ('scored_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-19 12:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_cart_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorDigestMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notified_through', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='placed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['placed_at'], name='order_placed_at'),
+        ),
+        migrations.AddField(
+            model_name='vendordigestmark',
+            name='vendor',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='digest_mark', to='shop.vendorprofile'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 """Models for Giftmarket application including custom user model,
 vendor profiles, products, orders, and reviews."""
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
@@ -49,6 +51,14 @@ class Store(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """The change feed pages stores by (updated_at, id)."""
+        indexes = [
+            models.Index(fields=['updated_at', 'id'],
+                         name='store_updated_id'),
+        ]
 
     def __str__(self):
         return str(self.name)
@@ -75,6 +85,20 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        """The change feed pages products by (updated_at, id)."""
+        indexes = [
+            models.Index(fields=['updated_at', 'id'],
+                         name='product_updated_id'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded stock so edits to it can be detected."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock = instance.__dict__.get('stock')
+        return instance
+
     def __str__(self):
         return f"{self.name} by {self.store.name}"
 
@@ -110,6 +134,17 @@ class Order(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
     )
+    # Statuses of orders that have been paid for (past checkout).
+    PURCHASED_STATUSES = ('processing', 'shipped', 'completed')
+    # Allowed moves (see shop.order_status); pending -> processing is
+    # checkout's.
+    TRANSITIONS = {
+        'pending': ('processing',),
+        'processing': ('shipped', 'cancelled'),
+        'shipped': ('completed',),
+        'completed': (),
+        'cancelled': (),
+    }
     buyer = models.ForeignKey(User, on_delete=models.CASCADE,
                               related_name='orders')
     total_price = models.DecimalField(max_digits=10, 
@@ -117,6 +152,28 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES,
                               default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set at checkout; vendor digests pick up orders by this time.
+    placed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """Carts are looked up by (buyer, status='pending')."""
+        indexes = [
+            models.Index(fields=['buyer', 'status'],
+                         name='order_buyer_status'),
+            models.Index(fields=['placed_at'], name='order_placed_at'),
+            # Admin changelist filtered by status, newest first.
+            models.Index(fields=['status', 'id'], name='order_status_id'),
+            # Order history pages, newest first.
+            models.Index(fields=['buyer', 'created_at', 'id'],
+                         name='order_buyer_created'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded status so transitions can be detected."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
 
     def __str__(self):
         return f"Order #{self.id or 'unsaved'} by {self.buyer}"
@@ -132,6 +189,15 @@ class OrderItem(models.Model):
     personalized_image = models.ImageField(upload_to='personalized_images/',
                                            blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Last cart activity on this line; idle carts are purged.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """One line per product per order, so carts can be upserted."""
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'],
+                                    name='unique_order_product'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
@@ -152,7 +218,256 @@ class Review(models.Model):
     class Meta:
         """Ensure a user can only leave one review per product."""
         unique_together = ('product', 'user')
+        indexes = [
+            models.Index(fields=['product', 'created_at'],
+                         name='review_product_created'),
+        ]
 
     def __str__(self):
         status = "Verified" if self.verified_purchase else "Unverified"
         return f"{status} review by {self.user.username} for {self.product.name}"
+
+
+# 7. Recommendations
+class ProductRecommendation(models.Model):
+    """Precomputed "frequently bought together" neighbour of a product.
+
+    Rows are written in bulk by ``shop.recommendations``; ``rank`` 1 is the
+    strongest neighbour, so a product's list is one indexed range scan.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                    related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        """Ranks are unique per product and double as the lookup index."""
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'],
+                                    name='unique_product_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} for product {self.product_id}"
+
+
+class RecommendationRefresh(models.Model):
+    """A product whose recommendations are due for a refresh.
+
+    Queued at checkout and worked off by ``manage.py build_recommendations
+    --pending``; re-queuing a product only moves ``queued_at``.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE,
+                                   primary_key=True, related_name='+')
+    queued_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Refresh recommendations of product {self.product_id}"
+
+
+# 8. Popularity
+class ProductPopularity(models.Model):
+    """Time-decayed popularity scores for a product.
+
+    Kept in a side table so score refreshes never touch ``Product`` rows.
+    Recomputed in bulk by ``manage.py update_popularity`` and nudged at
+    checkout by ``shop.popularity.record_order``.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE,
+                                   primary_key=True,
+                                   related_name='popularity')
+    trending_score = models.FloatField(default=0, db_index=True)
+    bestseller_score = models.FloatField(default=0, db_index=True)
+    units_sold = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(null=True, blank=True)
+    scored_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Popularity of product {self.product_id}"
+
+
+# 9. Inventory
+class StockCounter(models.Model):
+    """One shard of a product's available (unreserved) stock.
+
+    Hot products can be split over several shards so concurrent
+    reservations lock different rows instead of queueing on one.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='stock_counters')
+    shard = models.PositiveSmallIntegerField(default=0)
+    available = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """One row per shard of each product."""
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'],
+                                    name='unique_product_stock_shard'),
+        ]
+
+    def __str__(self):
+        return f"Product {self.product_id} shard {self.shard}"
+
+
+class StockReservation(models.Model):
+    """Stock taken from a counter for a cart line, until it expires."""
+    STATUS_CHOICES = (
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='stock_reservations')
+    counter = models.ForeignKey(StockCounter, on_delete=models.CASCADE,
+                                related_name='reservations')
+    order_item = models.ForeignKey(OrderItem, on_delete=models.SET_NULL,
+                                   null=True, blank=True,
+                                   related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """The sweeper scans held reservations by expiry."""
+        indexes = [
+            models.Index(fields=['status', 'expires_at'],
+                         name='reservation_status_expiry'),
+        ]
+
+    def __str__(self):
+        return (f"{self.quantity} x product {self.product_id} "
+                f"({self.status})")
+
+
+# 10. Change feed
+class CatalogTombstone(models.Model):
+    """Record of a deleted product or store, for the change feed."""
+    KIND_CHOICES = (
+        ('product', 'Product'),
+        ('store', 'Store'),
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """The change feed pages tombstones by (deleted_at, id)."""
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'],
+                         name='tombstone_deleted_id'),
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
+
+
+# 11. Archived orders
+class ArchivedOrder(models.Model):
+    """Completed or cancelled order moved out of the live tables."""
+    id = models.BigIntegerField(primary_key=True)  # the original Order id
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE,
+                              related_name='archived_orders')
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    placed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """Order history lists a buyer's orders newest first."""
+        indexes = [
+            models.Index(fields=['buyer', 'created_at'],
+                         name='archived_order_buyer_created'),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.id} by {self.buyer} (archived)"
+
+
+class ArchivedOrderItem(models.Model):
+    """Line of an archived order."""
+    id = models.BigIntegerField(primary_key=True)  # the original OrderItem id
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE,
+                              related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    personalized_text = models.CharField(max_length=255, blank=True, null=True)
+    personalized_image = models.ImageField(upload_to='personalized_images/',
+                                           blank=True, null=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name}"
+
+
+# 12. Vendor notifications
+class VendorDigestMark(models.Model):
+    """
+    High-water mark of the new-order digests: lines of orders placed up to
+    ``notified_through`` have been sent. The row without a vendor is the
+    mark for every vendor that has no row of its own.
+    """
+    vendor = models.OneToOneField(VendorProfile, on_delete=models.CASCADE,
+                                  null=True, blank=True,
+                                  related_name='digest_mark')
+    notified_through = models.DateTimeField()
+
+    def __str__(self):
+        return (f"Digests for {self.vendor or 'all vendors'} "
+                f"through {self.notified_through}")
+
+
+# 13. Chunked uploads
+class UploadSession(models.Model):
+    """
+    A resumable upload of one image, sent as numbered chunks.
+
+    Chunks are written to a temporary file (see ``shop.uploads``); the
+    image is validated and attached to its target once complete.
+    """
+    TARGET_CHOICES = (
+        ('product_image', 'Product image'),
+        ('personalized_image', 'Personalized image'),
+    )
+    STATUS_CHOICES = (
+        ('open', 'Open'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='upload_sessions')
+    # A Product id or an OrderItem id, depending on the target.
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    target_id = models.BigIntegerField()
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    received = models.JSONField(default=list)  # numbers of stored chunks
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default='open')
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """The sweeper finds stale sessions by (status, updated_at)."""
+        indexes = [
+            models.Index(fields=['status', 'updated_at'],
+                         name='upload_status_updated'),
+        ]
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.target}, {self.status})"
@@ -0,0 +1,118 @@
+"""
+Batched new-order digests for vendors.
+
+``send_vendor_digests`` (``manage.py send_vendor_digests``, run every few
+minutes) gathers the order lines placed since each vendor's high-water
+mark. Each vendor gets one email listing them. The templates are loaded
+once per batch, and all digests go out over a single mail connection.
+
+Marks live in ``VendorDigestMark``. After a run where every digest was
+sent, the shared mark moves to the end of the window and per-vendor rows
+are dropped. If the mail server fails part-way, only the vendors already
+sent get their own mark, so nobody is sent the same line twice. The
+others are retried next run. Orders placed in the last ``SETTLE_DELAY``
+wait for the next run, so a checkout still committing is not skipped.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.defaultfilters import pluralize
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import Order, OrderItem, VendorDigestMark
+
+SETTLE_DELAY = timedelta(seconds=60)
+
+
+def _marks(until):
+    """Return ``(default_mark, {vendor_id: mark})``."""
+    default, _ = VendorDigestMark.objects.get_or_create(
+        vendor=None, defaults={'notified_through': until})
+    own = dict(VendorDigestMark.objects.filter(vendor__isnull=False)
+               .values_list('vendor_id', 'notified_through'))
+    return default, own
+
+
+def pending_lines(until):
+    """Group lines placed after each vendor's mark (up to ``until``)."""
+    default, own = _marks(until)
+    since = min([default.notified_through, *own.values()])
+    lines = (
+        OrderItem.objects.filter(
+            order__status__in=Order.PURCHASED_STATUSES,
+            order__placed_at__gt=since, order__placed_at__lte=until)
+        .values('order_id', 'order__placed_at', 'product__name', 'quantity',
+                'price', 'product__store__name',
+                'product__store__vendor_id',
+                'product__store__vendor__user__username',
+                'product__store__vendor__user__email')
+        .order_by('order__placed_at', 'order_id')
+    )
+    by_vendor = defaultdict(list)
+    for line in lines:
+        vendor_id = line['product__store__vendor_id']
+        if line['order__placed_at'] > own.get(vendor_id,
+                                              default.notified_through):
+            by_vendor[vendor_id].append(line)
+    return default, by_vendor
+
+
+def _render(vendor_lines, templates):
+    first = vendor_lines[0]
+    context = {
+        'username': first['product__store__vendor__user__username'],
+        'lines': vendor_lines,
+        'orders': len({line['order_id'] for line in vendor_lines}),
+        'total': sum(line['price'] * line['quantity']
+                     for line in vendor_lines),
+    }
+    text, html = (template.render(context) for template in templates)
+    count = len(vendor_lines)
+    message = EmailMultiAlternatives(
+        subject=f"{count} new order line{pluralize(count)} on Giftmarket",
+        body=text, from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[first['product__store__vendor__user__email']])
+    message.attach_alternative(html, 'text/html')
+    return message
+
+
+def send_vendor_digests(now=None):
+    """
+    Send one digest per vendor with new order lines.
+
+    Returns ``{'vendors': sent, 'lines': lines_sent}``.
+    """
+    until = (now or timezone.now()) - SETTLE_DELAY
+    default, by_vendor = pending_lines(until)
+    templates = (get_template('shop/email_vendor_digest.txt'),
+                 get_template('shop/email_vendor_digest.html'))
+
+    sent = []
+    lines_sent = 0
+    try:
+        with get_connection() as connection:
+            for vendor_id, vendor_lines in by_vendor.items():
+                if vendor_lines[0]['product__store__vendor__user__email']:
+                    connection.send_messages(
+                        [_render(vendor_lines, templates)])
+                    lines_sent += len(vendor_lines)
+                sent.append(vendor_id)
+    finally:
+        with transaction.atomic():
+            if len(sent) == len(by_vendor):
+                default.notified_through = until
+                default.save(update_fields=['notified_through'])
+                VendorDigestMark.objects.filter(
+                    vendor__isnull=False, notified_through__lte=until
+                ).delete()
+            else:
+                for vendor_id in sent:
+                    VendorDigestMark.objects.update_or_create(
+                        vendor_id=vendor_id,
+                        defaults={'notified_through': until})
+    return {'vendors': len(sent), 'lines': lines_sent}
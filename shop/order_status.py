@@ -0,0 +1,104 @@
+"""
+Order state machine for the Giftmarket shop.
+
+``Order.TRANSITIONS`` lists the allowed moves:
+
+    pending -> processing -> shipped -> completed
+                          \\-> cancelled
+
+Checkout makes the pending -> processing move. ``bulk_transition``
+handles the later ones for many orders at once. Inside one transaction,
+it locks the orders that may move and changes them all with a single
+``UPDATE ... WHERE status IN (...)``. Each vendor then gets one
+``order_status_batch`` event for the batch, instead of one event per
+order. Queryset updates bypass ``post_save``, so the per-order
+``order_status`` event is not sent as well. Cancelling returns the
+orders' reserved stock in the same transaction.
+"""
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .events import publish
+from .inventory import release_orders
+from .models import Order, OrderItem
+
+
+def can_transition(current, status):
+    return status in Order.TRANSITIONS.get(current, ())
+
+
+def sources(status):
+    """Statuses an order can move to ``status`` from."""
+    return [current for current, targets in Order.TRANSITIONS.items()
+            if status in targets]
+
+
+def owned_by(queryset, vendor):
+    """
+    Orders whose lines all belong to ``vendor``.
+
+    An order's status is shared by all its lines, so a vendor only moves
+    orders nobody else sells into; mixed orders are left to staff.
+    """
+    lines = OrderItem.objects.filter(order=OuterRef('pk'))
+    return (queryset
+            .filter(Exists(lines.filter(product__store__vendor=vendor)))
+            .exclude(Exists(lines.exclude(product__store__vendor=vendor))))
+
+
+def _publish_batch(status, previous):
+    vendor_orders = {}
+    for order_id, vendor_id in (
+            OrderItem.objects.filter(order_id__in=list(previous))
+            .values_list('order_id', 'product__store__vendor_id')
+            .distinct()):
+        vendor_orders.setdefault(vendor_id, []).append(order_id)
+    for vendor_id, order_ids in vendor_orders.items():
+        publish([vendor_id], 'order_status_batch', {
+            'status': status,
+            'orders': [{'order_id': order_id, 'previous': previous[order_id]}
+                       for order_id in sorted(order_ids)],
+        })
+
+
+def bulk_transition(order_ids, status, vendor=None):
+    """
+    Move the given orders to ``status`` where that is allowed.
+
+    With ``vendor``, only that vendor's own orders are considered (see
+    ``owned_by``). Returns ``(changed_ids, rejected)``. ``rejected``
+    lists ``{'id', 'reason'}`` dicts: ``reason`` is ``'not_found'`` or
+    ``'invalid_transition'``, and the latter includes the current
+    ``status``.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    allowed = sources(status)
+    orders = Order.objects.filter(pk__in=order_ids)
+    if vendor is not None:
+        orders = owned_by(orders, vendor)
+
+    with transaction.atomic():
+        previous = dict(orders.filter(status__in=allowed)
+                        .select_for_update()
+                        .values_list('pk', 'status'))
+        if previous:
+            Order.objects.filter(pk__in=list(previous),
+                                 status__in=allowed).update(status=status)
+            if status == 'cancelled':
+                release_orders(list(previous))
+            _publish_batch(status, previous)
+        current = dict(orders.exclude(pk__in=list(previous))
+                       .values_list('pk', 'status'))
+
+    changed = [order_id for order_id in order_ids if order_id in previous]
+    rejected = []
+    for order_id in order_ids:
+        if order_id in previous:
+            continue
+        if order_id in current:
+            rejected.append({'id': order_id, 'reason': 'invalid_transition',
+                             'status': current[order_id]})
+        else:
+            rejected.append({'id': order_id, 'reason': 'not_found'})
+    return changed, rejected
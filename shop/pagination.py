@@ -0,0 +1,64 @@
+"""Giftmarket Shop API and admin pagination"""
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class ReviewCursorPagination(CursorPagination):
+    """Keyset pagination over reviews, newest first.
+
+    Pages seek on ``created_at`` instead of using OFFSET, so deep pages
+    cost the same as the first one.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+def estimated_row_count(model):
+    """
+    Planner estimate of a model's row count, or None if unavailable.
+
+    Read from PostgreSQL/MySQL table statistics, so it costs nothing on
+    any table size; SQLite has no such estimate.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:  # never analyzed
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Admin paginator that never runs ``COUNT(*)`` over a whole table.
+
+    An unfiltered list uses the planner's row estimate once the table is
+    past ``exact_count_limit`` rows. A filtered list counts at most
+    ``max_count`` matches; deeper pages are reached by narrowing the
+    filter or search.
+    """
+    exact_count_limit = 10000
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model)
+            if estimate is not None and estimate > self.exact_count_limit:
+                return estimate
+            return queryset.count()
+        return queryset.order_by()[:self.max_count].count()
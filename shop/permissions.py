@@ -1,19 +1,20 @@
 """Giftmarket Shop Permissions"""
 from rest_framework.permissions import BasePermission
 
+from .backends import get_vendor_profile, is_vendor
+
 
 class IsVendor(BasePermission):
     """Custom permission to only allow vendors to access certain views."""
     def has_permission(self, request, view):
         """Check if the user is a vendor."""
-        return (
-            request.user.is_authenticated and
-            hasattr(request.user, 'vendor_profile')
-        )
+        return is_vendor(request.user)
 
 
 class IsVendorOwner(BasePermission):
     """Custom permission to only allow owners of a vendor profile to edit it."""
     def has_object_permission(self, request, view, obj):
         """Check if the user is the owner of the vendor profile."""
-        return obj.vendor == request.user.vendor_profile
+        vendor_profile = get_vendor_profile(request.user)
+        return (vendor_profile is not None
+                and obj.vendor_id == vendor_profile.id)
@@ -0,0 +1,184 @@
+"""
+Time-decayed "Trending" and "Bestseller" scores for products.
+
+Each sale (and review) contributes ``weight * 2 ** (-age / half_life)``,
+so recent activity dominates. Trending uses a short half-life and counts
+reviews, weighted by rating. Bestsellers use a long half-life over units
+sold only.
+
+Scores use forward decay: a sale at time ``t`` adds
+``weight * 2 ** ((t - EPOCH) / half_life)``, relative to a fixed
+``EPOCH``. Older rows never need decaying, since every stored score is
+measured against the same point in time. The score as of now is the
+stored score times ``2 ** (-(now - EPOCH) / half_life)``, the same
+factor for every product, so sorting on the stored column is exact.
+Floats hold the trending growth factor for about 19 years after
+``EPOCH``. Move ``EPOCH`` forward and run a recompute well before then.
+
+``recompute_all`` rebuilds every score in bulk with NumPy and upserts
+``ProductPopularity`` rows. ``record_order`` adds the sales of a new
+order at checkout with an atomic ``F()`` update. It never rewrites
+other rows.
+
+NumPy is imported on first use by the bulk recompute only.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Avg, Count, F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .archive import purchased_lines, units_sold
+from .models import Product, ProductPopularity, Review
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+TRENDING_HALF_LIFE_DAYS = 7
+BESTSELLER_HALF_LIFE_DAYS = 90
+
+# Activity older than this contributes less than 1/16 and is skipped.
+TRENDING_WINDOW_DAYS = TRENDING_HALF_LIFE_DAYS * 4
+BESTSELLER_WINDOW_DAYS = BESTSELLER_HALF_LIFE_DAYS * 4
+
+# A five-star review counts as much as this many units sold for trending.
+REVIEW_WEIGHT = 2.0
+
+SORTS = {
+    'trending': 'popularity__trending_score',
+    'bestsellers': 'popularity__bestseller_score',
+}
+
+
+def _days_since_epoch(moment):
+    return (moment - EPOCH).total_seconds() / 86400
+
+
+def growth(moment, half_life_days):
+    """Forward-decay factor of activity at ``moment``."""
+    return 2 ** (_days_since_epoch(moment) / half_life_days)
+
+
+def _growth_sums(rows, half_life_days, index):
+    """Sum ``weight * growth(ts)`` per product for ``(pid, weight, ts)``."""
+    import numpy as np
+
+    product_ids, weights, days = [], [], []
+    for product_id, weight, created_at in rows:
+        product_ids.append(index[product_id])
+        weights.append(weight)
+        days.append(_days_since_epoch(created_at))
+    if not product_ids:
+        return np.zeros(len(index))
+    return np.bincount(
+        np.asarray(product_ids),
+        weights=np.asarray(weights, dtype=np.float64)
+        * np.exp2(np.asarray(days, dtype=np.float64) / half_life_days),
+        minlength=len(index),
+    )
+
+
+def _upsert(rows):
+    # MySQL infers the conflict target from the primary key and rejects
+    # an explicit one.
+    unique_fields = (
+        ['product']
+        if connection.features.supports_update_conflicts_with_target
+        else None
+    )
+    ProductPopularity.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['trending_score', 'bestseller_score', 'units_sold',
+                       'review_count', 'average_rating', 'scored_at'],
+    )
+
+
+def recompute_all(now=None):
+    """Recompute popularity scores for every product in bulk."""
+    now = now or timezone.now()
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    index = {pid: i for i, pid in enumerate(product_ids)}
+
+    trending = _growth_sums(
+        purchased_lines(since=now - timedelta(days=TRENDING_WINDOW_DAYS)),
+        TRENDING_HALF_LIFE_DAYS, index)
+    trending += REVIEW_WEIGHT * _growth_sums(
+        ((pid, rating / 5, created_at) for pid, rating, created_at in
+         Review.objects.filter(created_at__gte=now - timedelta(
+             days=TRENDING_WINDOW_DAYS))
+         .values_list('product_id', 'rating', 'created_at').iterator()),
+        TRENDING_HALF_LIFE_DAYS, index)
+    bestseller = _growth_sums(
+        purchased_lines(since=now - timedelta(days=BESTSELLER_WINDOW_DAYS)),
+        BESTSELLER_HALF_LIFE_DAYS, index)
+
+    units = units_sold()
+    reviews = {
+        pid: (count, avg) for pid, count, avg in
+        Review.objects.values('product_id')
+        .annotate(n=Count('id'), avg=Avg('rating'))
+        .values_list('product_id', 'n', 'avg')
+    }
+
+    with transaction.atomic():
+        _upsert([
+            ProductPopularity(
+                product_id=pid,
+                trending_score=float(trending[i]),
+                bestseller_score=float(bestseller[i]),
+                units_sold=units.get(pid) or 0,
+                review_count=reviews.get(pid, (0, None))[0],
+                average_rating=reviews.get(pid, (0, None))[1],
+                scored_at=now,
+            )
+            for pid, i in index.items()
+        ])
+    return len(product_ids)
+
+
+def record_order(order, now=None):
+    """Add the sales of a placed order to its products' scores."""
+    now = now or timezone.now()
+    quantities = dict(order.items.values('product_id')
+                      .annotate(n=Sum('quantity'))
+                      .values_list('product_id', 'n'))
+    if not quantities:
+        return
+
+    trending = growth(now, TRENDING_HALF_LIFE_DAYS)
+    bestseller = growth(now, BESTSELLER_HALF_LIFE_DAYS)
+    with transaction.atomic():
+        ProductPopularity.objects.bulk_create(
+            [ProductPopularity(product_id=pid, scored_at=now)
+             for pid in quantities], ignore_conflicts=True)
+        for pid, qty in quantities.items():
+            ProductPopularity.objects.filter(pk=pid).update(
+                trending_score=F('trending_score') + qty * trending,
+                bestseller_score=F('bestseller_score') + qty * bestseller,
+                units_sold=F('units_sold') + qty)
+
+
+def current_weight(prefix='', now=None):
+    """
+    Expression for trending plus bestseller score, as of ``now``.
+
+    The two columns grow at different rates, so each is scaled back to
+    the present before they are added (``prefix`` reaches the product
+    through a join).
+    """
+    now = now or timezone.now()
+    return (Coalesce(F(f'{prefix}popularity__trending_score'), 0.0)
+            * Value(1 / growth(now, TRENDING_HALF_LIFE_DAYS))
+            + Coalesce(F(f'{prefix}popularity__bestseller_score'), 0.0)
+            * Value(1 / growth(now, BESTSELLER_HALF_LIFE_DAYS)))
+
+
+def sort_by_popularity(queryset, sort):
+    """Order a Product queryset by a popularity sort key, if recognised."""
+    field = SORTS.get(sort)
+    if field is None:
+        return queryset
+    return queryset.order_by(F(field).desc(nulls_last=True), '-id')
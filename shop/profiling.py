@@ -0,0 +1,328 @@
+"""
+Signal receiver profiler for the Giftmarket shop.
+
+When ``settings.SIGNAL_PROFILING`` is on, ``install()`` (called when
+``ShopConfig`` is created, before any models are imported) wraps
+``Signal.connect``, so every synchronous receiver connected from then on
+is registered inside a timer. Each call is timed and its database
+queries are counted. Times are inclusive: a receiver that saves a model
+also pays for the receivers that save fires. The few receivers Django
+connects before the app registry loads (such as
+``close_old_connections``) are not profiled; ``disconnect`` still
+removes them, and receivers connected with their own ``dispatch_uid``,
+as Django would.
+
+Results are aggregated per ``(signal, receiver)`` with a latency
+histogram. They are reported in two places:
+
+* ``RequestProfilerMiddleware`` adds the request's receivers to a
+  ``Server-Timing`` header for staff users (or under DEBUG).
+* ``manage.py signal_profile`` prints a top-N report. Each process
+  writes a snapshot of its totals to ``<host>-<pid>.json`` in
+  ``settings.SIGNAL_PROFILE_DIR`` every ``FLUSH_INTERVAL`` seconds
+  (atomically, as ``shop.metrics`` does), and the command merges them.
+  With several servers the directory must be shared. The command can
+  also profile one command run directly.
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import os
+import socket
+import threading
+import time
+import weakref
+from importlib import import_module
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+
+# Upper bounds (ms) of the histogram buckets; the last bucket is open.
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+FLUSH_INTERVAL = 10
+SNAPSHOT_TIMEOUT = 60 * 60 * 24  # older snapshots are ignored
+
+_SIGNAL_MODULES = (
+    'django.db.models.signals',
+    'django.core.signals',
+    'django.contrib.auth.signals',
+    'django.db.backends.signals',
+    'django.test.signals',
+)
+
+_lock = threading.Lock()
+_stats = {}
+_signal_names = None
+_last_flush = 0.0
+_originals = None  # Signal.connect and Signal.disconnect, once installed
+_request_calls = contextvars.ContextVar('signal_profile_request',
+                                        default=None)
+
+
+def is_enabled():
+    return getattr(settings, 'SIGNAL_PROFILING', False)
+
+
+# -----------------------------
+# INSTRUMENTATION
+# -----------------------------
+
+class _QueryCounter:
+    """``execute_wrapper`` that only counts queries."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def signal_name(signal):
+    """Readable name of a signal, e.g. ``post_save``."""
+    global _signal_names
+    if _signal_names is None:
+        names = {}
+        for module_name in _SIGNAL_MODULES:
+            module = import_module(module_name)
+            for name, value in vars(module).items():
+                if isinstance(value, Signal):
+                    names[id(value)] = name
+        _signal_names = names
+    return _signal_names.get(id(signal), 'custom_signal')
+
+
+def receiver_name(receiver):
+    """Dotted path of a receiver function, method or partial."""
+    while isinstance(receiver, functools.partial):
+        receiver = receiver.func
+    func = getattr(receiver, '__func__', receiver)
+    qualname = getattr(func, '__qualname__', type(func).__qualname__)
+    return f"{getattr(func, '__module__', None) or '?'}.{qualname}"
+
+
+def record(signal, name, seconds, queries):
+    """Add one receiver call (``name`` from ``receiver_name``) to totals."""
+    key = (signal_name(signal), name)
+    ms = seconds * 1000
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = [0, 0.0, 0.0, 0,
+                                   [0] * (len(BUCKETS_MS) + 1)]
+        entry[0] += 1
+        entry[1] += ms
+        entry[2] = max(entry[2], ms)
+        entry[3] += queries
+        entry[4][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+    calls = _request_calls.get()
+    if calls is not None:
+        calls.append((key, ms, queries))
+
+
+def _dispatch_uid(receiver):
+    """Identity of a receiver, as Signal uses it to spot duplicates."""
+    if hasattr(receiver, '__self__') and hasattr(receiver, '__func__'):
+        return ('signal_profile', id(receiver.__self__),
+                id(receiver.__func__))
+    return ('signal_profile', id(receiver))
+
+
+def _timed(receiver, weak):
+    """A strongly held timer around ``receiver`` (weakly, if ``weak``)."""
+    if not weak:
+        def target():
+            return receiver
+    elif hasattr(receiver, '__self__') and hasattr(receiver, '__func__'):
+        target = weakref.WeakMethod(receiver)
+    else:
+        target = weakref.ref(receiver)
+    name = receiver_name(receiver)
+
+    def profiled(signal, sender, **named):
+        live = target()
+        if live is None:
+            return None  # collected; being disconnected
+        counter = _QueryCounter()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                return live(signal=signal, sender=sender, **named)
+        finally:
+            record(signal, name, time.perf_counter() - started,
+                   counter.count)
+    return profiled
+
+
+def install():
+    """Time every sync receiver connected from now on (idempotent)."""
+    global _originals
+    if _originals is not None:
+        return
+    connect, disconnect = _originals = Signal.connect, Signal.disconnect
+
+    @functools.wraps(connect)
+    def profiled_connect(self, receiver, sender=None, weak=True,
+                         dispatch_uid=None):
+        if iscoroutinefunction(receiver):
+            return connect(self, receiver, sender, weak, dispatch_uid)
+        uid = dispatch_uid or _dispatch_uid(receiver)
+        connect(self, _timed(receiver, weak), sender, weak=False,
+                dispatch_uid=uid)
+        if weak:
+            # Disconnect with the receiver, as Signal does for weak ones.
+            owner = getattr(receiver, '__self__', receiver)
+            weakref.finalize(owner, disconnect, self, sender=sender,
+                             dispatch_uid=uid)
+
+    @functools.wraps(disconnect)
+    def profiled_disconnect(self, receiver=None, sender=None,
+                            dispatch_uid=None):
+        if (dispatch_uid is None and receiver is not None
+                and disconnect(self, sender=sender,
+                               dispatch_uid=_dispatch_uid(receiver))):
+            return True
+        # Connected before install(), or under its own dispatch_uid.
+        return disconnect(self, receiver, sender, dispatch_uid)
+
+    Signal.connect = profiled_connect
+    Signal.disconnect = profiled_disconnect
+
+
+def uninstall():
+    """Restore ``Signal``; receivers connected meanwhile stay timed."""
+    global _originals
+    if _originals is not None:
+        Signal.connect, Signal.disconnect = _originals
+        _originals = None
+
+
+def is_installed():
+    return _originals is not None
+
+
+# -----------------------------
+# AGGREGATES
+# -----------------------------
+
+def snapshot():
+    """Copy of this process's totals."""
+    with _lock:
+        return {key: [calls, total, worst, queries, list(buckets)]
+                for key, (calls, total, worst, queries, buckets)
+                in _stats.items()}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def merge(*snapshots):
+    """Combine several snapshots into one."""
+    merged = {}
+    for snap in snapshots:
+        for key, (calls, total, worst, queries, buckets) in snap.items():
+            entry = merged.setdefault(
+                key, [0, 0.0, 0.0, 0, [0] * (len(BUCKETS_MS) + 1)])
+            entry[0] += calls
+            entry[1] += total
+            entry[2] = max(entry[2], worst)
+            entry[3] += queries
+            entry[4] = [a + b for a, b in zip(entry[4], buckets)]
+    return merged
+
+
+def percentile(buckets, fraction):
+    """Bucket upper bound (ms) below which ``fraction`` of calls fall."""
+    target = fraction * sum(buckets)
+    seen = 0
+    for bound, count in zip(BUCKETS_MS + (float('inf'),), buckets):
+        seen += count
+        if seen >= target:
+            return bound
+    return float('inf')
+
+
+def top(stats, n=10, order='total'):
+    """Return the ``n`` heaviest ``(key, entry)`` pairs."""
+    index = {'total': 1, 'max': 2, 'calls': 0, 'queries': 3}[order]
+    return sorted(stats.items(), key=lambda item: item[1][index],
+                  reverse=True)[:n]
+
+
+def profile_dir():
+    return Path(getattr(settings, 'SIGNAL_PROFILE_DIR', 'signal_profile'))
+
+
+def _encode(snap):
+    return [[signal, receiver, entry]
+            for (signal, receiver), entry in snap.items()]
+
+
+def _decode(rows):
+    return {(signal, receiver): entry for signal, receiver, entry in rows}
+
+
+def flush_due():
+    """Whether ``flush`` would save now (cheap; for async callers)."""
+    return time.monotonic() - _last_flush >= FLUSH_INTERVAL
+
+
+def flush(force=False):
+    """Write this process's snapshot to ``SIGNAL_PROFILE_DIR``."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{socket.gethostname()}-{os.getpid()}.json'
+    tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+    tmp_path.write_text(json.dumps(_encode(snapshot())))
+    os.replace(tmp_path, path)  # readers never see a partial file
+
+
+def _snapshot_paths():
+    directory = profile_dir()
+    return list(directory.glob('*.json')) if directory.is_dir() else []
+
+
+def collected():
+    """Merge the recent snapshots of every process."""
+    cutoff = time.time() - SNAPSHOT_TIMEOUT
+    snapshots = []
+    for path in _snapshot_paths():
+        try:
+            if path.stat().st_mtime >= cutoff:
+                snapshots.append(_decode(json.loads(path.read_text())))
+        except (OSError, ValueError):
+            continue  # removed or being replaced
+    return merge(*snapshots)
+
+
+def clear_collected():
+    for path in _snapshot_paths():
+        path.unlink(missing_ok=True)
+
+
+# -----------------------------
+# PER REQUEST
+# -----------------------------
+
+def start_request():
+    """Start collecting the current request's receiver calls."""
+    return _request_calls.set([])
+
+
+def finish_request(token):
+    """Stop collecting and return ``[((signal, receiver), ms, queries)]``."""
+    calls = _request_calls.get() or []
+    _request_calls.reset(token)
+    return calls
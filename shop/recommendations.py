@@ -0,0 +1,210 @@
+"""
+"Frequently bought together" recommendations for the Giftmarket shop.
+
+Co-purchases are counted from placed orders with a sparse
+order x product basket matrix ``B``: ``B.T @ B`` is the product x product
+co-occurrence matrix, whose diagonal holds each product's order count.
+Scores are normalised (cosine or lift) and the top-K neighbours of each
+product are stored in ``ProductRecommendation``, so ``product_detail``
+reads them with one indexed query.
+
+A full rebuild runs from ``manage.py build_recommendations``. Checkout
+only queues the products of the new order (``RecommendationRefresh``);
+``manage.py build_recommendations --pending``, run from cron, refreshes
+their rows off the request path. Full and incremental refreshes read
+the same live and archived sales, so they agree.
+
+NumPy and SciPy are imported on first use, so web workers and commands
+that only read recommendations never load them.
+"""
+
+from django.db import connection, transaction
+
+from .archive import (order_pairs, product_order_counts,
+                      purchased_order_count, purchased_pairs,
+                      recent_order_ids)
+from .models import ProductRecommendation, RecommendationRefresh
+
+TOP_K = 10
+DEFAULT_METRIC = 'cosine'
+METRICS = ('cosine', 'lift')
+
+# Incremental refreshes only look at this many recent orders per product,
+# which bounds the work done at checkout for very popular products.
+INCREMENTAL_ORDER_WINDOW = 5000
+
+
+def _pairs_array(rows):
+    """Return distinct ``(order_id, product_id)`` rows as an int64 array."""
+    import numpy as np
+
+    pairs = np.fromiter(
+        (value for row in rows for value in row), dtype=np.int64)
+    return np.unique(pairs.reshape(-1, 2), axis=0)
+
+
+def compute_neighbours(pairs, targets=None, item_counts=None,
+                       n_orders=None, metric=DEFAULT_METRIC,
+                       top_k=TOP_K):
+    """
+    Score co-purchased products and return the top-K for each target.
+
+    ``pairs`` is an ``(n, 2)`` array of distinct ``(order_id, product_id)``.
+    ``targets`` limits the rows computed (default: every product seen);
+    all orders containing a target must be present in ``pairs``.
+    ``item_counts`` (product id -> order count) and ``n_orders`` override
+    the counts derived from ``pairs`` when it is only a slice of history.
+
+    Returns ``{product_id: [(recommended_id, score), ...]}``.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}; use one of {METRICS}.")
+    if len(pairs) == 0:
+        return {}
+
+    orders, order_idx = np.unique(pairs[:, 0], return_inverse=True)
+    products, product_idx = np.unique(pairs[:, 1], return_inverse=True)
+    basket = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float64), (order_idx, product_idx)),
+        shape=(len(orders), len(products)),
+    )
+
+    if item_counts is None:
+        counts = np.asarray(basket.sum(axis=0)).ravel()
+    else:
+        counts = np.array([item_counts.get(int(pid), 0) for pid in products],
+                          dtype=np.float64)
+    counts[counts == 0] = 1
+    total_orders = n_orders or len(orders)
+
+    if targets is None:
+        target_cols = np.arange(len(products))
+    else:
+        target_cols = np.flatnonzero(np.isin(products, list(targets)))
+
+    co = (basket[:, target_cols].T @ basket).tocoo()
+    keep = target_cols[co.row] != co.col  # a product is not its own pair
+    rows, cols, together = co.row[keep], co.col[keep], co.data[keep]
+
+    target_counts = counts[target_cols[rows]]
+    if metric == 'cosine':
+        scores = together / np.sqrt(target_counts * counts[cols])
+    else:
+        scores = together * total_orders / (target_counts * counts[cols])
+
+    # Sort once by (row, -score) and take the first K of each row.
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.searchsorted(rows, np.arange(len(target_cols)))
+    ends = np.searchsorted(rows, np.arange(len(target_cols)), side='right')
+
+    result = {}
+    for row, (start, end) in enumerate(zip(starts, ends)):
+        end = min(end, start + top_k)
+        result[int(products[target_cols[row]])] = [
+            (int(products[col]), float(score))
+            for col, score in zip(cols[start:end], scores[start:end])
+        ]
+    return result
+
+
+def _store(neighbours, replace_all=False):
+    """Replace stored recommendation rows for the given products."""
+    rows = [
+        ProductRecommendation(product_id=product_id,
+                              recommended_id=recommended_id,
+                              score=score, rank=rank)
+        for product_id, items in neighbours.items()
+        for rank, (recommended_id, score) in enumerate(items, start=1)
+    ]
+    with transaction.atomic():
+        if replace_all:
+            ProductRecommendation.objects.all().delete()
+        else:
+            ProductRecommendation.objects.filter(
+                product_id__in=list(neighbours)).delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_all(metric=DEFAULT_METRIC, top_k=TOP_K):
+    """Recompute recommendations for every purchased product."""
+    pairs = _pairs_array(purchased_pairs())
+    neighbours = compute_neighbours(pairs, metric=metric, top_k=top_k)
+    return len(neighbours), _store(neighbours, replace_all=True)
+
+
+def refresh_products(product_ids, metric=DEFAULT_METRIC, top_k=TOP_K):
+    """Recompute recommendation rows for ``product_ids`` only."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+
+    order_ids = set()
+    for product_id in product_ids:
+        order_ids.update(recent_order_ids(product_id,
+                                          INCREMENTAL_ORDER_WINDOW))
+
+    pairs = _pairs_array(order_pairs(order_ids))
+    if len(pairs) == 0:
+        return _store({pid: [] for pid in product_ids})
+
+    # Normalisation needs global counts (archived orders included), not
+    # counts within the slice.
+    item_counts = product_order_counts(sorted(set(pairs[:, 1].tolist())))
+    n_orders = purchased_order_count()
+
+    neighbours = compute_neighbours(
+        pairs, targets=product_ids, item_counts=item_counts,
+        n_orders=n_orders, metric=metric, top_k=top_k)
+    for product_id in product_ids:
+        neighbours.setdefault(product_id, [])
+    return _store(neighbours)
+
+
+def refresh_for_order(order):
+    """Queue the products of a newly placed order for a refresh."""
+    product_ids = set(order.items.values_list('product_id', flat=True))
+    # MySQL infers the conflict target from the primary key and rejects
+    # an explicit one.
+    unique_fields = (
+        ['product']
+        if connection.features.supports_update_conflicts_with_target
+        else None
+    )
+    RecommendationRefresh.objects.bulk_create(
+        [RecommendationRefresh(product_id=pid) for pid in product_ids],
+        update_conflicts=True, unique_fields=unique_fields,
+        update_fields=['queued_at'])
+
+
+def refresh_pending(batch_size=500, metric=DEFAULT_METRIC, top_k=TOP_K):
+    """
+    Refresh every queued product, ``batch_size`` at a time.
+
+    A product queued again while its batch runs keeps its newer queue
+    entry, so the next run picks up the later orders. Returns the number
+    of products refreshed.
+    """
+    refreshed = 0
+    while True:
+        batch = dict(RecommendationRefresh.objects.order_by('queued_at')
+                     .values_list('product_id', 'queued_at')[:batch_size])
+        if not batch:
+            return refreshed
+        refresh_products(list(batch), metric=metric, top_k=top_k)
+        # Entries queued again since the read are newer than all of these.
+        RecommendationRefresh.objects.filter(
+            product_id__in=list(batch),
+            queued_at__lte=max(batch.values())).delete()
+        refreshed += len(batch)
+
+
+def get_recommendations(product_id, limit=4):
+    """Return recommended products for ``product_id`` (one indexed query)."""
+    return ProductRecommendation.objects.filter(
+        product_id=product_id, rank__lte=limit
+    ).select_related('recommended').order_by('rank')
@@ -1,5 +1,12 @@
 """Giftmarket Shop Serializers"""
-from rest_framework import serializers
+import decimal
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import Store
 from .models import Product
 from .models import Review
@@ -30,3 +37,183 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = '__all__'
         read_only_fields = ['buyer']
+
+
+class VendorReviewSerializer(ReviewSerializer):
+    """Review with the product name and reviewer username inlined."""
+    product_name = serializers.CharField(source='product.name',
+                                         read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+
+
+# -----------------------------
+# FAST READ PATH FOR HOT LIST ENDPOINTS
+# -----------------------------
+
+# Field types whose database values are already their JSON representation.
+PASSTHROUGH_FIELDS = (
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ReadOnlyField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for ``.values()`` rows.
+
+    Produces the same output as ``serializer_class`` without building a
+    model instance or walking field objects per row. Each field is
+    compiled once into a ``(key, converter)`` pair, and rows are then
+    mapped with plain dict lookups. Only for flat serializers: primary-key
+    relations are supported, nested ones are not.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._plan = None
+
+    @property
+    def columns(self):
+        """Column names to pass to ``QuerySet.values()``."""
+        return [key for key, _, _ in self._compile()]
+
+    def _compile(self):
+        if self._plan is None:
+            plan = []
+            for name, field in self.serializer_class().fields.items():
+                if field.write_only:
+                    continue
+                if isinstance(field, PASSTHROUGH_FIELDS):
+                    plan.append((field.source, name, None))
+                elif isinstance(field, serializers.RelatedField):
+                    raise TypeError(
+                        f"{name}: only primary-key relations are supported.")
+                else:
+                    plan.append((field.source, name, field))
+            self._plan = plan
+        return self._plan
+
+    @staticmethod
+    def _decimal_converter(field):
+        coerce = getattr(field, 'coerce_to_string',
+                         api_settings.COERCE_DECIMAL_TO_STRING)
+        if not coerce or field.localize or field.normalize_output:
+            return field.to_representation
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+
+        def convert(value):
+            if value is None:
+                return ''
+            value = value.quantize(exponent, rounding=field.rounding,
+                                   context=context)
+            return f'{value:f}'
+        return convert
+
+    @staticmethod
+    def _datetime_converter(field):
+        output_format = getattr(field, 'format',
+                                api_settings.DATETIME_FORMAT)
+        if (output_format is None
+                or output_format.lower() != ISO_8601
+                or hasattr(field, 'timezone')
+                or not settings.USE_TZ):
+            return field.to_representation
+        tz = timezone.get_current_timezone()
+
+        def convert(value):
+            if not value:
+                return None
+            if timezone.is_aware(value):
+                value = value.astimezone(tz)
+            value = value.isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+
+    @staticmethod
+    def _file_converter(field, model_field, request):
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return lambda value: value or None
+        storage = model_field.storage
+        prefix = request.build_absolute_uri('/')[:-1] if request else ''
+        # FileSystemStorage.url() is urljoin(base_url, quoted name); for a
+        # plain relative name that is a string concatenation.
+        base_url = None
+        if isinstance(storage, FileSystemStorage):
+            base_url = storage.base_url
+            if not base_url.endswith('/'):
+                base_url = None
+
+        def storage_url(name):
+            if base_url is not None and '..' not in name:
+                return base_url + filepath_to_uri(name).lstrip('/')
+            return storage.url(name)
+
+        def convert(value):
+            if not value:
+                return None
+            url = storage_url(value)
+            if url.startswith('/') and not url.startswith('//'):
+                return prefix + url
+            return request.build_absolute_uri(url) if request else url
+        return convert
+
+    def _converters(self, request):
+        model = self.serializer_class.Meta.model
+        converters = []
+        for key, name, field in self._compile():
+            if field is None:
+                converters.append((key, name, None))
+            elif isinstance(field, serializers.DecimalField):
+                converters.append((key, name, self._decimal_converter(field)))
+            elif isinstance(field, serializers.DateTimeField):
+                converters.append((key, name,
+                                   self._datetime_converter(field)))
+            elif isinstance(field, serializers.FileField):
+                converters.append((key, name, self._file_converter(
+                    field, model._meta.get_field(key), request)))
+            else:
+                converters.append((key, name, field.to_representation))
+        return converters
+
+    def absolutize(self, data, request):
+        """
+        Make the relative file URLs in serialized ``data`` absolute.
+
+        For output serialized without a request (e.g. cached for every
+        host); the result matches serializing with ``request``.
+        """
+        names = [name for _, name, field in self._compile()
+                 if isinstance(field, serializers.FileField)
+                 and getattr(field, 'use_url',
+                             api_settings.UPLOADED_FILES_USE_URL)]
+        if not names or request is None:
+            return data
+        prefix = request.build_absolute_uri('/')[:-1]
+
+        def absolute(url):
+            if url and url.startswith('/') and not url.startswith('//'):
+                return prefix + url
+            return url
+        return [{**row, **{name: absolute(row[name]) for name in names}}
+                for row in data]
+
+    def serialize(self, rows, request=None):
+        """Return the serialized list for an iterable of ``values()`` rows."""
+        converters = self._converters(request)
+        return [
+            {name: row[key] if conv is None else conv(row[key])
+             for key, name, conv in converters}
+            for row in rows
+        ]
+
+
+store_values_serializer = ValuesSerializer(StoreSerializer)
+product_values_serializer = ValuesSerializer(ProductSerializer)
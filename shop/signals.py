@@ -1,13 +1,23 @@
 """Signals for the Giftmarket shop application."""
 
-from django.db.models.signals import post_save
+import logging
+
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-
-from .models import VendorProfile, Product, Store
+from django.contrib.auth.signals import user_logged_in
+
+from .models import VendorProfile, Product, Review, Store, Order
+from .catalog_cache import invalidate_products
+from .change_feed import record_deletion
+from . import autocomplete, availability, listing_cache
+from .cart import merge_guest_cart
+from .events import crossed_low_stock, publish, publish_low_stock
+from .inventory import set_stock
 from .twitter_service import post_tweet
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=User)
@@ -64,3 +74,158 @@ def tweet_when_product_created(sender, instance, created, **kwargs):
     except Exception:
         # Tweet failure must not prevent product creation
         pass
+
+
+@receiver(post_save, sender=Product)
+def notify_low_stock(sender, instance, created, **kwargs):
+    """
+    Tell the vendor when a product's stock falls to the low-stock level.
+
+    Connected before ``sync_stock_counters``, which resets the loaded stock.
+    """
+    if crossed_low_stock(getattr(instance, '_loaded_stock', None),
+                         instance.stock):
+        logger.info("low stock", extra={'product_id': instance.pk,
+                                        'stock': instance.stock})
+        publish_low_stock([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def sync_stock_counters(sender, instance, created, **kwargs):
+    """
+    Re-balance the inventory ledger when a vendor sets a product's stock
+    (Web UI, API, admin, shell). The edit is applied as a change from the
+    loaded figure, which may predate recent sales.
+    """
+    previous = getattr(instance, '_loaded_stock', None)
+    if created or instance.stock != previous:
+        set_stock(instance, instance.stock,
+                  previous=None if created else previous)
+        instance._loaded_stock = instance.stock
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    """Drop the cached batch row of a changed or deleted product."""
+    invalidate_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def forget_availability(sender, instance, **kwargs):
+    """A deleted product has no availability to report."""
+    availability.forget([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviewed_product_cache(sender, instance, **kwargs):
+    """A review changes its product's cached rating summary."""
+    invalidate_products([instance.product_id])
+
+
+@receiver(post_save, sender=Store)
+def invalidate_store_products_cache(sender, instance, created, **kwargs):
+    """Cached product rows carry the store name."""
+    if not created:
+        invalidate_products(
+            instance.products.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_store_listing_version(sender, instance, **kwargs):
+    """Cached product lists of the product's store are now out of date."""
+    listing_cache.bump('store', [instance.store_id])
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def bump_vendor_listing_version(sender, instance, **kwargs):
+    """Cached store lists of the store's vendor are now out of date."""
+    listing_cache.bump('vendor', [instance.vendor_id])
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Store)
+def record_catalog_tombstone(sender, instance, **kwargs):
+    """Leave a tombstone so change-feed consumers see the deletion."""
+    record_deletion(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Store)
+def update_autocomplete(sender, instance, **kwargs):
+    """Keep this process's autocomplete index current (if loaded)."""
+    index = autocomplete.loaded_index()
+    if index is not None:
+        index.put(instance._meta.model_name, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Store)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    """Drop a deleted product or store from the autocomplete index."""
+    index = autocomplete.loaded_index()
+    if index is not None:
+        index.remove(instance._meta.model_name, instance.pk)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_events(sender, instance, created, **kwargs):
+    """
+    Tell vendors about their new order lines at checkout, and about later
+    status changes of orders that include their products.
+    """
+    previous = getattr(instance, '_loaded_status', None)
+    instance._loaded_status = instance.status
+    if created or previous in (None, instance.status):
+        return
+
+    logger.debug("order status changed",
+                 extra={'order_id': instance.pk, 'status': instance.status,
+                        'previous': previous})
+    lines = list(instance.items.values(
+        'product_id', 'product__name', 'quantity', 'price',
+        'product__store__vendor_id'))
+    if previous == 'pending':
+        if instance.status not in Order.PURCHASED_STATUSES:
+            return  # an abandoned cart is of no interest to vendors
+        for line in lines:
+            publish([line['product__store__vendor_id']], 'order_line', {
+                'order_id': instance.pk,
+                'product_id': line['product_id'],
+                'name': line['product__name'],
+                'quantity': line['quantity'],
+                'price': str(line['price']),
+            })
+    else:
+        publish([line['product__store__vendor_id'] for line in lines],
+                'order_status', {'order_id': instance.pk,
+                                 'status': instance.status,
+                                 'previous': previous})
+
+
+@receiver(post_save, sender=Review)
+def publish_review_event(sender, instance, created, **kwargs):
+    """Tell the vendor about a new review of one of their products."""
+    if not created:
+        return
+    vendor_id = (Product.objects.filter(pk=instance.product_id)
+                 .values_list('store__vendor_id', flat=True).first())
+    publish([vendor_id], 'review', {
+        'review_id': instance.pk,
+        'product_id': instance.product_id,
+        'rating': instance.rating,
+        'verified_purchase': instance.verified_purchase,
+    })
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """
+    Move a guest's cookie cart into their pending Order on login
+    (login form and buyer signup both go through ``login()``).
+    """
+    if request is not None:
+        merge_guest_cart(request, user)
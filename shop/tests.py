@@ -1,3 +1,1292 @@
-from django.test import TestCase
+"""Behaviour tests for the Giftmarket shop."""
+import gc
+import hashlib
+import io
+import json
+import logging
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.db import IntegrityError, connection
+from django.dispatch import Signal
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import (archive, autocomplete, availability, catalog_cache,
+               change_feed, inventory, listing_cache, metrics,
+               log, notifications, order_status, popularity, profiling,
+               recommendations, uploads)
+from .cart import CART_COOKIE_NAME, GuestCart
+from .models import (ArchivedOrder, CatalogTombstone, Order, OrderItem,
+                     Product, ProductPopularity, ProductRecommendation,
+                     RecommendationRefresh, Review, StockCounter, Store,
+                     User, VendorDigestMark, VendorProfile)
+
+
+def setUpModule():
+    """Keep log lines (JSON on stderr) out of the test output."""
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class ShopTestCase(TestCase):
+    """
+    Base for the shop tests: files go to a temporary ``MEDIA_ROOT``, and
+    the autocomplete loader thread stays out of test transactions.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        cls.enterClassContext(override_settings(
+            MEDIA_ROOT=media.name, AUTOCOMPLETE_WARM_UP=False))
+        super().setUpClass()
+
+
+def make_vendor(username):
+    """A vendor with one store."""
+    user = User.objects.create_user(username, f'{username}@example.com',
+                                    'pw', role='vendor')
+    profile, _ = VendorProfile.objects.get_or_create(user=user)
+    with mock.patch('shop.signals.post_tweet'):
+        store = Store.objects.create(vendor=profile, name=f'{username} gifts')
+    return user, profile, store
+
+
+def make_product(store, name='Mug', stock=10):
+    with mock.patch('shop.signals.post_tweet'):
+        return Product.objects.create(store=store, name=name,
+                                      description='A gift', price='9.99',
+                                      stock=stock)
+
+
+def make_order(buyer, product, status='processing', quantity=1):
+    order = Order.objects.create(buyer=buyer, status=status)
+    OrderItem.objects.create(order=order, product=product,
+                             quantity=quantity, price=product.price)
+    return order
+
+
+def make_basket(buyer, products, status='processing'):
+    """A placed order with one unit of each product."""
+    order = Order.objects.create(buyer=buyer, status=status)
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=product, quantity=1,
+                  price=product.price) for product in products)
+    return order
+
+
+# -----------------------------
+# ASYNC CATALOG VIEWS
+# -----------------------------
+
+class AsyncCatalogTests(ShopTestCase):
+    """The async product pages and ``/api/async/`` lists."""
+
+    def setUp(self):
+        _, self.profile, self.store = make_vendor('vendor')
+        self.mug = make_product(self.store, 'Mug')
+        self.teapot = make_product(self.store, 'Teapot')
+        buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        Review.objects.create(product=self.mug, user=buyer, rating=4,
+                              comment='Sturdy')
+        ProductPopularity.objects.create(product=self.teapot,
+                                         trending_score=5,
+                                         scored_at=timezone.now())
+
+    async def test_product_list_sorts_by_popularity(self):
+        response = await self.async_client.get('/shop/?sort=trending')
+        content = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(content.index('Teapot'), content.index('Mug'))
+
+        response = await self.async_client.get('/shop/')
+        content = response.content.decode()
+        self.assertLess(content.index('Mug'), content.index('Teapot'))
+
+    def test_product_detail(self):
+        # The sync client runs the async view via async_to_sync, so its
+        # queries land on this thread's connection.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/shop/product/{self.mug.id}/')
+        self.assertContains(response, 'Mug')
+        self.assertContains(response, 'Sturdy')
+        self.assertContains(response, '4.0/5')
+        tables = [query['sql'] for query in queries.captured_queries]
+        self.assertIn('"shop_product"', tables[0])
+
+    def test_missing_product_skips_review_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/shop/product/999999/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(any('shop_review' in query['sql']
+                             for query in queries.captured_queries))
+
+    async def test_async_lists_match_drf_lists(self):
+        for path in ('stores/', f'stores/{self.store.id}/products/',
+                     f'vendors/{self.profile.id}/stores/'):
+            sync = await self.async_client.get(f'/api/{path}')
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), sync.json())
+
+
+# -----------------------------
+# GUEST CART
+# -----------------------------
+
+class GuestCartMergeTests(ShopTestCase):
+    """A guest's cookie cart joins their pending order when they log in."""
+
+    def setUp(self):
+        _, _, store = make_vendor('vendor')
+        self.mug = make_product(store, 'Mug')
+        self.teapot = make_product(store, 'Teapot')
+        self.buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+
+    def test_login_merges_cookie_cart(self):
+        order = make_order(self.buyer, self.mug, 'pending', 1)
+        self.client.get(f'/shop/cart/add/{self.mug.id}/')
+        self.client.get(f'/shop/cart/add/{self.mug.id}/')
+        self.client.get(f'/shop/cart/add/{self.teapot.id}/')
+        self.assertIn(CART_COOKIE_NAME, self.client.cookies)
+
+        response = self.client.post('/accounts/login/',
+                                    {'username': 'buyer', 'password': 'pw'})
+        self.assertEqual(response.status_code, 302)
+        quantities = dict(order.items.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.mug.id: 3, self.teapot.id: 1})
+        self.assertEqual(self.client.cookies[CART_COOKIE_NAME].value, '')
+
+    def test_guest_cart_respects_stock(self):
+        few = make_product(self.mug.store, 'Vase', stock=1)
+        self.client.get(f'/shop/cart/add/{few.id}/')
+        self.client.get(f'/shop/cart/add/{few.id}/')
+        self.client.post('/accounts/login/',
+                         {'username': 'buyer', 'password': 'pw'})
+        item = OrderItem.objects.get(order__buyer=self.buyer, product=few)
+        self.assertEqual(item.quantity, 1)
+
+    def test_full_guest_cart_refuses_new_products(self):
+        vase = make_product(self.mug.store, 'Vase')
+        with mock.patch('shop.cart.CART_MAX_LINES', 2):
+            self.client.get(f'/shop/cart/add/{self.mug.id}/')
+            self.client.get(f'/shop/cart/add/{self.teapot.id}/')
+            response = self.client.get(f'/shop/cart/add/{vase.id}/')
+            self.assertRedirects(response, f'/shop/product/{vase.id}/',
+                                 fetch_redirect_response=False)
+            self.assertIn('at most 2 different products',
+                          [str(m) for m in
+                           get_messages(response.wsgi_request)][-1])
+            # Products already in the cart can still be added.
+            self.client.get(f'/shop/cart/add/{self.mug.id}/')
+        response = self.client.get('/shop/cart/')
+        cart = GuestCart(response.wsgi_request)
+        self.assertEqual(cart.lines, {self.mug.id: 2, self.teapot.id: 1})
+
+
+# -----------------------------
+# RECOMMENDATIONS
+# -----------------------------
+
+class RecommendationTests(ShopTestCase):
+    """Frequently-bought-together neighbours, full and incremental."""
+
+    def setUp(self):
+        _, _, store = make_vendor('vendor')
+        self.a, self.b, self.c, self.d = (
+            make_product(store, name) for name in 'ABCD')
+        self.buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        for basket in ((self.a, self.b), (self.a, self.b), (self.a, self.c),
+                       (self.b, self.d)):
+            make_basket(self.buyer, basket)
+
+    def neighbours(self, product):
+        return [(rec.recommended, round(rec.score, 3))
+                for rec in recommendations.get_recommendations(product.id)]
+
+    def stored(self):
+        return sorted(ProductRecommendation.objects.values_list(
+            'product_id', 'recommended_id', 'rank'))
+
+    def test_rebuild_ranks_by_cosine(self):
+        recommendations.rebuild_all()
+        # A is in 3 orders: 2 with B (also in 3), 1 with C (in 1).
+        self.assertEqual(self.neighbours(self.a),
+                         [(self.b, 0.667), (self.c, 0.577)])
+        self.assertEqual(self.neighbours(self.d), [(self.b, 0.577)])
+
+    def test_pending_refresh_matches_rebuild(self):
+        recommendations.rebuild_all()
+        order = make_basket(self.buyer, (self.a, self.d))
+        recommendations.refresh_for_order(order)
+        self.assertEqual(set(RecommendationRefresh.objects.values_list(
+            'product_id', flat=True)), {self.a.id, self.d.id})
+
+        self.assertEqual(recommendations.refresh_pending(), 2)
+        self.assertFalse(RecommendationRefresh.objects.exists())
+        incremental = self.stored()
+        recommendations.rebuild_all()
+        self.assertEqual(incremental, self.stored())
+
+    def test_checkout_queues_products(self):
+        self.client.force_login(self.buyer)
+        self.client.get(f'/shop/cart/add/{self.c.id}/')
+        self.client.get(f'/shop/cart/add/{self.d.id}/')
+        self.client.get('/shop/checkout/')
+        self.assertEqual(set(RecommendationRefresh.objects.values_list(
+            'product_id', flat=True)), {self.c.id, self.d.id})
+
+
+# -----------------------------
+# POPULARITY
+# -----------------------------
+
+class PopularityTests(ShopTestCase):
+    """Forward-decayed trending and bestseller scores."""
+
+    def setUp(self):
+        _, _, store = make_vendor('vendor')
+        self.old, self.new = make_product(store, 'Old'), make_product(
+            store, 'New')
+        self.buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        self.now = timezone.now()
+
+    def sell(self, product, quantity, days_ago):
+        order = make_order(self.buyer, product, quantity=quantity)
+        created_at = self.now - timedelta(days=days_ago)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        popularity.record_order(order, now=created_at)
+
+    def scores(self):
+        return {row.product_id: (row.trending_score, row.bestseller_score,
+                                 row.units_sold)
+                for row in ProductPopularity.objects.all()}
+
+    def test_growth_doubles_every_half_life(self):
+        later = popularity.EPOCH + timedelta(days=7)
+        self.assertAlmostEqual(popularity.growth(later, 7), 2.0)
+        self.assertAlmostEqual(popularity.growth(popularity.EPOCH, 7), 1.0)
+
+    def test_record_order_adds_to_existing_scores(self):
+        self.sell(self.new, 1, 0)
+        first = self.scores()[self.new.id]
+        self.sell(self.new, 2, 0)
+        trending, bestseller, units = self.scores()[self.new.id]
+        self.assertAlmostEqual(trending, first[0] * 3, delta=1e-6 * trending)
+        self.assertAlmostEqual(bestseller, first[1] * 3,
+                               delta=1e-6 * bestseller)
+        self.assertEqual(units, 3)
+
+    def test_sorts_decay_at_their_own_rate(self):
+        self.sell(self.old, 3, 14)  # two trending half-lives ago
+        self.sell(self.new, 1, 0)
+        products = Product.objects.all()
+        trending = popularity.sort_by_popularity(products, 'trending')
+        bestsellers = popularity.sort_by_popularity(products, 'bestsellers')
+        self.assertEqual(list(trending), [self.new, self.old])
+        self.assertEqual(list(bestsellers), [self.old, self.new])
+
+        weights = dict(products.annotate(
+            weight=popularity.current_weight(now=self.now))
+            .values_list('id', 'weight'))
+        self.assertAlmostEqual(weights[self.new.id], 2.0, places=6)
+        self.assertAlmostEqual(
+            weights[self.old.id], 3 * (0.25 + 2 ** (-14 / 90)), places=6)
+
+    def test_recompute_matches_incremental_scores(self):
+        self.sell(self.old, 3, 14)
+        self.sell(self.new, 1, 0)
+        self.sell(self.new, 2, 3)
+        incremental = self.scores()
+        popularity.recompute_all(now=self.now)
+        for product_id, (trending, bestseller, units) in (
+                self.scores().items()):
+            expected = incremental[product_id]
+            self.assertAlmostEqual(trending, expected[0],
+                                   delta=1e-9 * trending)
+            self.assertAlmostEqual(bestseller, expected[1],
+                                   delta=1e-9 * bestseller)
+            self.assertEqual(units, expected[2])
+
+
+# -----------------------------
+# INVENTORY LEDGER
+# -----------------------------
+
+class InventoryTests(ShopTestCase):
+    """Stock moves through reservations; vendor edits are deltas."""
+
+    def setUp(self):
+        _, _, store = make_vendor('vendor')
+        self.product = make_product(store, stock=10)
+        self.buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+
+    def available(self):
+        return inventory.available_stock([self.product.id])[self.product.id]
+
+    def test_new_product_gets_its_stock_on_the_counters(self):
+        self.assertEqual(self.available(), 10)
+
+    def test_reserve_and_release(self):
+        order = make_order(self.buyer, self.product, 'pending', 3)
+        item = order.items.get()
+        inventory.reserve(self.product, 3, order_item=item)
+        self.assertEqual(self.available(), 7)
+        inventory.release(item, 2)
+        self.assertEqual(self.available(), 9)
+
+    def test_reserve_more_than_available_takes_nothing(self):
+        with self.assertRaises(inventory.InsufficientStock):
+            inventory.reserve(self.product, 11)
+        self.assertEqual(self.available(), 10)
+
+    def test_reserve_spans_shards(self):
+        inventory.shard_stock(self.product, 4)
+        self.assertEqual(StockCounter.objects.filter(
+            product=self.product).count(), 4)
+        inventory.reserve(self.product, 9)
+        self.assertEqual(self.available(), 1)
+
+    def test_vendor_edit_after_sales_does_not_resell_units(self):
+        order = make_order(self.buyer, self.product, 'pending', 2)
+        inventory.commit_order(order)
+        self.assertEqual(self.available(), 8)
+
+        # The vendor's form still shows 10 and they add 5 units.
+        self.product.stock = 15
+        self.product.save()
+        self.assertEqual(self.available(), 13)
+
+        inventory.sync_product_stock([self.product.id])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 13)
+
+    def test_released_order_returns_committed_stock(self):
+        order = make_order(self.buyer, self.product, 'pending', 4)
+        inventory.commit_order(order)
+        self.assertEqual(self.available(), 6)
+        self.assertEqual(inventory.release_orders([order.id]),
+                         {self.product.id: 4})
+        self.assertEqual(self.available(), 10)
+        self.assertEqual(inventory.release_orders([order.id]), {})
+
+
+    def test_expired_holds_are_swept(self):
+        inventory.reserve(self.product, 3,
+                          now=timezone.now() - timedelta(hours=1))
+        inventory.reserve(self.product, 2)
+        released, touched = inventory.release_expired()
+        self.assertEqual((released, touched), (1, {self.product.id}))
+        self.assertEqual(self.available(), 8)
+
+
+# -----------------------------
+# THROTTLING
+# -----------------------------
+
+@override_settings(THROTTLE_BUCKETS={
+    'public_ip': {'rate': '2/m', 'burst': 2},
+    'public_user': {'rate': '100/m', 'burst': 100},
+    'public_endpoint': {'rate': '5/m', 'burst': 5},
+})
+class ThrottleTests(ShopTestCase):
+    """One client's refused requests must not use up the shared budget."""
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path, ip, **extra):
+        return self.client.get(path, REMOTE_ADDR=ip, **extra)
+
+    def test_client_bucket_refuses_with_retry_after(self):
+        for _ in range(2):
+            self.assertEqual(self.get('/api/stores/', '10.0.0.1')
+                             .status_code, 200)
+        response = self.get('/api/stores/', '10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(response['RateLimit-Remaining'], '0')
+
+    def test_refused_requests_do_not_drain_endpoint_budget(self):
+        for _ in range(20):
+            self.get('/api/stores/', '10.0.0.1')
+        # Only the scraper's 2 allowed requests came out of the
+        # endpoint's budget of 5.
+        for ip in ('10.0.0.2', '10.0.0.3'):
+            self.assertEqual(self.get('/api/stores/', ip).status_code, 200)
+
+    def test_forwarded_for_is_not_trusted_without_proxies(self):
+        for n in range(3):
+            response = self.get('/api/stores/', '10.0.0.1',
+                                HTTP_X_FORWARDED_FOR=f'192.0.2.{n}')
+        self.assertEqual(response.status_code, 429)
+
+    def test_async_route_shares_the_budget(self):
+        for _ in range(2):
+            self.get('/api/stores/', '10.0.0.1')
+        response = self.get('/api/async/stores/', '10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+# -----------------------------
+# PRODUCT BATCH LOOKUP
+# -----------------------------
+
+class ProductBatchTests(ShopTestCase):
+    """Per-product cache rows read with one ``get_many``."""
+
+    def setUp(self):
+        cache.clear()
+        _, _, store = make_vendor('vendor')
+        self.mug = make_product(store, 'Mug')
+        self.teapot = make_product(store, 'Teapot')
+
+    def test_rows_are_cached_including_missing_ids(self):
+        ids = [self.teapot.id, self.mug.id, 999999]
+        with self.assertNumQueries(1):
+            rows = catalog_cache.get_product_rows(ids)
+        self.assertEqual(set(rows), {self.mug.id, self.teapot.id})
+        self.assertEqual(
+            cache.get(catalog_cache.product_cache_key(999999)),
+            catalog_cache.MISSING)
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog_cache.get_product_rows(ids), rows)
+
+    def test_saving_a_product_drops_its_row(self):
+        catalog_cache.get_product_rows([self.mug.id])
+        self.mug.name = 'Big Mug'
+        self.mug.save()
+        rows = catalog_cache.get_product_rows([self.mug.id])
+        self.assertEqual(rows[self.mug.id]['name'], 'Big Mug')
+
+    def test_endpoint_keeps_order_and_lists_missing(self):
+        response = self.client.get(
+            f'/api/products/batch/?ids={self.teapot.id},999999,{self.mug.id}')
+        data = response.json()
+        self.assertEqual([item['name'] for item in data['results']],
+                         ['Teapot', 'Mug'])
+        self.assertEqual(data['results'][0]['store_name'], 'vendor gifts')
+        self.assertEqual(data['missing'], [999999])
+
+
+# -----------------------------
+# CATALOG CHANGE FEED
+# -----------------------------
+
+class ChangeFeedTests(ShopTestCase):
+    """Keyset paging over products, stores and tombstones."""
+
+    def setUp(self):
+        _, _, self.store = make_vendor('vendor')
+        self.products = [make_product(self.store, name)
+                         for name in ('Mug', 'Teapot', 'Vase')]
+        # Everything settled a minute ago, products sharing one timestamp.
+        self.then = timezone.now() - timedelta(minutes=1)
+        Product.objects.update(updated_at=self.then)
+        Store.objects.update(updated_at=self.then - timedelta(seconds=1))
+        self.now = timezone.now()
+
+    def read_all(self, limit):
+        positions = change_feed.initial_cursor()
+        changes = []
+        while True:
+            page, positions, has_more = change_feed.read_changes(
+                positions, limit=limit, now=self.now)
+            self.assertLessEqual(len(page), limit)
+            changes += page
+            positions = change_feed.decode_cursor(
+                change_feed.encode_cursor(positions))
+            if not has_more:
+                return changes, positions
+
+    def test_pages_return_each_change_once_in_order(self):
+        vase_id = self.products[2].id
+        self.products[2].delete()
+        CatalogTombstone.objects.update(deleted_at=self.then)
+        changes, _ = self.read_all(limit=1)
+        self.assertEqual(
+            [(change['type'], change['op'], change['id'])
+             for change in changes],
+            [('store', 'upsert', self.store.id),
+             ('product', 'upsert', self.products[0].id),
+             ('product', 'upsert', self.products[1].id),
+             ('product', 'delete', vase_id)])
+
+    def test_cursor_only_moves_forward(self):
+        _, positions = self.read_all(limit=10)
+        mug = self.products[0]
+        Product.objects.filter(pk=mug.pk).update(
+            updated_at=self.then + timedelta(seconds=10))
+        changes, _, has_more = change_feed.read_changes(positions,
+                                                        now=self.now)
+        self.assertEqual([change['id'] for change in changes], [mug.id])
+        self.assertFalse(has_more)
+
+    def test_recent_changes_wait_for_settle_delay(self):
+        _, positions = self.read_all(limit=10)
+        mug = self.products[0]
+        until = self.now - change_feed.SETTLE_DELAY
+        Product.objects.filter(pk=mug.pk).update(updated_at=until)
+        changes, held, _ = change_feed.read_changes(positions, now=self.now)
+        self.assertEqual((changes, held), ([], positions))
+
+        Product.objects.filter(pk=mug.pk).update(
+            updated_at=until - timedelta(microseconds=1))
+        changes, _, _ = change_feed.read_changes(positions, now=self.now)
+        self.assertEqual([change['id'] for change in changes], [mug.id])
+
+    def test_bad_cursor_is_refused(self):
+        with self.assertRaises(change_feed.InvalidCursor):
+            change_feed.decode_cursor('not-a-cursor')
+        response = self.client.get('/api/changes/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+
+# -----------------------------
+# ORDER ARCHIVE
+# -----------------------------
+
+class ArchiveTests(ShopTestCase):
+    """Archiving cold orders and paging history across both tables."""
+
+    def setUp(self):
+        _, _, store = make_vendor('vendor')
+        self.product = make_product(store)
+        self.buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        self.now = timezone.now()
+
+    def order(self, days_ago, status='completed'):
+        order = make_order(self.buyer, self.product, status)
+        Order.objects.filter(pk=order.pk).update(
+            created_at=self.now - timedelta(days=days_ago),
+            placed_at=self.now - timedelta(days=days_ago))
+        return order
+
+    def test_archives_old_finished_orders_with_their_lines(self):
+        old = self.order(400)
+        self.order(400, 'processing')
+        self.order(10)
+        moved = []
+        self.assertEqual(
+            archive.archive_orders(365, batch_size=1, now=self.now,
+                                   progress=lambda *totals:
+                                   moved.append(totals)),
+            (1, 1))
+        self.assertEqual(moved, [(1, 1)])
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual(archived.id, old.id)
+        self.assertEqual(archived.placed_at, self.now - timedelta(days=400))
+        self.assertEqual(archived.items.get().product, self.product)
+        self.assertFalse(Order.objects.filter(pk=old.pk).exists())
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_id_conflict_keeps_the_live_order(self):
+        old = self.order(400)
+        ArchivedOrder.objects.create(id=old.id, buyer=self.buyer,
+                                     total_price=0, status='completed',
+                                     created_at=self.now)
+        with self.assertRaises(IntegrityError):
+            archive.archive_batch(self.now)
+        self.assertTrue(Order.objects.filter(pk=old.pk).exists())
+        self.assertTrue(OrderItem.objects.filter(order=old).exists())
+
+    def test_history_pages_across_live_and_archived_orders(self):
+        orders = [self.order(days) for days in range(0, 700, 100)]
+        self.order(0, 'pending')  # the cart, not history
+        # Ties on created_at are broken by id, newest first.
+        Order.objects.filter(pk=orders[1].pk).update(
+            created_at=self.now - timedelta(days=200))
+        archive.archive_orders(365, now=self.now)
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+
+        seen, before = [], None
+        while True:
+            page, before = archive.order_history(self.buyer, before,
+                                                 limit=2)
+            self.assertLessEqual(len(page), 2)
+            seen += [order.id for order in page]
+            if before is None:
+                break
+            before = archive.decode_history_cursor(
+                archive.encode_history_cursor(before))
+        self.assertEqual(seen, [orders[0].id, orders[2].id, orders[1].id]
+                         + [order.id for order in orders[3:]])
+
+    def test_bad_history_cursor(self):
+        for token in ('', 'garbage', 'bm9waXBl', 'é'):
+            self.assertIsNone(archive.decode_history_cursor(token))
+        self.client.force_login(self.buyer)
+        self.order(1)
+        response = self.client.get('/shop/orders/?before=garbage')
+        self.assertEqual(len(response.context['orders']), 1)
+
+
+# -----------------------------
+# SIGNAL PROFILING
+# -----------------------------
+
+def early_receiver(sender, **kwargs):
+    return 'early'
+
+
+def late_receiver(sender, **kwargs):
+    return 'late'
+
+
+class SignalProfilingTests(ShopTestCase):
+    """Timing receivers without changing how signals connect."""
+
+    def setUp(self):
+        self.signal = Signal()
+        self.signal.connect(early_receiver)
+        self.signal.connect(early_receiver, dispatch_uid='own-uid')
+        profiling.install()
+        self.addCleanup(profiling.uninstall)
+        profiling.reset()
+        self.addCleanup(profiling.reset)
+
+    def test_receivers_connected_after_install_are_timed(self):
+        self.signal.connect(late_receiver)
+        responses = [response for _, response in self.signal.send(None)]
+        self.assertEqual(sorted(responses), ['early', 'early', 'late'])
+        self.assertEqual(
+            [receiver for (_, receiver) in profiling.snapshot()],
+            [f'{__name__}.late_receiver'])
+
+    def test_disconnect_finds_every_receiver(self):
+        self.signal.connect(late_receiver)
+        self.signal.connect(late_receiver, dispatch_uid='late-uid')
+        self.assertTrue(self.signal.disconnect(late_receiver))
+        self.assertTrue(self.signal.disconnect(early_receiver))
+        self.assertTrue(self.signal.disconnect(dispatch_uid='own-uid'))
+        self.assertTrue(self.signal.disconnect(dispatch_uid='late-uid'))
+        self.assertFalse(self.signal.has_listeners())
+
+    def test_collected_receivers_are_disconnected(self):
+        def temporary(sender, **kwargs):
+            pass
+        self.signal.connect(temporary)
+        self.assertEqual(len(self.signal.receivers), 3)
+        del temporary
+        gc.collect()
+        self.assertEqual(len(self.signal.receivers), 2)
+
+    def test_snapshots_are_merged_from_files(self):
+        self.signal.connect(late_receiver)
+        self.signal.send(None)
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(SIGNAL_PROFILE_DIR=directory):
+            profiling.flush(force=True)
+            self.assertEqual(profiling.collected(), profiling.snapshot())
+            profiling.clear_collected()
+            self.assertEqual(profiling.collected(), {})
+
+
+# -----------------------------
+# VENDOR DIGESTS
+# -----------------------------
+
+class VendorDigestTests(ShopTestCase):
+    """Each order line is emailed to its vendor exactly once."""
+
+    def setUp(self):
+        self.start = timezone.now() - timedelta(hours=1)
+        notifications.send_vendor_digests(now=self.start)  # first mark
+        self.buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        self.products = []
+        for name in ('ann', 'bob'):
+            _, _, store = make_vendor(name)
+            self.products.append(make_product(store))
+
+    def place(self, product, minutes):
+        order = make_order(self.buyer, product)
+        Order.objects.filter(pk=order.pk).update(
+            placed_at=self.start + timedelta(minutes=minutes))
+
+    def send(self, minutes):
+        mail.outbox = []
+        result = notifications.send_vendor_digests(
+            now=self.start + timedelta(minutes=minutes))
+        return result, sorted(message.to[0] for message in mail.outbox)
+
+    def test_lines_are_sent_once_across_runs(self):
+        self.place(self.products[0], 1)
+        self.place(self.products[0], 2)
+        self.place(self.products[1], 4.5)  # still settling at minute 5
+        self.assertEqual(self.send(5), ({'vendors': 1, 'lines': 2},
+                                        ['ann@example.com']))
+        self.assertEqual(self.send(6), ({'vendors': 1, 'lines': 1},
+                                        ['bob@example.com']))
+        self.assertEqual(self.send(7), ({'vendors': 0, 'lines': 0}, []))
+
+    def test_partial_failure_keeps_unsent_vendors_marks(self):
+        self.place(self.products[0], 1)
+        self.place(self.products[1], 2)
+        send_messages = locmem.EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise ConnectionError("mail server went away")
+            return send_messages(backend, messages)
+
+        mail.outbox = []
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', flaky):
+            with self.assertRaises(ConnectionError):
+                notifications.send_vendor_digests(
+                    now=self.start + timedelta(minutes=5))
+        sent_to = mail.outbox[0].to[0]
+        self.assertEqual(VendorDigestMark.objects.filter(
+            vendor__isnull=False).count(), 1)
+
+        result, recipients = self.send(6)
+        self.assertEqual(result, {'vendors': 1, 'lines': 1})
+        self.assertNotIn(sent_to, recipients)
+        self.assertFalse(VendorDigestMark.objects.filter(
+            vendor__isnull=False).exists())
+        self.assertEqual(self.send(7), ({'vendors': 0, 'lines': 0}, []))
+
+
+# -----------------------------
+# AUTOCOMPLETE
+# -----------------------------
+
+class PrefixIndexTests(SimpleTestCase):
+    """In-place updates, short-prefix caching and snapshots."""
+
+    def setUp(self):
+        self.index = autocomplete.PrefixIndex()
+        self.index.load([('product', 1, 'Coffee Mug', 5.0),
+                         ('product', 2, 'Mug Tree', 1.0),
+                         ('store', 7, 'Mugs & More', 3.0)])
+
+    def names(self, query, kind=None):
+        return [hit['name'] for hit in self.index.search(query, 10, kind)]
+
+    def test_search_matches_word_starts_by_weight(self):
+        self.assertEqual(self.names('mug'),
+                         ['Coffee Mug', 'Mugs & More', 'Mug Tree'])
+        self.assertEqual(self.names('MUG', 'product'),
+                         ['Coffee Mug', 'Mug Tree'])
+        self.assertEqual(self.names('tea'), [])
+
+    def test_put_remove_and_merge(self):
+        self.index.put('product', 3, 'Teapot', 2.0)
+        self.index.put('product', 2, 'Tea Tree')  # renamed, keeps weight
+        self.index.remove('product', 1)
+        self.assertEqual(self.names('tea'), ['Teapot', 'Tea Tree'])
+        self.assertEqual(self.names('mug'), ['Mugs & More'])
+        with mock.patch.object(autocomplete, 'MERGE_AT', 0):
+            self.index.put('product', 4, 'Mug Rack', 0.5)
+        self.assertFalse(self.index._added or self.index._removed)
+        self.assertEqual(self.names('mug'), ['Mugs & More', 'Mug Rack'])
+        self.assertEqual(self.names('tea'), ['Teapot', 'Tea Tree'])
+
+    def test_changes_invalidate_cached_short_prefixes(self):
+        self.assertEqual(self.names('mu'),
+                         ['Coffee Mug', 'Mugs & More', 'Mug Tree'])
+        self.index.put('product', 3, 'Mustard Pot', 9.0)
+        self.assertEqual(self.names('mu')[0], 'Mustard Pot')
+        self.index.remove('product', 3)
+        self.assertNotIn('Mustard Pot', self.names('mu'))
+
+    def test_short_prefix_cache_is_bounded(self):
+        self.names('zz')
+        self.assertEqual(self.index._short_cache, {})  # no results
+        with mock.patch.object(autocomplete, 'SHORT_CACHE_MAX', 2):
+            for query in ('m', 'mu', 'c', 'co'):
+                self.names(query)
+        self.assertEqual(list(self.index._short_cache),
+                         [('c', None), ('co', None)])
+
+    def test_snapshot_round_trip(self):
+        self.index.put('product', 3, 'Teapot', 2.0)
+        self.index.synced_at = timezone.now()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/index.json'
+            autocomplete.save_snapshot(self.index, path)
+            copy = autocomplete.PrefixIndex()
+            self.assertTrue(autocomplete.load_snapshot(copy, path))
+            self.assertFalse(autocomplete.load_snapshot(
+                copy, f'{tmp}/missing.json'))
+        self.assertEqual(sorted(copy.items()), sorted(self.index.items()))
+        self.assertEqual(copy.synced_at, self.index.synced_at)
+        self.assertEqual(copy.search('mug'), self.index.search('mug'))
+
+
+@override_settings(THROTTLE_BUCKETS={
+    'public_ip': {'rate': '2/m', 'burst': 2},
+    'public_user': {'rate': '100/m', 'burst': 100},
+    'public_endpoint': {'rate': '5/m', 'burst': 5},
+})
+class AutocompleteViewTests(ShopTestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(autocomplete, 'search', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_view_is_throttled_per_client(self):
+        for _ in range(2):
+            response = self.client.get('/api/autocomplete/?q=mug',
+                                       REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/autocomplete/?q=mug',
+                                   REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.get('/api/autocomplete/?q=mug',
+                                         REMOTE_ADDR='10.0.0.2')
+                         .status_code, 200)
+
+
+# -----------------------------
+# LISTING CACHE
+# -----------------------------
+
+class ListingCacheTests(ShopTestCase):
+    """Version-keyed listing results: hit, stale and miss."""
+
+    def setUp(self):
+        cache.clear()
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        return [self.computed]
+
+    def result(self):
+        return listing_cache.cached_result('store', 1, '', self.compute)
+
+    def test_miss_then_hit(self):
+        self.assertEqual(self.result(), ([1], 'miss'))
+        self.assertEqual(self.result(), ([1], 'hit'))
+        self.assertEqual(self.computed, 1)
+
+    def test_bump_waits_for_commit(self):
+        self.result()
+        with self.captureOnCommitCallbacks() as callbacks:
+            listing_cache.bump('store', [1])
+            self.assertEqual(self.result(), ([1], 'hit'))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.result(), ([2], 'miss'))
+
+    def test_stale_result_while_another_request_recomputes(self):
+        self.result()
+        with self.captureOnCommitCallbacks(execute=True):
+            listing_cache.bump('store', [1])
+        version = listing_cache.get_version('store', 1)
+        key = listing_cache.result_key('store', 1, '', version)
+        cache.add(f'{key}:lock', 1)  # another request is recomputing
+        self.assertEqual(self.result(), ([1], 'stale'))
+        self.assertEqual(self.computed, 1)
+
+    def test_variant_ignores_unknown_parameters_and_values(self):
+        allowed = {'sort': ('trending', 'bestsellers')}
+        self.assertEqual(listing_cache.variant({'x': '1'}, allowed), '')
+        self.assertEqual(listing_cache.variant({'sort': 'bogus'}, allowed),
+                         '')
+        self.assertEqual(listing_cache.variant({'sort': 'trending'},
+                                               allowed), 'sort=trending')
+
+    def test_product_list_endpoint(self):
+        _, _, store = make_vendor('vendor')
+        make_product(store)
+        url = f'/api/stores/{store.id}/products/'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(f'{url}?x=1')['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product(store, name='Teapot')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Teapot', response.content.decode())
+
+
+# -----------------------------
+# ADMIN
+# -----------------------------
+
+class OrderAdminTests(ShopTestCase):
+    """Order pages load line products in a fixed number of queries."""
+
+    def test_order_page_queries_do_not_grow_with_lines(self):
+        admin_user = User.objects.create_superuser('admin', 'a@example.com',
+                                                   'pw')
+        self.client.force_login(admin_user)
+        _, _, store = make_vendor('vendor')
+        products = [make_product(store, name=f'Mug {n}') for n in range(4)]
+        small = make_basket(admin_user, products[:1])
+        large = make_basket(admin_user, products)
+
+        def queries(order):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(
+                    f'/admin/shop/order/{order.pk}/change/')
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        queries(small)  # warms the content type cache
+        self.assertEqual(queries(large), queries(small))
+
+
+# -----------------------------
+# CHUNKED UPLOADS
+# -----------------------------
+
+class ChunkedUploadTests(ShopTestCase):
+    """Chunks arrive in any order; bad files never reach the product."""
+
+    def setUp(self):
+        upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(upload_dir.cleanup)
+        self.enterContext(override_settings(
+            CHUNKED_UPLOAD_DIR=upload_dir.name))
+        self.enterContext(mock.patch.object(uploads, 'CHUNK_SIZE', 4))
+        self.vendor, _, store = make_vendor('vendor')
+        self.product = make_product(store)
+
+    def start(self, data, sha256=None):
+        return uploads.start_session(
+            self.vendor, 'product_image', self.product.id, 'mug.png',
+            len(data), sha256 or hashlib.sha256(data).hexdigest())
+
+    def send(self, session, data, number, sha256=None):
+        chunk = data[number * 4:(number + 1) * 4]
+        return uploads.write_chunk(session, number, io.BytesIO(chunk),
+                                   len(chunk), sha256)
+
+    def test_out_of_order_and_repeated_chunks(self):
+        data = b'0123456789'
+        session = self.start(data)
+        for number in (2, 0, 0):
+            session = self.send(session, data, number)
+        self.assertEqual(uploads.missing_chunks(session), [1])
+        with self.assertRaises(uploads.UploadError):
+            uploads.complete_session(session)
+
+        session = self.send(session, data, 1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            session = uploads.complete_session(session)
+        self.assertEqual(session.status, 'processing')
+        self.assertEqual(len(callbacks), 1)
+        with open(uploads.temp_path(session), 'rb') as fh:
+            self.assertEqual(fh.read(), data)
+
+    def test_bad_chunk_checksum_marks_chunk_missing(self):
+        data = b'0123456789'
+        session = self.send(self.start(data), data, 0)
+        with self.assertRaises(uploads.UploadError):
+            self.send(session, data, 0, sha256='0' * 64)
+        session.refresh_from_db()
+        self.assertEqual(uploads.missing_chunks(session), [0, 1, 2])
+
+    def test_file_checksum_mismatch_resets_the_session(self):
+        data = b'0123456789'
+        session = self.start(data, sha256='0' * 64)
+        for number in range(3):
+            session = self.send(session, data, number)
+        with self.assertRaises(uploads.UploadError):
+            uploads.complete_session(session)
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.received), ('open', []))
+
+    def complete(self, data):
+        session = self.start(data)
+        for number in range(session.chunk_count):
+            session = self.send(session, data, number)
+        with self.captureOnCommitCallbacks():  # no worker thread
+            uploads.complete_session(session)
+        uploads.process_session(session.pk)
+        session.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertFalse(uploads.temp_path(session).exists())
+        return session
+
+    def test_invalid_image_fails_the_session(self):
+        session = self.complete(b'not an image')
+        self.assertEqual((session.status, session.error),
+                         ('failed', "Not a valid image."))
+        self.assertFalse(self.product.image)
+
+    def test_valid_image_is_attached(self):
+        out = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(out, 'PNG')
+        session = self.complete(out.getvalue())
+        self.assertEqual(session.status, 'done')
+        self.assertEqual(self.product.image.name,
+                         f'products/{session.pk}.jpg')
+
+
+# -----------------------------
+# AVAILABILITY CACHE
+# -----------------------------
+
+class AvailabilityCacheTests(ShopTestCase):
+    """Reads cache what they load; deltas keep cached values current."""
+
+    def setUp(self):
+        cache.clear()
+        _, _, store = make_vendor('vendor')
+        self.product = make_product(store, stock=10)
+
+    def get(self):
+        pid = self.product.id
+        return availability.get_availability([pid]).get(pid)
+
+    def test_deltas_apply_to_cached_values(self):
+        self.assertEqual(self.get(), 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.product, 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(), 7)
+
+    def test_read_racing_a_delta_does_not_cache_its_old_value(self):
+        load = availability._load
+
+        def racing_load(product_ids):
+            loaded = load(product_ids)
+            # A checkout commits before this read caches what it loaded.
+            with self.captureOnCommitCallbacks(execute=True):
+                inventory.reserve(self.product, 3)
+            return loaded
+
+        with mock.patch.object(availability, '_load', racing_load):
+            self.assertEqual(self.get(), 10)
+        self.assertEqual(
+            cache.get(availability.availability_key(self.product.id)),
+            availability.UNSETTLED)
+        self.assertEqual(self.get(), 7)
+
+
+# -----------------------------
+# ORDER STATUS TRANSITIONS
+# -----------------------------
+
+class OrderTransitionTests(ShopTestCase):
+    """Bulk status changes only make allowed moves on the vendor's orders."""
+
+    def setUp(self):
+        self.vendor, self.profile, store = make_vendor('vendor')
+        _, _, other_store = make_vendor('other')
+        self.product = make_product(store)
+        other_product = make_product(other_store)
+        buyer = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        self.processing = make_order(buyer, self.product)
+        self.pending = make_order(buyer, self.product, 'pending')
+        self.others = make_order(buyer, other_product)
+        self.mixed = make_order(buyer, self.product)
+        OrderItem.objects.create(order=self.mixed, product=other_product,
+                                 quantity=1, price=other_product.price)
+
+    def test_refused_transitions(self):
+        changed, rejected = order_status.bulk_transition(
+            [self.processing.id, self.pending.id, self.others.id,
+             self.mixed.id, 999999],
+            'shipped', vendor=self.profile)
+        self.assertEqual(changed, [self.processing.id])
+        self.assertEqual(rejected, [
+            {'id': self.pending.id, 'reason': 'invalid_transition',
+             'status': 'pending'},
+            {'id': self.others.id, 'reason': 'not_found'},
+            {'id': self.mixed.id, 'reason': 'not_found'},
+            {'id': 999999, 'reason': 'not_found'},
+        ])
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, 'pending')
+
+    def test_finished_orders_do_not_move(self):
+        order_status.bulk_transition([self.processing.id], 'cancelled')
+        changed, rejected = order_status.bulk_transition(
+            [self.processing.id], 'shipped')
+        self.assertEqual(changed, [])
+        self.assertEqual(rejected[0]['status'], 'cancelled')
+
+    def test_endpoint_refuses_unknown_target_status(self):
+        client = APIClient()
+        client.force_authenticate(self.vendor)
+        response = client.post('/api/vendor/orders/status/',
+                               {'ids': [self.processing.id],
+                                'status': 'pending'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/api/vendor/orders/status/',
+                               {'ids': [self.processing.id],
+                                'status': 'shipped'}, format='json')
+        self.assertEqual(response.json()['changed'], [self.processing.id])
+
+
+
+    def test_cancelling_returns_reserved_stock(self):
+        item = self.processing.items.get()
+        inventory.commit_order(self.processing)
+        self.assertEqual(inventory.available_stock(
+            [self.product.id])[self.product.id], 9)
+        with self.captureOnCommitCallbacks(execute=True):
+            order_status.bulk_transition([self.processing.id], 'cancelled',
+                                         vendor=self.profile)
+        self.assertEqual(inventory.available_stock(
+            [self.product.id])[self.product.id], 10)
+        self.assertEqual(availability.get_availability(
+            [self.product.id])[self.product.id], 10)
+        self.assertFalse(item.reservations.exclude(
+            status='released').exists())
+
+
+# -----------------------------
+# METRICS
+# -----------------------------
+
+@override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'])
+class MetricsTests(ShopTestCase):
+    """Scrapes are restricted; per-thread and per-process totals add up."""
+
+    def test_only_allowed_ips_and_staff_can_scrape(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9')
+                         .status_code, 404)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+                         .status_code, 200)
+        user = User.objects.create_user('buyer', 'b@example.com', 'pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9')
+                         .status_code, 404)
+        user.is_staff = True
+        user.save()
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE giftmarket_queue_depth gauge',
+                      response.content.decode())
+
+    def test_thread_shards_are_summed(self):
+        key = ('giftmarket_cache_requests_total',
+               (('cache', 'shards'), ('result', 'hit')))
+        before = metrics.snapshot()['counters'].get(key, 0)
+
+        def record():
+            metrics.cache_lookups('shards', 2, 0)
+            metrics.observe('giftmarket_http_request_duration_seconds',
+                            0.02, route='shards')
+
+        threads = [threading.Thread(target=record) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        record()
+
+        snap = metrics.snapshot()
+        self.assertEqual(snap['counters'][key] - before, 8)
+        entry = snap['histograms'][(
+            'giftmarket_http_request_duration_seconds',
+            (('route', 'shards'),))]
+        self.assertEqual(entry[-1], 4)
+        self.assertEqual(entry[metrics.BUCKETS.index(0.025)], 4)
+
+    def test_process_files_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory:
+            other = {'counters': {('giftmarket_log_records_dropped_total',
+                                   ()): 5},
+                     'histograms': {}}
+            with open(f'{directory}/1.json', 'w') as fh:
+                json.dump(metrics._encode(other), fh)
+            with override_settings(METRICS_DIR=directory):
+                own = metrics.snapshot()['counters'].get(
+                    ('giftmarket_log_records_dropped_total', ()), 0)
+                total = metrics.collected()['counters'][
+                    ('giftmarket_log_records_dropped_total', ())]
+        self.assertEqual(total, own + 5)
+
+
+# -----------------------------
+# STRUCTURED LOGGING
+# -----------------------------
+
+@override_settings(AUTOCOMPLETE_WARM_UP=False)
+class StructuredLogTests(SimpleTestCase):
+    """JSON lines carry the request id and ``extra`` fields."""
+
+    def record(self, level=logging.INFO, msg="order %s placed", args=(7,),
+               exc_info=None, **extra):
+        record = logging.LogRecord('shop.test', level, __file__, 1, msg,
+                                   args, exc_info)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = self.record(exc_info=sys.exc_info(), order_id=7,
+                                 request_id='abc')
+        data = json.loads(log.JsonFormatter().format(record))
+        self.assertEqual(
+            {key: data[key] for key in ('level', 'logger', 'message',
+                                        'request_id', 'order_id')},
+            {'level': 'INFO', 'logger': 'shop.test',
+             'message': "order 7 placed", 'request_id': 'abc',
+             'order_id': 7})
+        self.assertIn('ValueError: boom', data['exc'])
+        self.assertNotIn('args', data)
+
+    def test_request_id_filter(self):
+        request_filter = log.RequestIdFilter()
+        record = self.record()
+        self.assertTrue(request_filter.filter(record))
+        self.assertIsNone(record.request_id)
+
+        token = log.request_id_var.set('from-context')
+        try:
+            request_filter.filter(record)
+        finally:
+            log.request_id_var.reset(token)
+        self.assertEqual(record.request_id, 'from-context')
+
+        # django.request logs after the middleware, with the request.
+        record = self.record(request=mock.Mock(request_id='from-request'))
+        request_filter.filter(record)
+        self.assertEqual(record.request_id, 'from-request')
+
+    def test_debug_sampling_is_per_request(self):
+        sample = log.SampleDebugFilter(rate=0.5)
+        for request_id in ('a', 'b', 'c', 'd'):
+            kept = {sample.filter(self.record(logging.DEBUG,
+                                              request_id=request_id))
+                    for _ in range(5)}
+            self.assertEqual(len(kept), 1)
+        self.assertTrue(sample.filter(self.record(logging.WARNING)))
+
+    def test_request_id_header(self):
+        self.assertEqual(log.new_request_id('req-1'), 'req-1')
+        self.assertNotEqual(log.new_request_id('bad id\n'), 'bad id\n')
+        response = self.client.get('/no-such-page/',
+                                   HTTP_X_REQUEST_ID='req-1')
+        self.assertEqual(response['X-Request-ID'], 'req-1')
+
+    def test_full_queue_drops_and_counts(self):
+        handler = log.QueueingHandler(target_kwargs={'stream': io.StringIO()},
+                                      queue_size=1)
+        handler.close()  # no listener: the queue stays full
+        key = ('giftmarket_log_records_dropped_total', ())
+        before = metrics.snapshot()['counters'].get(key, 0)
+        handler.handle(self.record())
+        handler.handle(self.record())
+        self.assertEqual(metrics.snapshot()['counters'][key] - before, 1)
@@ -0,0 +1,190 @@
+"""
+Token-bucket API throttles for the Giftmarket public endpoints.
+
+Each bucket holds up to ``burst`` tokens and refills at ``rate``. A
+request spends one token, and a request that finds the bucket empty is
+rejected with ``Retry-After``.
+
+A bucket is stored as one integer cache entry: the time (in
+microseconds) at which it will be full again, as in GCRA. Spending a
+token is a single atomic ``incr`` of one refill interval, so concurrent
+requests never overwrite each other's debits; a refused request gives
+its token back with ``decr``. Any Django cache backend with ``incr``
+works (locmem, memcached and Redis included). An allowed request costs
+one ``incr`` and one ``touch`` per throttle.
+
+DRF asks every throttle even after one has refused the request. A
+bucket is not charged for a request another throttle already refused,
+so ``PublicEndpointThrottle`` (listed last) only counts requests that
+passed the client's own buckets. One client hammering an endpoint
+cannot use up its shared budget.
+
+Budgets are configured in ``settings.THROTTLE_BUCKETS``::
+
+    THROTTLE_BUCKETS = {
+        'public_ip': {'rate': '5/s', 'burst': 30},
+        'public_user': {'rate': '10/s', 'burst': 60},
+        'public_endpoint': {'rate': '200/s', 'burst': 400},
+    }
+
+Client IPs come from ``REMOTE_ADDR`` unless ``NUM_PROXIES`` (in
+``REST_FRAMEWORK``) says how many trusted proxies add ``X-Forwarded-For``.
+"""
+
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+MICROS = 1_000_000
+
+
+def parse_rate(rate):
+    """Parse ``'<n>/<period>'`` into tokens per second."""
+    num, period = rate.split('/')
+    return int(num) / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base class: subclasses set ``scope`` and implement ``get_ident_key``."""
+    scope = None
+    cache = cache
+    timer = time.time
+
+    def __init__(self):
+        config = getattr(settings, 'THROTTLE_BUCKETS', {})[self.scope]
+        self.rate = parse_rate(config['rate'])
+        self.burst = config.get('burst', max(int(self.rate), 1))
+        self.interval = max(int(MICROS / self.rate), 1)  # per token
+        self.wait_seconds = None
+
+    def get_ident_key(self, request, view):
+        """Return the bucket identity, or None to skip throttling."""
+        raise NotImplementedError
+
+    def _spend(self, key, now):
+        """Take one token; return the bucket's new full-again time."""
+        try:
+            full_at = self.cache.incr(key, self.interval)
+        except ValueError:  # no bucket yet (or it expired): it is full
+            if self.cache.add(key, now + self.interval,
+                              self._timeout(now + self.interval, now)):
+                return now + self.interval
+            full_at = self.cache.incr(key, self.interval)
+        if full_at - self.interval < now:
+            # The bucket had refilled completely; restart it from now.
+            # Debits racing this reset are lost, but only when the
+            # bucket is full, so at most a few tokens are given away.
+            full_at = now + self.interval
+            self.cache.set(key, full_at, self._timeout(full_at, now))
+        return full_at
+
+    @staticmethod
+    def _timeout(full_at, now):
+        # Entries expire once the bucket would be full again anyway.
+        return math.ceil((full_at - now) / MICROS) + 1
+
+    def allow_request(self, request, view):
+        ident = self.get_ident_key(request, view)
+        if ident is None or getattr(request, '_throttle_refused', False):
+            return True
+
+        key = f'throttle:bucket:{self.scope}:{ident}'
+        now = int(self.timer() * MICROS)
+        full_at = self._spend(key, now)
+        capacity = self.burst * self.interval
+
+        allowed = full_at - now <= capacity
+        if allowed:
+            self.wait_seconds = None
+            self.cache.touch(key, self._timeout(full_at, now))
+        else:
+            self.cache.decr(key, self.interval)  # give the token back
+            full_at -= self.interval
+            self.wait_seconds = (full_at + self.interval - capacity
+                                 - now) / MICROS
+            request._throttle_refused = True
+        self._record(request, (capacity - (full_at - now)) / self.interval,
+                     (full_at - now) / MICROS)
+        return allowed
+
+    def _record(self, request, tokens, reset):
+        """Keep the tightest bucket on the request for RateLimit headers."""
+        state = (max(int(tokens), 0), self.burst, math.ceil(reset))
+        current = getattr(request, '_ratelimit', None)
+        if current is None or state[0] < current[0]:
+            request._ratelimit = state
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class PublicIPThrottle(TokenBucketThrottle):
+    """Per-client-IP budget."""
+    scope = 'public_ip'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class PublicUserThrottle(TokenBucketThrottle):
+    """Per-user budget for logged-in clients (anonymous ones use the IP)."""
+    scope = 'public_user'
+
+    def get_ident_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+class PublicEndpointThrottle(TokenBucketThrottle):
+    """Budget shared by all clients of one endpoint, to protect the DB."""
+    scope = 'public_endpoint'
+
+    def get_ident_key(self, request, view):
+        return type(view).__name__
+
+
+PUBLIC_THROTTLES = [PublicIPThrottle, PublicUserThrottle,
+                    PublicEndpointThrottle]
+
+
+def throttle_wait(request, view, throttle_classes=PUBLIC_THROTTLES):
+    """
+    Run throttles outside DRF, as ``APIView.check_throttles`` does.
+
+    Returns None if every throttle allows the request, else the seconds
+    to wait. Used by the async views, which are not DRF views; pass an
+    instance of the matching DRF view so both share endpoint budgets.
+    """
+    waits = []
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, view):
+            waits.append(throttle.wait())
+    if not waits:
+        return None
+    return max((wait for wait in waits if wait is not None), default=0)
+
+
+def add_ratelimit_headers(request, response):
+    """Add ``RateLimit-*`` headers for the tightest bucket to ``response``."""
+    state = getattr(request, '_ratelimit', None)
+    if state is not None:
+        remaining, limit, reset = state
+        response['RateLimit-Limit'] = str(limit)
+        response['RateLimit-Remaining'] = str(remaining)
+        response['RateLimit-Reset'] = str(reset)
+    return response
+
+
+class RateLimitHeadersMixin:
+    """Add ``RateLimit-*`` headers for the tightest bucket to responses."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response,
+                                             *args, **kwargs)
+        return add_ratelimit_headers(request, response)
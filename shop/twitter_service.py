@@ -3,18 +3,24 @@ Twitter (X) integration service.
 
 This module is SAFE to use even if API credentials are missing.
 The application will continue to work without crashing,
-but API usage and errors will always be visible.
+but API usage and errors are always logged (``shop.twitter_service``).
+
+tweepy (and the requests/oauthlib stack behind it) is only imported when
+a tweet is actually sent, so startup does not pay for it.
 """
 
-import tweepy
+import logging
+
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
+
 
 def post_tweet(text, image_url=None):
     """
     Post a tweet to X (Twitter).
 
-    This function is intentionally verbose so that:
+    This function logs every attempt so that:
     - API usage is visible
     - HTTP errors can be inspected
     - The app never crashes
@@ -27,12 +33,14 @@ def post_tweet(text, image_url=None):
 
     # ❗ Do NOT silently skip — log clearly
     if not all([api_key, api_secret, access_token, access_secret]):
-        print(
-            "⚠️ X API credentials are missing. "
+        logger.warning(
+            "X API credentials are missing. "
             "Tweet attempt made but cannot be sent."
         )
         return
 
+    import tweepy
+
     try:
         client = tweepy.Client(
             consumer_key=api_key,
@@ -44,15 +52,15 @@ def post_tweet(text, image_url=None):
         response = client.create_tweet(text=text)
 
         # ✅ Log HTTP response details
-        print("✅ Tweet request sent to X")
-        print("📡 X API response:", response)
+        logger.info("Tweet request sent to X",
+                    extra={'x_response': repr(response)})
 
     except tweepy.TweepyException as e:
         # 🔍 Explicit API error (mentor wants this)
-        print("❌ X API request failed")
-        print("📡 X API error response:", e)
+        logger.warning("X API request failed",
+                       extra={'x_error': str(e)})
 
     except Exception:
         # ❗ Safety net
-        print("❌ Unexpected Twitter error occurred")
+        logger.exception("Unexpected Twitter error occurred")
 
@@ -0,0 +1,309 @@
+"""
+Chunked, resumable image uploads for the Giftmarket shop.
+
+Product images and personalization photos can be large, and phones on
+slow links drop connections. Instead of one multipart request, a client:
+
+1. creates an ``UploadSession`` with the file's name, size and SHA-256;
+2. sends numbered chunks of ``chunk_size`` bytes, in any order. Each
+   chunk is streamed from the socket into a temporary file at its
+   offset, so memory use is bounded by ``STREAM_BLOCK``. A chunk may
+   carry an ``X-Chunk-SHA256`` header, which is checked;
+3. after a disconnect, asks for the session to learn which chunks are
+   still missing;
+4. completes the session. The whole file's hash is checked, then a
+   background worker validates and normalises the image and attaches it
+   to its ``Product`` or ``OrderItem``.
+
+Temporary files live in ``settings.CHUNKED_UPLOAD_DIR``. With several
+app servers this must be a shared volume. ``manage.py process_uploads``
+retries sessions whose worker died and removes abandoned ones.
+"""
+
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .backends import get_vendor_profile
+from .models import OrderItem, Product, UploadSession
+
+CHUNK_SIZE = 1024 * 1024
+STREAM_BLOCK = 64 * 1024
+MAX_PIXELS = 40_000_000  # refuse decompression bombs
+PROCESSING_TIMEOUT = timedelta(minutes=10)
+PROCESS_WORKERS = 2
+
+
+class UploadError(Exception):
+    """A request against an upload session that cannot be honoured."""
+
+
+def max_size():
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 25 * 1024 * 1024)
+
+
+def max_edge():
+    return getattr(settings, 'UPLOAD_IMAGE_MAX_EDGE', 2048)
+
+
+def temp_path(session):
+    """Temporary file holding a session's chunks."""
+    return Path(settings.CHUNKED_UPLOAD_DIR) / f'{session.pk}.part'
+
+
+def _remove_temp(session):
+    try:
+        os.remove(temp_path(session))
+    except FileNotFoundError:
+        pass
+
+
+# -----------------------------
+# TARGETS
+# -----------------------------
+
+def get_target(user, target, target_id):
+    """
+    Return the Product or OrderItem ``user`` may upload an image to.
+
+    Vendors upload images of their own products; buyers upload the
+    personalization photo of a line in their cart, if the product
+    takes one.
+    """
+    if target == 'product_image':
+        vendor_profile = get_vendor_profile(user)
+        product = Product.objects.filter(
+            pk=target_id, store__vendor=vendor_profile).first()
+        if vendor_profile is None or product is None:
+            raise UploadError("Product not found.")
+        return product
+    if target == 'personalized_image':
+        item = OrderItem.objects.filter(
+            pk=target_id, order__buyer=user, order__status='pending',
+            product__personalized_image=True).first()
+        if item is None:
+            raise UploadError("Cart item not found or not personalizable.")
+        return item
+    raise UploadError("Unknown upload target.")
+
+
+# -----------------------------
+# SESSIONS AND CHUNKS
+# -----------------------------
+
+def start_session(user, target, target_id, filename, size, sha256):
+    """Create an upload session and its empty temporary file."""
+    get_target(user, target, target_id)
+    if not 0 < size <= max_size():
+        raise UploadError(f"File size must be 1 to {max_size()} bytes.")
+    sha256 = sha256.lower()
+    if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+        raise UploadError("sha256 must be a hex SHA-256 digest.")
+    session = UploadSession.objects.create(
+        user=user, target=target, target_id=target_id,
+        filename=os.path.basename(filename)[:255] or 'upload',
+        size=size, chunk_size=CHUNK_SIZE, sha256=sha256)
+    Path(settings.CHUNKED_UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    with open(temp_path(session), 'wb') as fh:
+        fh.truncate(size)
+    return session
+
+
+def missing_chunks(session):
+    received = set(session.received)
+    return [n for n in range(session.chunk_count) if n not in received]
+
+
+def write_chunk(session, number, stream, length, sha256=None):
+    """
+    Stream chunk ``number`` from ``stream`` into the session's file.
+
+    ``length`` is the request's Content-Length. Resending a chunk simply
+    overwrites it, so a client may retry any chunk it is unsure of.
+    """
+    if session.status != 'open':
+        raise UploadError("Upload is no longer accepting chunks.")
+    if not 0 <= number < session.chunk_count:
+        raise UploadError("Chunk number out of range.")
+    offset = number * session.chunk_size
+    expected = min(session.chunk_size, session.size - offset)
+    if length != expected:
+        raise UploadError(f"Chunk {number} must be {expected} bytes.")
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(temp_path(session), 'r+b') as fh:
+        fh.seek(offset)
+        while written < expected:
+            block = stream.read(min(STREAM_BLOCK, expected - written))
+            if not block:
+                break
+            digest.update(block)
+            fh.write(block)
+            written += len(block)
+    error = None
+    if written != expected:
+        error = "Chunk was cut short; send it again."
+    elif sha256 and digest.hexdigest() != sha256.lower():
+        error = "Chunk checksum mismatch; send it again."
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(
+            pk=session.pk)
+        # A failed resend has overwritten the chunk, so it is missing.
+        received = set(session.received)
+        (received.discard if error else received.add)(number)
+        if received != set(session.received):
+            session.received = sorted(received)
+            session.save(update_fields=['received', 'updated_at'])
+    if error:
+        raise UploadError(error)
+    return session
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(STREAM_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete_session(session):
+    """
+    Check the assembled file and queue it for processing.
+
+    On a hash mismatch the received chunks are forgotten, so the client
+    sends the file again within the same session.
+    """
+    if session.status != 'open':
+        raise UploadError("Upload is already complete.")
+    if missing_chunks(session):
+        raise UploadError("Some chunks are still missing.")
+    if file_sha256(temp_path(session)) != session.sha256:
+        session.received = []
+        session.save(update_fields=['received', 'updated_at'])
+        raise UploadError("File checksum mismatch; upload it again.")
+    claimed = UploadSession.objects.filter(
+        pk=session.pk, status='open').update(status='processing',
+                                             updated_at=timezone.now())
+    if not claimed:
+        raise UploadError("Upload is already complete.")
+    session.status = 'processing'
+    transaction.on_commit(lambda: _submit(session.pk))
+    return session
+
+
+# -----------------------------
+# PROCESSING (OFF THE REQUEST THREAD)
+# -----------------------------
+
+_executor = None
+
+
+def _submit(session_id):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PROCESS_WORKERS,
+                                       thread_name_prefix='uploads')
+    _executor.submit(_process_in_thread, session_id)
+
+
+def _process_in_thread(session_id):
+    try:
+        process_session(session_id)
+    finally:
+        close_old_connections()
+
+
+def normalise_image(path):
+    """
+    Validate an image file and return ``(bytes, extension)``.
+
+    Applies the EXIF orientation, drops metadata and shrinks the longest
+    edge to ``UPLOAD_IMAGE_MAX_EDGE``. Images with transparency become
+    PNG, others JPEG.
+    """
+    from PIL import Image, ImageOps  # only needed by upload workers
+
+    with Image.open(path) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise UploadError("Image dimensions are too large.")
+        image.verify()
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge(), max_edge()))
+        has_alpha = (image.mode in ('RGBA', 'LA')
+                     or 'transparency' in image.info)
+        out = io.BytesIO()
+        if has_alpha:
+            image.convert('RGBA').save(out, 'PNG', optimize=True)
+            return out.getvalue(), 'png'
+        image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+        return out.getvalue(), 'jpg'
+
+
+def _fail(session, message):
+    session.status, session.error = 'failed', message[:255]
+    session.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def process_session(session_id):
+    """Validate, normalise and attach a completed upload."""
+    session = (UploadSession.objects.select_related('user')
+               .filter(pk=session_id, status='processing').first())
+    if session is None:
+        return
+    try:
+        try:
+            data, extension = normalise_image(temp_path(session))
+        except UploadError as exc:
+            return _fail(session, str(exc))
+        except Exception:  # Pillow raises many types for bad files
+            return _fail(session, "Not a valid image.")
+        try:
+            target = get_target(session.user, session.target,
+                                session.target_id)
+        except UploadError as exc:
+            return _fail(session, str(exc))
+        field = ('image' if session.target == 'product_image'
+                 else 'personalized_image')
+        getattr(target, field).save(f'{session.pk}.{extension}',
+                                    ContentFile(data), save=False)
+        target.save(update_fields=[field, 'updated_at'])
+        session.status = 'done'
+        session.save(update_fields=['status', 'updated_at'])
+    finally:
+        _remove_temp(session)
+
+
+# -----------------------------
+# SWEEPING
+# -----------------------------
+
+def stalled_sessions(now=None):
+    """Sessions left in processing by a worker that died."""
+    cutoff = (now or timezone.now()) - PROCESSING_TIMEOUT
+    return UploadSession.objects.filter(status='processing',
+                                        updated_at__lt=cutoff)
+
+
+def expire_sessions(older_than, now=None):
+    """Delete sessions idle longer than ``older_than`` and their files."""
+    cutoff = (now or timezone.now()) - older_than
+    expired = UploadSession.objects.filter(
+        status__in=('open', 'done', 'failed'), updated_at__lt=cutoff)
+    count = 0
+    for session in expired.iterator():
+        _remove_temp(session)
+        count += 1
+    expired.delete()
+    return count
@@ -1,5 +1,9 @@
 """Views for the Giftmarket shop application."""
 
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
@@ -7,8 +11,16 @@ from django.contrib import messages
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Avg
-from .models import Product, Order, OrderItem, Review, Store, VendorProfile, User
+from django.utils import timezone
+from .models import Product, Order, Review, Store, VendorProfile, User
+from . import archive, metrics
+from .backends import get_vendor_profile
+from .cart import CartFull, get_cart
+from .inventory import InsufficientStock, commit_order
+from .recommendations import get_recommendations, refresh_for_order
+from .popularity import record_order, sort_by_popularity
 from .forms import (
     BuyerSignupForm,
     VendorSignupForm,
@@ -16,22 +28,26 @@ from .forms import (
     ProductForm,
     ProductUpdateForm)
 
+logger = logging.getLogger(__name__)
+
 
 @login_required
 def vendor_store_list(request):
     """List all stores owned by the vendor."""
-    if not hasattr(request.user, "vendor_profile"):
+    vendor_profile = get_vendor_profile(request.user)
+    if vendor_profile is None:
         messages.error(request, "Vendor profile not found.")
         return redirect("vendor_signup")
 
-    stores = Store.objects.filter(vendor=request.user.vendor_profile)
+    stores = Store.objects.filter(vendor=vendor_profile)
     return render(request, "shop/vendor_store_list.html", {"stores": stores})
 
 
 @login_required
 def create_store(request):
     """Create a new store for the vendor."""
-    if not hasattr(request.user, "vendor_profile"):
+    vendor_profile = get_vendor_profile(request.user)
+    if vendor_profile is None:
         messages.error(request, "Vendor profile not found.")
         return redirect("vendor_signup")
 
@@ -43,7 +59,7 @@ def create_store(request):
             return redirect("create_store")
 
         Store.objects.create(
-            vendor=request.user.vendor_profile,
+            vendor=vendor_profile,
             name=name
         )
 
@@ -59,7 +75,7 @@ def update_store(request, store_id):
     store = get_object_or_404(
         Store,
         id=store_id,
-        vendor=request.user.vendor_profile
+        vendor=get_vendor_profile(request.user)
     )
 
     if request.method == "POST":
@@ -83,7 +99,7 @@ def delete_store(request, store_id):
     store = get_object_or_404(
         Store,
         id=store_id,
-        vendor=request.user.vendor_profile
+        vendor=get_vendor_profile(request.user)
     )
 
     if request.method == "POST":
@@ -98,101 +114,98 @@ def delete_store(request, store_id):
 # -----------------------------
 
 
-def product_list(request):
-    """Display list of all products."""
-    products = Product.objects.all()
-    return render(request, 'shop/product_list.html', {'products': products})
+async def _alist(queryset):
+    """Evaluate a queryset with the async ORM and return a list."""
+    return [obj async for obj in queryset]
+
 
+async def product_list(request):
+    """Display list of all products, optionally sorted by popularity."""
+    sort = request.GET.get('sort', '')
+    products = await _alist(
+        sort_by_popularity(Product.objects.all(), sort))
+    # Template rendering touches the session (user, messages), which is
+    # still sync-only, so only that part runs in the sync thread.
+    return await sync_to_async(render)(
+        request, 'shop/product_list.html',
+        {'products': products, 'sort': sort})
 
-def product_detail(request, product_id):
+
+async def product_detail(request, product_id):
     """Display product details and reviews."""
-    product = get_object_or_404(Product, id=product_id)
-    reviews = product.reviews.all()
-    average_rating = reviews.aggregate(avg=Avg('rating'))['avg']
+    product = await Product.objects.filter(id=product_id).afirst()
+    if product is None:
+        raise Http404("No Product matches the given query.")
+
+    # Django runs async ORM calls one at a time on its single
+    # thread-sensitive executor, so these are awaited in turn.
+    user = await request.auser()
+    reviews = Review.objects.filter(
+        product_id=product_id).select_related('user')
+    review_list = await _alist(reviews)
+    rating = await reviews.aaggregate(avg=Avg('rating'))
+    user_has_reviewed = (user.is_authenticated
+                         and await reviews.filter(user=user).aexists())
+    recommendations = await _alist(get_recommendations(product_id))
+
+    average_rating = rating['avg']
     average_rating = round(average_rating, 1) if average_rating else None
 
-    user_has_reviewed = False
-    if request.user.is_authenticated:
-        user_has_reviewed = reviews.filter(user=request.user).exists()
-
-    return render(request, 'shop/product_detail.html', {
-        'product': product,
-        'reviews': reviews,
-        'average_rating': average_rating,
-        'user_has_reviewed': user_has_reviewed,
-    })
+    return await sync_to_async(render)(
+        request, 'shop/product_detail.html', {
+            'product': product,
+            'reviews': review_list,
+            'average_rating': average_rating,
+            'user_has_reviewed': user_has_reviewed,
+            'recommendations': [r.recommended for r in recommendations],
+        })
 
 
 # -----------------------------
 # CART / ORDER
 # -----------------------------
 
-@login_required
 def view_cart(request):
-    """Display user's cart items."""
-    cart_items = OrderItem.objects.filter(order__buyer=request.user,
-                                          order__status='pending')
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    """Display the cart for a guest or logged-in buyer."""
+    cart = get_cart(request)
+    cart_items = cart.items()
+    total = cart.total(cart_items)
     return render(request, 'shop/cart.html',
                   {'cart_items': cart_items, 'total': total})
 
 
-@login_required
 def add_to_cart(request, product_id):
     """Add a product to the buyer's cart."""
-
     product = get_object_or_404(Product, id=product_id)
-
-    # Get or create pending order
-    order, created = Order.objects.get_or_create(
-        buyer=request.user,
-        status='pending'
-    )
-
-    # Get or create order item
-    order_item, created = OrderItem.objects.get_or_create(
-        order=order,
-        product=product,
-        defaults={
-            'quantity': 1,
-            'price': product.price
-            }
-    )
-
-    if not created:
-        order_item.quantity += 1
-        order_item.save()
+    try:
+        get_cart(request).add(product)
+    except (InsufficientStock, CartFull) as exc:
+        messages.error(request, str(exc))
+        return redirect('product_detail', product_id=product.id)
+    logger.debug("added to cart", extra={'product_id': product.id})
 
     messages.success(request, "Product added to cart.")
     return redirect('view_cart')
 
 
-@login_required
 def increase_quantity(request, item_id):
     """Increase quantity of an item in the cart."""
-    item = get_object_or_404(OrderItem, id=item_id, order__buyer=request.user)
-    item.quantity += 1
-    item.save()
+    try:
+        get_cart(request).increase(item_id)
+    except InsufficientStock as exc:
+        messages.error(request, str(exc))
     return redirect('view_cart')
 
 
-@login_required
 def decrease_quantity(request, item_id):
     """Decrease quantity of an item in the cart."""
-    item = get_object_or_404(OrderItem, id=item_id, order__buyer=request.user)
-    if item.quantity > 1:
-        item.quantity -= 1
-        item.save()
-    else:
-        item.delete()
+    get_cart(request).decrease(item_id)
     return redirect('view_cart')
 
 
-@login_required
 def remove_from_cart(request, item_id):
     """Remove an item from the cart."""
-    item = get_object_or_404(OrderItem, id=item_id, order__buyer=request.user)
-    item.delete()
+    get_cart(request).remove(item_id)
     return redirect('view_cart')
 
 
@@ -204,10 +217,25 @@ def checkout(request):
         messages.warning(request, "Your cart is empty.")
         return redirect('product_list')
 
-    order.status = 'processing'
-    order.total_price = sum(
-        item.product.price * item.quantity for item in order.items.all())
-    order.save()
+    try:
+        with transaction.atomic():
+            commit_order(order)
+            order.status = 'processing'
+            order.placed_at = timezone.now()
+            order.total_price = sum(
+                item.product.price * item.quantity
+                for item in order.items.select_related('product'))
+            order.save()
+            refresh_for_order(order)
+    except InsufficientStock as exc:
+        logger.info("checkout refused: insufficient stock",
+                    extra={'order_id': order.id, 'detail': str(exc)})
+        messages.error(request, str(exc))
+        return redirect('view_cart')
+    logger.info("order placed",
+                extra={'order_id': order.id, 'buyer_id': request.user.id,
+                       'total': str(order.total_price)})
+    record_order(order)
 
     subject = f"Invoice for Order #{order.id}"
     message = render_to_string('shop/email_invoice.html',
@@ -223,10 +251,13 @@ def checkout(request):
 
 @login_required
 def order_history(request):
-    """Display past orders for the user."""
-    orders = Order.objects.filter(
-        buyer=request.user).exclude(status='pending').order_by('-created_at')
-    return render(request, 'shop/order_history.html', {'orders': orders})
+    """Display past orders for the user, a page at a time."""
+    before = archive.decode_history_cursor(request.GET.get('before', ''))
+    orders, next_before = archive.order_history(request.user, before)
+    next_cursor = (archive.encode_history_cursor(next_before)
+                   if next_before else None)
+    return render(request, 'shop/order_history.html',
+                  {'orders': orders, 'next_cursor': next_cursor})
 
 
 # -----------------------------
@@ -251,11 +282,7 @@ def submit_review(request, product_id):
                 request, "You have already reviewed this product.")
             return redirect('product_detail', product_id=product.id)
 
-        purchased = OrderItem.objects.filter(
-            order__buyer=request.user,
-            order__status__in=['processing', 'shipped', 'completed'],
-            product=product
-        ).exists()
+        purchased = archive.has_purchased(request.user, product)
 
         Review.objects.create(
             product=product,
@@ -321,11 +348,11 @@ def vendor_signup(request):
 def vendor_dashboard(request):
     """Vendor dashboard overview."""
 
-    if not hasattr(request.user, "vendor_profile"):
+    vendor_profile = get_vendor_profile(request.user)
+    if vendor_profile is None:
         messages.error(request, "Vendor profile not found.")
         return redirect("vendor_signup")
 
-    vendor_profile = request.user.vendor_profile
     stores = Store.objects.filter(vendor=vendor_profile)
     products = Product.objects.filter(store__in=stores)
 
@@ -341,12 +368,11 @@ def add_product(request):
     """Add a new product for the vendor."""
 
     # Ensure user is a vendor
-    if not hasattr(request.user, 'vendor_profile'):
+    vendor_profile = get_vendor_profile(request.user)
+    if vendor_profile is None:
         messages.error(request, "You must complete vendor signup first.")
         return redirect('vendor_signup')
 
-    vendor_profile = request.user.vendor_profile
-
     # Get all stores for this vendor
     stores = vendor_profile.stores.all()
     if not stores.exists():
@@ -382,8 +408,11 @@ def add_product(request):
 @login_required
 def edit_product(request, product_id):
     """Edit an existing product for the vendor."""
-    product = get_object_or_404(Product, id=product_id)
-    if product.store.vendor != request.user.vendor_profile:
+    product = get_object_or_404(Product.objects.select_related('store'),
+                                id=product_id)
+    vendor_profile = get_vendor_profile(request.user)
+    if (vendor_profile is None
+            or product.store.vendor_id != vendor_profile.id):
         messages.error(request, "Not authorized.")
         return redirect('product_list')
 
@@ -401,8 +430,11 @@ def edit_product(request, product_id):
 @login_required
 def delete_product(request, product_id):
     """Delete a product for the vendor."""
-    product = get_object_or_404(Product, id=product_id)
-    if product.store.vendor != request.user.vendor_profile:
+    product = get_object_or_404(Product.objects.select_related('store'),
+                                id=product_id)
+    vendor_profile = get_vendor_profile(request.user)
+    if (vendor_profile is None
+            or product.store.vendor_id != vendor_profile.id):
         messages.error(request, "Not authorized to delete this product.")
         return redirect('product_list')
 
@@ -412,3 +444,19 @@ def delete_product(request, product_id):
         return redirect('vendor_dashboard')
 
     return render(request, 'shop/delete_product.html', {'product': product})
+
+
+# -----------------------------
+# OPERATIONS: PROMETHEUS METRICS
+# -----------------------------
+
+def metrics_view(request):
+    """Prometheus scrape endpoint (allowed IPs and staff only)."""
+    allowed = request.META.get('REMOTE_ADDR') in getattr(
+        settings, 'METRICS_ALLOWED_IPS', ())
+    if not (allowed or request.user.is_staff):
+        raise Http404
+    body = metrics.render(metrics.collected(), metrics.queue_depths())
+    return HttpResponse(body,
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')